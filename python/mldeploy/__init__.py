@@ -19,4 +19,6 @@ from .mldeploy_functions import (
     undeploy,
     status,
     update,
+    gc,
+    lock,
 )
@@ -7,7 +7,8 @@
 #
 #
 # The CLI is built using the following packages:
-#   - boto3: Python SDK for AWS
+#   - ruamel.yaml: CloudFormation templates (through the 'utils' loaders)
+#   - boto3: Python SDK for AWS (imported when a stack is deployed or removed)
 # -----------------------------------------------------------------------------
 # Author: kingfischer16 (https://github.com/kingfischer16/mldeploy)
 # =============================================================================
@@ -15,25 +16,39 @@
 # =============================================================================
 # Imports.
 # -----------------------------------------------------------------------------
-import boto3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import copy
 from datetime import datetime
-import json
-import ruamel.yaml as ryml  # Allows modification of YAML file without disrupting comments.
+import hashlib
 import os
-from typing import NoReturn, Dict
+import random
+import re
+import sys
+import threading
+import time
+from typing import Any, Callable, NoReturn, Dict, Iterator, List, Tuple
 from .utils import (
     _add_field_to_registry,
     _get_field_if_exists,
-    _add_field_to_registry,
+    _registry_transaction,
+    _RegistryTransaction,
     _get_project_folder,
+    _get_project_config,
     _add_salt,
     _get_constant,
+    _dump_yaml,
+    _load_yaml_cached,
+    _trace_span,
+    _traced,
 )
 
 
 # =============================================================================
 # CloudFormation template creation function, top level.
 # -----------------------------------------------------------------------------
+@_traced()
 def _add_cloudformation_template(name: str) -> NoReturn:
     """
     Adds the CloudFormation template to the configuration folder.
@@ -51,16 +66,16 @@ def _add_cloudformation_template(name: str) -> NoReturn:
         )
     else:
         _create_cloudformation_file(name)
-        _add_project_s3_bucket(name)
-        _add_ec2_instance(name)
 
 
 # =============================================================================
 # Architecture setup.
 # -----------------------------------------------------------------------------
+@_traced()
 def _create_cloudformation_file(name: str) -> NoReturn:
     """
-    Creates and registers a CloudFormation JSON file.
+    Builds the project's CloudFormation template in memory, writes it
+    once and registers it.
 
     Args:
         name (str): Name of the project to create the cloudformation file.
@@ -75,23 +90,64 @@ def _create_cloudformation_file(name: str) -> NoReturn:
         raise FileExistsError(
             f"A CloudFormation template already exists at the location: {cf_filename}"
         )
-    template_desc = f"CloudFormation template generated by MLDEPLOY for {name} project."
-    file_contents = {
-        "AWSTemplateFormatVersion": "2010-09-09",
-        "Description": template_desc,
-        "Resources": {},
-        "Parameters": {},
-        "Mappings": {},
-        "Metadata": {},
-    }
-    yaml_obj = ryml.YAML()
-    with open(cf_filename, "w") as f:
-        yaml_obj.dump(file_contents, f)
+    template = _build_cloudformation_template(name)
+    with _trace_span("cloudformation.write", path=cf_filename):
+        template.write(cf_filename)
     # Register the CloudFormation template file in the registry.
     _add_field_to_registry(
         name, _get_constant("CLOUDFORMATION_LOCATION_KEY"), cf_filename
     )
-    # Register a project hash, for ensuring
+
+
+def _build_cloudformation_template(name: str) -> "_TemplateBuilder":
+    """
+    Assembles the project's CloudFormation template from the project
+    configuration and the 'cloudformation-fragments' it lists.
+
+    Args:
+        name (str): The project name.
+
+    Returns:
+        (_TemplateBuilder): The assembled template.
+    """
+    template = _TemplateBuilder(
+        f"CloudFormation template generated by MLDEPLOY for {name} project."
+    )
+    _add_project_s3_bucket(name, template)
+    _add_ec2_instance(name, template)
+    for fragment in _get_project_config(name).cloudformation_fragments:
+        template.add_fragment(_load_deploy_template(fragment), {"ProjectName": name})
+    return template
+
+
+def _render_cloudformation_template(name: str) -> str:
+    """
+    Renders the project's CloudFormation template from its current
+    configuration and returns the text. The template file is replaced
+    atomically if the text changed, and registered if it was not yet.
+
+    Args:
+        name (str): The project name.
+    """
+    template = _build_cloudformation_template(name)
+    text = template.to_yaml()
+    cf_filename = _get_field_if_exists(
+        name, _get_constant("CLOUDFORMATION_LOCATION_KEY")
+    )
+    if cf_filename == "(None)":
+        proj_folder = _get_field_if_exists(name, _get_constant("PROJ_FOLDER_KEY"))
+        cf_filename = proj_folder + "/" + _get_constant("CLOUDFORMATION_FILE_NAME")
+        _add_field_to_registry(
+            name, _get_constant("CLOUDFORMATION_LOCATION_KEY"), cf_filename
+        )
+    current = None
+    if os.path.exists(cf_filename):
+        with open(cf_filename, "r") as f:
+            current = f.read()
+    if current != text:
+        with _trace_span("cloudformation.write", path=cf_filename):
+            template.write(cf_filename)
+    return text
 
 
 def _create_stack_id(name: str) -> str:
@@ -108,54 +164,157 @@ def _create_stack_id(name: str) -> str:
     return name + "_" + dt_string
 
 
-def _add_project_s3_bucket(name: str) -> NoReturn:
+def _add_project_s3_bucket(name: str, template: "_TemplateBuilder") -> NoReturn:
     """
-    Adds a project bucket to the CloudFormation file with the naming
+    Adds a project bucket to the CloudFormation template with the naming
     convention:
-        mldeploy_store_<project name>_<date>
+        <project name>-store-<salt>
 
     Args:
         name (str): Name of the project for which to create the bucket.
+
+        template (_TemplateBuilder): The template being built.
     """
-    cf_data = _get_cloudformation_template_data(name)
-    cf_data["Resources"][f"{_get_constant('S3_STORE_PREF')}{name}"] = {
-        "Type": "AWS::S3::Bucket",
-        "Properties": {
-            "BucketName": f"{name}-store-{_get_field_if_exists(name, _get_constant('SALT_KEY'))}"
+    template.add_resource(
+        f"{_get_constant('S3_STORE_PREF')}{name}",
+        {
+            "Type": "AWS::S3::Bucket",
+            "Properties": {
+                "BucketName": f"{name}-store-{_get_field_if_exists(name, _get_constant('SALT_KEY'))}"
+            },
         },
-    }
-    _update_cloudformation_template_data(name, cf_data)
+    )
 
 
-def _add_ec2_instance(name: str) -> NoReturn:
+def _add_ec2_instance(name: str, template: "_TemplateBuilder") -> NoReturn:
     """
     Sample function. Adds EC2 instance.
     """
-    cf_data = _get_cloudformation_template_data(name)
-    cf_data["Resources"][f"EC2{name}01"] = {
-        "Type": "AWS::EC2::Instance",
-        "Properties": {
-            "InstanceType": "t3.micro",
-            "ImageId": "ami-02cb52d7ba9887a93",
-            "AvailabilityZone": "eu-north-1a",
+    config = _get_project_config(name)
+    template.add_resource(
+        f"EC2{name}01",
+        {
+            "Type": "AWS::EC2::Instance",
+            "Properties": {
+                "InstanceType": "t3.micro",
+                "ImageId": "ami-02cb52d7ba9887a93",
+                "AvailabilityZone": f"{config.aws_region}a",
+            },
         },
-    }
-    _update_cloudformation_template_data(name, cf_data)
+    )
 
 
 # =============================================================================
 # CloudFormation template manipulations.
 # -----------------------------------------------------------------------------
-def _get_cloudformation_template_data(name: str) -> Dict:
+# The template is assembled in memory and written once. Fragments from the
+# 'deploy_templates' folder are parsed once per process with the round-trip
+# loader, which keeps intrinsic function tags such as '!Sub' and '!GetAtt',
+# and are copied before they are merged.
+class _TemplateBuilder:
+    """
+    A CloudFormation template assembled in memory.
     """
-    Returns the contents of the CloudFormation template file
-    as a Python dictionary.
+
+    SECTIONS = ("Parameters", "Mappings", "Conditions", "Resources", "Outputs")
+
+    def __init__(self, description: str):
+        self.data = {
+            "AWSTemplateFormatVersion": "2010-09-09",
+            "Description": description,
+            "Resources": {},
+            "Parameters": {},
+            "Mappings": {},
+            "Metadata": {},
+        }
+
+    def add_resource(self, logical_id: str, resource: Dict) -> NoReturn:
+        """
+        Adds a resource to the template.
+
+        Raises:
+            ValueError: If a different resource has the same logical ID.
+        """
+        self._add_entry("Resources", logical_id, resource)
+
+    def add_fragment(self, fragment: Dict, parameter_defaults: Dict = None) -> NoReturn:
+        """
+        Merges the sections of a template fragment into the template.
+
+        Args:
+            fragment (dict): Parsed fragment, see '_load_deploy_template'.
+             It is not modified.
+
+            parameter_defaults (dict): Default values for the fragment's
+             parameters, by parameter name.
+
+        Raises:
+            ValueError: If an entry of the fragment clashes with a
+             different entry of the same name.
+        """
+        parameter_defaults = parameter_defaults or {}
+        for section in self.SECTIONS:
+            for key, value in (fragment.get(section) or {}).items():
+                value = copy.deepcopy(value)
+                if section == "Parameters" and key in parameter_defaults:
+                    value["Default"] = parameter_defaults[key]
+                self._add_entry(section, key, value)
+
+    def _add_entry(self, section: str, key: str, value: Any) -> NoReturn:
+        """
+        Adds an entry to a section. Identical duplicates are ignored.
+        Entries are compared as YAML, as tagged values such as '!Ref'
+        do not compare equal to their copies.
+        """
+        entries = self.data.setdefault(section, {})
+        if key in entries and _dump_yaml(entries[key]) != _dump_yaml(value):
+            raise ValueError(
+                f"{_get_constant('FAIL_PREFIX')}CloudFormation template already has a different entry '{key}' in '{section}'."
+            )
+        entries[key] = value
+
+    def to_yaml(self) -> str:
+        """
+        Returns the template as YAML.
+        """
+        return _dump_yaml(self.data)
+
+    def write(self, path: str) -> NoReturn:
+        """
+        Writes the template to 'path', replacing the file at once.
+        """
+        with open(path + ".tmp", "w") as f:
+            f.write(self.to_yaml())
+        os.replace(path + ".tmp", path)
+
+
+def _load_deploy_template(fragment: str) -> Dict:
+    """
+    Returns a parsed template fragment from the 'deploy_templates' folder.
+    The result is shared and must be treated as read-only.
 
     Args:
-        name (str): The project name.
+        fragment (str): File name of the fragment, with or without '.yml'.
 
-    Returns:
-        (dict): The contents of the JSON file as a dictionary.
+    Raises:
+        ValueError: If there is no such fragment.
+    """
+    if not fragment.endswith(".yml"):
+        fragment += ".yml"
+    path = _get_constant("DEPLOY_TEMPLATES_FOLDER") + "/" + fragment
+    if not os.path.isfile(path):
+        raise ValueError(
+            f"{_get_constant('FAIL_PREFIX')}No CloudFormation fragment named '{fragment}' in: {_get_constant('DEPLOY_TEMPLATES_FOLDER')}"
+        )
+    return _load_yaml_cached(path, "rt")
+
+
+def _get_cloudformation_template_path(name: str) -> str:
+    """
+    Returns the path of the project's registered CloudFormation template.
+
+    Args:
+        name (str): The project name.
 
     Raises:
         FileNotFoundError: If the project does not have an associated
@@ -174,102 +333,796 @@ def _get_cloudformation_template_data(name: str) -> Dict:
         raise FileNotFoundError(
             f"Registered CloudFormation tempalate for project '{name}' cannot be found at it's registered location: {cf_filepath}"
         )
-    yaml_obj = ryml.YAML()
-    with open(cf_filepath, "r") as f:
-        data = yaml_obj.load(f)
-    return data
+    return cf_filepath
+
 
+# =============================================================================
+# Nested stack templates.
+# -----------------------------------------------------------------------------
+# The master template and the nested templates it references are uploaded
+# under content-addressed keys, '<prefix><stem>-<hash>.yml'. The master
+# template is rewritten to point at the keys of its nested templates before
+# it is hashed, so any change to a nested template gives a new master key.
+# Keys that already exist in the bucket are not uploaded again.
+_TEMPLATE_REFERENCE = re.compile(r"cloudformation/([\w-]+\.yml)")
 
-def _update_cloudformation_template_data(name: str, data: Dict) -> NoReturn:
+
+def _get_s3_client(region: str = None) -> "botocore.client.S3":
     """
-    Given the name of the project and the Python dictionary of updated contents,
-    this function writes the data to the registered JSON CloudFormation template
-    file path for the specified project.
+    Returns an S3 client. The endpoint can be set with the
+    'MLDEPLOY_S3_ENDPOINT_URL' environment variable to use a local S3
+    stand-in.
+
+    Args:
+        region (str): AWS region name.
+    """
+    import boto3
+
+    return boto3.client(
+        "s3",
+        region_name=region,
+        endpoint_url=os.environ.get(_get_constant("S3_ENDPOINT_ENV_VAR")),
+    )
 
-    Note that this function will overwrite whatever is there with the entire new
-    dictionary, so this function should be used in conjunction with
-    '_get_cloudformation_template_data' to first pull in the current data in
-    the template, modify it, then push it.
+
+def _get_content_key(filename: str, body: bytes) -> str:
+    """
+    Returns the content-addressed object key of a template.
 
     Args:
-        name (str): Project name.
+        filename (str): Template file name.
 
-        data (dict): The data dictionary to use to update the template.
+        body (bytes): Template contents.
     """
-    cf_filepath = _get_field_if_exists(
-        name, _get_constant("CLOUDFORMATION_LOCATION_KEY")
+    stem, extension = os.path.splitext(filename)
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    return f"{_get_constant('S3_TEMPLATE_PREFIX')}{stem}-{digest}{extension}"
+
+
+def _render_nested_templates(
+    master: str = "master.yml", folder: str = None
+) -> Dict[str, Tuple[str, bytes]]:
+    """
+    Renders the master template and the nested templates it references,
+    with the references rewritten to content-addressed keys.
+
+    Args:
+        master (str): File name of the master template.
+
+        folder (str): Folder of the templates. Default is the package's
+         'deploy_templates' folder.
+
+    Returns:
+        (dict): Tuples of (object key, contents) by file name.
+    """
+    folder = folder or _get_constant("DEPLOY_TEMPLATES_FOLDER")
+    with open(folder + "/" + master, "r") as f:
+        master_text = f.read()
+    rendered = {}
+    for filename in sorted(set(_TEMPLATE_REFERENCE.findall(master_text))):
+        with open(folder + "/" + filename, "rb") as f:
+            body = f.read()
+        rendered[filename] = (_get_content_key(filename, body), body)
+    master_body = _TEMPLATE_REFERENCE.sub(
+        lambda m: rendered[m.group(1)][0], master_text
+    ).encode()
+    rendered[master] = (_get_content_key(master, master_body), master_body)
+    return rendered
+
+
+def _list_object_keys(client: "botocore.client.S3", bucket: str, prefix: str) -> set:
+    """
+    Returns the keys of all objects in 'bucket' under 'prefix'.
+    """
+    keys = set()
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = client.list_objects_v2(**kwargs)
+        keys.update(item["Key"] for item in response.get("Contents", []))
+        if not response.get("IsTruncated"):
+            return keys
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+@_traced()
+def _upload_nested_templates(
+    bucket: str,
+    client: "botocore.client.S3" = None,
+    master: str = "master.yml",
+    folder: str = None,
+) -> Tuple[str, List[str]]:
+    """
+    Uploads the master template and its nested templates to 'bucket'.
+    Templates whose content is already in the bucket are skipped, the
+    others are uploaded concurrently through the one client.
+
+    Args:
+        bucket (str): Bucket name.
+
+        client (botocore.client.S3): S3 client. Default is a new client
+         from '_get_s3_client'.
+
+        master (str): File name of the master template.
+
+        folder (str): Folder of the templates, see
+         '_render_nested_templates'.
+
+    Returns:
+        (str, list): Object key of the master template, and the keys that
+         were uploaded.
+    """
+    client = client if client is not None else _get_s3_client()
+    rendered = _render_nested_templates(master, folder)
+    existing = _list_object_keys(client, bucket, _get_constant("S3_TEMPLATE_PREFIX"))
+    missing = sorted(
+        (key, body) for key, body in rendered.values() if key not in existing
     )
-    yaml_obj = ryml.YAML()
-    with open(cf_filepath, "w") as f:
-        yaml_obj.dump(data, f)
+
+    def upload(key: str, body: bytes) -> str:
+        with _trace_span("s3.put_object", key=key):
+            client.put_object(
+                Bucket=bucket, Key=key, Body=body, ContentType="application/x-yaml"
+            )
+        return key
+
+    workers = min(_get_constant("S3_UPLOAD_WORKERS"), max(len(missing), 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        uploaded = list(pool.map(lambda item: upload(*item), missing))
+    print(
+        f"{_get_constant('MSG_PREFIX')}Uploaded {len(uploaded)} of {len(rendered)} templates to '{bucket}', {len(rendered) - len(uploaded)} unchanged."
+    )
+    return rendered[master][0], uploaded
+
+
+# =============================================================================
+# API rate limiting.
+# -----------------------------------------------------------------------------
+# All CloudFormation calls for a region go through one shared client and one
+# token bucket, so concurrent stack operations stay under the API limits.
+# Calls that are throttled anyway are retried with exponential backoff.
+_CFN_CLIENTS = {}
+_CFN_CLIENTS_LOCK = threading.Lock()
+_THROTTLING_CODES = (
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+)
+
+
+class _RateLimiter:
+    """
+    Thread-safe token bucket allowing 'rate' calls per second on average
+    and up to 'burst' calls at once.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> NoReturn:
+        """Blocks until a call is allowed."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _RateLimitedClient:
+    """
+    Wraps a boto3 client so every API call waits for the rate limiter and
+    throttled calls are retried. Other attributes are passed through.
+    """
+
+    def __init__(self, client: Any, limiter: _RateLimiter):
+        self._client = client
+        self._limiter = limiter
+
+    def __getattr__(self, attr: str) -> Any:
+        value = getattr(self._client, attr)
+        if attr not in self._client.meta.method_to_api_mapping:
+            return value
+
+        def call(*args, **kwargs):
+            return self._call(value, *args, **kwargs)
+
+        return call
+
+    def _call(self, method: Callable, *args, **kwargs) -> Any:
+        import botocore.exceptions
+
+        attempts = _get_constant("CFN_API_MAX_ATTEMPTS")
+        for attempt in range(attempts):
+            self._limiter.acquire()
+            try:
+                return method(*args, **kwargs)
+            except botocore.exceptions.ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code not in _THROTTLING_CODES or attempt == attempts - 1:
+                    raise
+            time.sleep(min(2**attempt, 20) * (0.5 + random.random() / 2))
+
+
+def _get_cloudformation_client(region: str) -> _RateLimitedClient:
+    """
+    Returns the shared, rate limited CloudFormation client for a region.
+
+    Args:
+        region (str): AWS region name.
+    """
+    with _CFN_CLIENTS_LOCK:
+        if region not in _CFN_CLIENTS:
+            import boto3
+
+            _CFN_CLIENTS[region] = _RateLimitedClient(
+                boto3.client("cloudformation", region_name=region),
+                _RateLimiter(
+                    _get_constant("CFN_API_RATE"), _get_constant("CFN_API_BURST")
+                ),
+            )
+        return _CFN_CLIENTS[region]
+
+
+# =============================================================================
+# Stack events.
+# -----------------------------------------------------------------------------
+# Stack events are followed with one asyncio task per stack, nested stacks
+# included. Each task polls 'describe_stack_events' in the default thread
+# pool, backs off while its stack is idle and polls quickly again once new
+# events arrive. Events are listed newest first, so a poll pages back until
+# it reaches an event it has already seen.
+class _StackEventFollower:
+    """
+    Follows the events of a stack and its nested stacks until the stack
+    reaches a final status, showing the status of each resource.
+    """
+
+    MIN_INTERVAL = 1.0
+    MAX_INTERVAL = 15.0
+
+    def __init__(
+        self, client: "botocore.client.CloudFormation", stack: str, live: bool = None
+    ):
+        self.client = client
+        self.stack = stack
+        self.live = sys.stdout.isatty() if live is None else live
+        self.seen = set()
+        # Resource rows by (stack ID, logical ID), in the order first seen.
+        self.resources = {}
+        # Display label prefix of each followed stack, by stack ID.
+        self.labels = {}
+        self.since = None
+        self.status = None
+        # Errors that stopped the following of nested stacks, by label.
+        self.errors = {}
+        self._tasks = {}
+        self._drawn = 0
+
+    def skip_existing(self) -> NoReturn:
+        """
+        Marks the current events of the stack as seen. Call this before
+        starting an operation on an existing stack.
+        """
+        events = self.client.describe_stack_events(StackName=self.stack)
+        self.seen.update(e["EventId"] for e in events.get("StackEvents", []))
+
+    def follow(self) -> str:
+        """
+        Follows the stack until it reaches a final status.
+
+        Returns:
+            (str): Final status of the stack.
+        """
+        return asyncio.run(self._follow())
+
+    async def _follow(self) -> str:
+        self._start(self.stack, "")
+        try:
+            await self._tasks[self.stack]
+        finally:
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        return self.status
+
+    def _start(self, stack: str, label: str) -> NoReturn:
+        if stack not in self._tasks:
+            self.labels[stack] = label
+            self._tasks[stack] = asyncio.ensure_future(self._poll(stack))
+            if stack != self.stack:
+                self._tasks[stack].add_done_callback(self._check_nested)
+
+    def _check_nested(self, task: asyncio.Task) -> NoReturn:
+        """
+        Reports an error that stopped the following of a nested stack. The
+        parent stack is still followed to its final status.
+        """
+        if task.cancelled() or task.exception() is None:
+            return
+        stack = next(s for s, t in self._tasks.items() if t is task)
+        label = self.labels[stack].rstrip("/")
+        self.errors[label] = task.exception()
+        print(
+            f"{_get_constant('FAIL_PREFIX')}Stopped following nested stack '{label}': {task.exception()}"
+        )
+
+    async def _poll(self, stack: str) -> NoReturn:
+        """
+        Polls the events of one stack until it reaches a final status.
+        """
+        loop = asyncio.get_event_loop()
+        interval = self.MIN_INTERVAL
+        while True:
+            try:
+                events = await loop.run_in_executor(None, self._get_new_events, stack)
+            except Exception as e:
+                if "does not exist" in str(e) and stack == self.stack:
+                    self.status = "DELETE_COMPLETE"
+                    return
+                if "Throttling" not in str(e) and "Rate exceeded" not in str(e):
+                    raise
+                events = []
+            for event in events:
+                if self._handle(stack, event):
+                    return
+            if len(events) > 0:
+                interval = self.MIN_INTERVAL
+            else:
+                interval = min(interval * 2, self.MAX_INTERVAL)
+            await asyncio.sleep(interval)
+
+    def _get_new_events(self, stack: str) -> List[Dict]:
+        """
+        Returns the unseen events of a stack, oldest first.
+        """
+        kwargs = {"StackName": stack}
+        new_events = []
+        while True:
+            with _trace_span("cloudformation.describe_stack_events", stack=stack):
+                response = self.client.describe_stack_events(**kwargs)
+            for event in response.get("StackEvents", []):
+                if event["EventId"] in self.seen:
+                    return new_events[::-1]
+                new_events.append(event)
+            if "NextToken" not in response:
+                return new_events[::-1]
+            kwargs["NextToken"] = response["NextToken"]
+
+    def _handle(self, stack: str, event: Dict) -> bool:
+        """
+        Processes one new event of a stack.
+
+        Returns:
+            (bool): True if the stack reached a final status.
+        """
+        if event["EventId"] in self.seen:
+            return False
+        self.seen.add(event["EventId"])
+        if self.since is None:
+            self.since = event["Timestamp"]
+        if event["Timestamp"] < self.since:
+            # Events of nested stacks from earlier operations.
+            return False
+        status = event["ResourceStatus"]
+        is_stack = event["ResourceType"] == "AWS::CloudFormation::Stack"
+        is_self = is_stack and (
+            event.get("PhysicalResourceId") == stack
+            or event["LogicalResourceId"] == event.get("StackName")
+        )
+        if is_self and stack != self.stack:
+            # Nested stacks are shown by their row in the parent stack.
+            return _is_final_stack_status(status)
+        row = {
+            "label": self.labels[stack] + event["LogicalResourceId"],
+            "type": event["ResourceType"],
+            "status": status,
+            "reason": event.get("ResourceStatusReason", ""),
+        }
+        self.resources[(stack, event["LogicalResourceId"])] = row
+        nested = event.get("PhysicalResourceId", "")
+        if is_stack and not is_self and nested.startswith("arn:"):
+            self._start(nested, row["label"] + "/")
+        self._show(row)
+        if is_self and _is_final_stack_status(status):
+            self.status = status
+            return True
+        return False
+
+    def _show(self, row: Dict) -> NoReturn:
+        """
+        Shows a status change. A terminal redraws the table of all
+        resources, other output gets one line per event.
+        """
+        if not self.live:
+            reason = f"  {row['reason']}" if row["reason"] else ""
+            print(
+                f"{_get_constant('MSG_PREFIX')}{row['label']}  {row['status']}{reason}"
+            )
+            return
+        lines = [
+            f"\t{r['status']:<36}{r['label']}  ({r['type']})"
+            for r in self.resources.values()
+        ]
+        clear = f"\033[{self._drawn}F\033[J" if self._drawn > 0 else ""
+        sys.stdout.write(clear + "\n".join(lines) + "\n")
+        sys.stdout.flush()
+        self._drawn = len(lines)
+
+    def failures(self) -> List[Dict]:
+        """
+        Returns the resources that failed, with their reasons.
+        """
+        return [r for r in self.resources.values() if r["status"].endswith("_FAILED")]
+
+
+def _is_final_stack_status(status: str) -> bool:
+    """
+    Returns True if a stack with this status is no longer changing.
+    """
+    return not status.endswith("_IN_PROGRESS") and (
+        status.endswith("_COMPLETE") or status.endswith("_FAILED")
+    )
+
+
+def _follow_stack(
+    client: "botocore.client.CloudFormation",
+    stack: str,
+    follower: _StackEventFollower = None,
+) -> bool:
+    """
+    Follows a stack operation to its end and reports the outcome.
+
+    Args:
+        client (botocore.client.CloudFormation): CloudFormation client.
+
+        stack (str): Stack name or ID.
+
+        follower (_StackEventFollower): Follower prepared with
+         'skip_existing', for stacks that existed before the operation.
+
+    Returns:
+        (bool): True if the operation succeeded.
+    """
+    follower = follower or _StackEventFollower(client, stack)
+    status = follower.follow()
+    if "ROLLBACK" in status or status.endswith("_FAILED"):
+        print(f"{_get_constant('FAIL_PREFIX')}Stack '{stack}' ended in {status}.")
+        for row in follower.failures():
+            print(f"\t{row['label']}: {row['reason']}")
+        return False
+    print(f"{_get_constant('MSG_PREFIX')}Stack '{stack}' reached {status}.")
+    return True
 
 
 # =============================================================================
 # Deployment control.
 # -----------------------------------------------------------------------------
-def _deploy_stack(name: str) -> NoReturn:
+@_traced()
+def _deploy_stack(name: str, txn: _RegistryTransaction = None) -> bool:
     """
-    Deploys the stack to AWS for the given project using CloudFormation.
+    Deploys the stack to AWS for the given project using CloudFormation,
+    and follows it until it is created or rolled back.
 
     Args:
         name (str): The project name.
+
+        txn (_RegistryTransaction): Record the deployment in this
+         transaction instead of writing it to the registry right away.
+
+    Returns:
+        (bool): True if the stack was created.
     """
     deployed_status = _get_field_if_exists(name, _get_constant("DEPLOY_STATUS_KEY"))
     if deployed_status == _get_constant("STATUS_DEPLOYED"):
         print(
             f"{_get_constant('FAIL_PREFIX')}Deployment failed for project '{name}. A stack is already deployed for this project."
         )
-        return
+        return False
     # Create stack name.
     stack_name = (
         f"{name}-mldeploy-{_get_field_if_exists(name, _get_constant('SALT_KEY'))}"
     )
-    # Get template.
-    yaml_obj = ryml.YAML()
-    cf_filepath = _get_field_if_exists(
-        name, _get_constant("CLOUDFORMATION_LOCATION_KEY")
-    )
-    with open(cf_filepath, "r") as f:
-        cf_template_yaml = yaml_obj.load(f)
-    cf_template = json.dumps(cf_template_yaml)
+    # Get template. CloudFormation reads YAML templates, so the file is
+    # sent as written.
+    cf_template = _read_cloudformation_template(name)
     # Create client.
-    client = boto3.client("cloudformation")
+    client = _get_cloudformation_client(_get_project_config(name).aws_region)
     # Create stack.
-    d_stack_id = client.create_stack(StackName=stack_name, TemplateBody=cf_template)
+    with _trace_span("cloudformation.create_stack", stack=stack_name):
+        d_stack_id = client.create_stack(StackName=stack_name, TemplateBody=cf_template)
     stack_id = d_stack_id["StackId"]
     print(
         f"{_get_constant('MSG_PREFIX')}Deployment created successfully for project '{name}'.\n\tStack ID: {stack_id}"
     )
-    # Register stack.
-    _register_deployment(name, stack_name, stack_id, deployed=True)
+    # Register stack. A stack that rolls back still has to be removed.
+    _register_deployment(
+        name, stack_name, stack_id, deployed=True, template=cf_template, txn=txn
+    )
+    return _follow_stack(client, stack_id)
 
 
-def _undeploy_stack(name: str) -> NoReturn:
+@_traced()
+def _undeploy_stack(name: str, txn: _RegistryTransaction = None) -> bool:
     """
-    Removes a deployed stack from AWS CloudFormation.
+    Removes a deployed stack from AWS CloudFormation, and follows it until
+    it is deleted.
 
     Args:
         name (str): The project name.
+
+        txn (_RegistryTransaction): Record the removal in this transaction
+         instead of writing it to the registry right away.
+
+    Returns:
+        (bool): True if the stack was deleted.
     """
     deployed_status = _get_field_if_exists(name, _get_constant("DEPLOY_STATUS_KEY"))
     if deployed_status == _get_constant("STATUS_NOT_DEPLOYED"):
         print(
             f"{_get_constant('FAIL_PREFIX')}Undeploy action failed for project '{name}. Project has no stack deployed."
         )
-        return
+        return False
     # Create stack name.
     stack_name = _get_field_if_exists(name, _get_constant("STACK_NAME_KEY"))
+    stack_id = _get_field_if_exists(name, _get_constant("STACK_ID_KEY"))
     # Create client.
-    client = boto3.client("cloudformation")
+    client = _get_cloudformation_client(_get_project_config(name).aws_region)
+    # Deleted stacks can only be followed by stack ID.
+    follower = _StackEventFollower(client, stack_id)
+    follower.skip_existing()
     # Create stack.
-    client.delete_stack(StackName=stack_name)
+    with _trace_span("cloudformation.delete_stack", stack=stack_name):
+        client.delete_stack(StackName=stack_name)
+    if not _follow_stack(client, stack_id, follower):
+        return False
     print(f"{_get_constant('MSG_PREFIX')}Stack removed for project '{name}'.")
     # Register stack.
-    _register_deployment(name, "", "", deployed=False)
+    _register_deployment(name, "", "", deployed=False, txn=txn)
+    return True
+
+
+@_traced()
+def _update_stack(
+    name: str, dry_run: bool = False, client: "botocore.client.CloudFormation" = None
+) -> bool:
+    """
+    Updates the deployed stack of a project to its current template
+    through a change set. The template is rendered again from the project
+    configuration first. Nothing is sent to AWS if the template is the
+    one last deployed, and no change set is created if the deployed stack
+    already has this template. The changes are shown before they are
+    executed, with the resources that would be replaced.
+
+    Args:
+        name (str): The project name.
+
+        dry_run (bool): Only show the changes. The change set is deleted.
+
+        client (botocore.client.CloudFormation): CloudFormation client.
+         Default is a new client for the project's region.
+
+    Returns:
+        (bool): True if the stack was updated, False if there was nothing
+         to update or on a dry run.
+
+    Raises:
+        ValueError: If the project has no stack deployed, an AWS request
+         failed, the change set could not be created, or the update failed.
+    """
+    deployed_status = _get_field_if_exists(name, _get_constant("DEPLOY_STATUS_KEY"))
+    if deployed_status != _get_constant("STATUS_DEPLOYED"):
+        raise ValueError(
+            f"{_get_constant('FAIL_PREFIX')}Update failed for project '{name}'. Project has no stack deployed."
+        )
+    stack_name = _get_field_if_exists(name, _get_constant("STACK_NAME_KEY"))
+    cf_template = _render_cloudformation_template(name)
+    template_hash = _get_template_hash(cf_template)
+    if template_hash == _get_field_if_exists(
+        name, _get_constant("STACK_TEMPLATE_HASH_KEY")
+    ):
+        print(
+            f"{_get_constant('MSG_PREFIX')}No changes to deploy for project '{name}'."
+        )
+        return False
+    if client is None:
+        client = _get_cloudformation_client(_get_project_config(name).aws_region)
+    with _trace_span(
+        "cloudformation.get_template", stack=stack_name
+    ), _client_errors_as_value_errors(stack_name):
+        deployed = client.get_template(StackName=stack_name, TemplateStage="Original")
+    if deployed.get("TemplateBody") == cf_template:
+        print(
+            f"{_get_constant('MSG_PREFIX')}No changes to deploy for project '{name}'."
+        )
+        _add_field_to_registry(
+            name, _get_constant("STACK_TEMPLATE_HASH_KEY"), template_hash
+        )
+        return False
+    change_set_name = "mldeploy-" + datetime.now().strftime("%Y%m%d-%H%M%S")
+    with _trace_span(
+        "cloudformation.create_change_set", stack=stack_name
+    ), _client_errors_as_value_errors(stack_name):
+        client.create_change_set(
+            StackName=stack_name,
+            ChangeSetName=change_set_name,
+            ChangeSetType="UPDATE",
+            TemplateBody=cf_template,
+        )
+        try:
+            changes = _wait_for_change_set(client, stack_name, change_set_name)
+        except BaseException:
+            # Do not leave a failed change set behind on the stack.
+            _delete_change_set(client, stack_name, change_set_name)
+            raise
+    if len(changes) == 0 or dry_run:
+        with _client_errors_as_value_errors(stack_name):
+            client.delete_change_set(
+                StackName=stack_name, ChangeSetName=change_set_name
+            )
+    if len(changes) == 0:
+        print(
+            f"{_get_constant('MSG_PREFIX')}No changes to deploy for project '{name}'."
+        )
+        _add_field_to_registry(
+            name, _get_constant("STACK_TEMPLATE_HASH_KEY"), template_hash
+        )
+        return False
+    print(
+        f"{_get_constant('MSG_PREFIX')}Changes to stack '{stack_name}':\n"
+        + _format_stack_changes(changes)
+    )
+    if dry_run:
+        return False
+    follower = _StackEventFollower(client, stack_name)
+    with _trace_span(
+        "cloudformation.execute_change_set", stack=stack_name
+    ), _client_errors_as_value_errors(stack_name):
+        follower.skip_existing()
+        client.execute_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+    if not _follow_stack(client, stack_name, follower):
+        raise ValueError(
+            f"{_get_constant('FAIL_PREFIX')}Update failed for project '{name}'. See the stack events above."
+        )
+    _add_field_to_registry(
+        name, _get_constant("STACK_TEMPLATE_HASH_KEY"), template_hash
+    )
+    print(f"{_get_constant('MSG_PREFIX')}Stack updated for project '{name}'.")
+    return True
+
+
+@contextmanager
+def _client_errors_as_value_errors(stack_name: str) -> Iterator[None]:
+    """
+    Turns errors returned by AWS into ValueErrors with a FAIL_PREFIX
+    message, so commands can report them without a traceback.
+
+    Args:
+        stack_name (str): Stack the requests are about.
+    """
+    import botocore.exceptions
+
+    try:
+        yield
+    except botocore.exceptions.ClientError as e:
+        raise ValueError(
+            f"{_get_constant('FAIL_PREFIX')}AWS request for stack '{stack_name}' failed: {e}"
+        ) from e
+
+
+def _delete_change_set(
+    client: "botocore.client.CloudFormation", stack_name: str, change_set_name: str
+) -> NoReturn:
+    """
+    Deletes a change set, ignoring errors, e.g. if it was never created.
+    """
+    import botocore.exceptions
+
+    try:
+        client.delete_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+    except botocore.exceptions.ClientError:
+        pass
+
+
+def _wait_for_change_set(
+    client: "botocore.client.CloudFormation", stack_name: str, change_set_name: str
+) -> List[Dict]:
+    """
+    Waits until a change set is created and returns its changes.
+
+    Returns:
+        (list): 'ResourceChange' entries of the change set. Empty if the
+         template causes no changes.
+
+    Raises:
+        ValueError: If the change set could not be created.
+    """
+    import botocore.exceptions
+
+    kwargs = {"StackName": stack_name, "ChangeSetName": change_set_name}
+    try:
+        client.get_waiter("change_set_create_complete").wait(**kwargs)
+    except botocore.exceptions.WaiterError:
+        pass
+    changes = []
+    while True:
+        response = client.describe_change_set(**kwargs)
+        if response["Status"] == "FAILED":
+            reason = response.get("StatusReason", "")
+            if "didn't contain changes" in reason or "No updates" in reason:
+                return []
+            raise ValueError(
+                f"{_get_constant('FAIL_PREFIX')}Could not create change set for stack '{stack_name}': {reason}"
+            )
+        changes.extend(c["ResourceChange"] for c in response.get("Changes", []))
+        if "NextToken" not in response:
+            return changes
+        kwargs["NextToken"] = response["NextToken"]
+
 
+def _format_stack_changes(changes: List[Dict]) -> str:
+    """
+    Formats the resource changes of a change set for display, marking
+    resources that would be replaced.
+
+    Args:
+        changes (list): 'ResourceChange' entries of a change set.
+    """
+    lines = []
+    for change in changes:
+        replacement = change.get("Replacement")
+        note = ""
+        if replacement == "True":
+            note = "  (replaced)"
+        elif replacement == "Conditional":
+            note = "  (may be replaced)"
+        lines.append(
+            f"\t{change['Action']:<8}{change['LogicalResourceId']}  {change['ResourceType']}{note}\n"
+        )
+    return "".join(lines)
+
+
+def _read_cloudformation_template(name: str) -> str:
+    """
+    Returns the text of the project's registered CloudFormation template.
 
+    Args:
+        name (str): The project name.
+    """
+    with open(_get_cloudformation_template_path(name), "r") as f:
+        return f.read()
+
+
+def _get_template_hash(cf_template: str) -> str:
+    """
+    Returns the hash of a template, as recorded for the deployed stack.
+    Stack parameters are not set by mldeploy, so the template defaults
+    are part of the hashed text.
+
+    Args:
+        cf_template (str): Template text.
+    """
+    return hashlib.sha256(cf_template.encode()).hexdigest()
+
+
+@_traced()
 def _register_deployment(
-    name: str, stack_name: str, stack_id: str, deployed: bool
+    name: str,
+    stack_name: str,
+    stack_id: str,
+    deployed: bool,
+    template: str = "",
+    txn: _RegistryTransaction = None,
 ) -> NoReturn:
     """
     Registers or deregisteres the stack ID of the deployment in
@@ -284,12 +1137,26 @@ def _register_deployment(
 
         deployed (bool): Set True if stack is deployed and being registered,
          set False if the stack is being removed and being deregistered.
+
+        template (str): The deployed template text, if deployed.
+
+        txn (_RegistryTransaction): Transaction to record the fields in.
+         Default is a transaction committed right away.
     """
-    _add_field_to_registry(name, _get_constant("STACK_NAME_KEY"), stack_name)
-    _add_field_to_registry(name, _get_constant("STACK_ID_KEY"), stack_id)
+    if txn is None:
+        with _registry_transaction() as txn:
+            _register_deployment(name, stack_name, stack_id, deployed, template, txn)
+        return
     deploy_status = (
         _get_constant("STATUS_DEPLOYED")
         if deployed
         else _get_constant("STATUS_NOT_DEPLOYED")
     )
-    _add_field_to_registry(name, _get_constant("DEPLOY_STATUS_KEY"), deploy_status)
+    txn.set_field(name, _get_constant("STACK_NAME_KEY"), stack_name)
+    txn.set_field(name, _get_constant("STACK_ID_KEY"), stack_id)
+    txn.set_field(name, _get_constant("DEPLOY_STATUS_KEY"), deploy_status)
+    txn.set_field(
+        name,
+        _get_constant("STACK_TEMPLATE_HASH_KEY"),
+        _get_template_hash(template) if deployed else "",
+    )
@@ -14,12 +14,11 @@
 # =============================================================================
 # Imports.
 # -----------------------------------------------------------------------------
-import json
 import os
 import shutil
 from typing import NoReturn
 
-from .utils import (_get_registry_data, _get_registry_path, _get_project_folder,
+from .utils import (_registry_transaction, _get_project_folder,
     _delete_docker_image)
 
 
@@ -56,7 +55,5 @@ def _delete_project_from_registry(name: str) -> NoReturn:
     Args:
         name (str): The name of the project.
     """
-    data = _get_registry_data()
-    data.pop(name, None)
-    with open(_get_registry_path(), 'w') as f:
-        json.dump(data, f)
+    with _registry_transaction() as txn:
+        txn.delete_project(name)
@@ -15,6 +15,7 @@
 # Imports.
 # -----------------------------------------------------------------------------
 import fire  # The python-fire CLI engine.
+import sys
 from typing import NoReturn
 
 from .mldeploy_functions import (
@@ -28,6 +29,10 @@ from .mldeploy_functions import (
     status,
     update,
     undeploy,
+    gc,
+    lock,
+    _pop_trace_option,
+    _command_trace,
 )
 
 
@@ -39,7 +44,21 @@ def main() -> NoReturn:
     The main program function to be packaged for command line.
 
     This function uses python-fire to convert the specified functions
-    into
+    into command line commands.
+
+    Passing '--trace' (or '--trace=<file>') with any command records timed
+    spans for each phase of the command and writes them as a Chrome-trace
+    JSON file, followed by a summary table.
+    """
+    trace_path = _pop_trace_option(sys.argv)
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    with _command_trace(command, trace_path):
+        _fire_commands()
+
+
+def _fire_commands() -> NoReturn:
+    """
+    Dispatches the command line to the matching command function.
     """
     fire.Fire(
         {
@@ -48,6 +67,8 @@ def main() -> NoReturn:
             "cwd": cwd,
             "delete": delete,
             "deploy": deploy,
+            "gc": gc,
+            "lock": lock,
             "ls": ls,
             "status": status,
             "undeploy": undeploy,
@@ -15,29 +15,45 @@
 # =============================================================================
 # Imports.
 # -----------------------------------------------------------------------------
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import docker
+import hashlib
+import json
 import os
-import ruamel.yaml as ryml  # Allows modification of YAML file without disrupting comments.
+import re
+import shlex
 import shutil
-from typing import NoReturn, List, Iterator
+import subprocess
+import tarfile
+import threading
+import time
+from typing import NoReturn, List, Dict, Iterator, Union, Tuple
 
 from .utils import (
+    _get_appdata_folder,
     _get_project_folder,
-    _get_config_data,
+    _get_project_config,
     _add_field_to_registry,
-    _get_registry_data,
+    _get_registry_project,
     _delete_docker_image,
-    _temp_copy_local_files,
-    _remove_temp_files,
     _get_constant,
+    _get_file_digest,
+    _get_tree_digest,
+    _save_file_digest_cache,
+    _read_json_file,
+    _write_json_file,
+    _registry_transaction,
+    _trace_span,
+    _traced,
 )
 
 
 # =============================================================================
 # Dockerfile creation.
 # -----------------------------------------------------------------------------
-def _get_or_create_dockerfile(name: str) -> NoReturn:
+@_traced()
+def _get_or_create_dockerfile(name: str, refresh_base: bool = False) -> NoReturn:
     """
     Gets and moves a custom Dockerfile if it exists, otherwise
     creates a Dockerfile from the configuration files in the
@@ -45,73 +61,287 @@ def _get_or_create_dockerfile(name: str) -> NoReturn:
 
     Args:
         name (str): Project name.
+
+        refresh_base (bool): Pull the base image even if the cached
+         digest has not expired.
     """
     user_dockerfile_found = _get_custom_dockerfile(name)
     if not user_dockerfile_found:
-        _create_dockerfile(name)
+        _create_dockerfile(name, refresh_base=refresh_base)
 
 
-def _create_dockerfile(name: str) -> NoReturn:
+@_traced()
+def _create_dockerfile(name: str, refresh_base: bool = False) -> NoReturn:
     """
     Creates a new Dockerfile for the project.
 
     Currently the base image should contain the Python language
     installation and the Dockerfile creation is used to add
-    files and install Python packages.
+    files and install Python packages. The base image is pinned to its
+    resolved digest. The file is only rewritten if its contents change.
     """
     print(
         f"{_get_constant('MSG_PREFIX')}Building Dockerfile from project configuration."
     )
+    config = _get_project_config(name)
+    client = docker.from_env()
+    base_image = _resolve_base_image(
+        client, config.base_image, config.base_image_ttl, refresh_base
+    )
+    # Projects that were locked stay locked, and the lockfile is kept
+    # up to date with 'requirements.txt'.
+    lockfile = os.path.isfile(_get_lockfile_path(name))
+    if lockfile:
+        _lock_requirements(name, client=client, base_image=base_image)
+    dockerfile = _render_dockerfile(
+        base_image=base_image,
+        code_paths=config.add_files,
+        apt_packages=config.apt_packages,
+        buildkit=config.docker_buildkit,
+        multistage=config.docker_multistage,
+        wheelhouse=config.use_wheelhouse,
+        lockfile=lockfile,
+        slim=config.docker_slim,
+        precompile=config.docker_precompile,
+    )
+    dockerfile_path = _get_project_folder(name) + "/Dockerfile"
+    current = None
+    if os.path.isfile(dockerfile_path):
+        with open(dockerfile_path, "r") as dfile:
+            current = dfile.read()
+    if current != dockerfile:
+        with open(dockerfile_path, "w") as dfile:
+            dfile.write(dockerfile)
 
-    LEND = "\n"  # Line ender for Dockerfile.
-    # List holding the Dockerfile lines in order.
-    dockerfile_list = []
-    code_paths = _get_code_paths(name)
+    # Register Dockerfile.
+    _add_field_to_registry(name, "dockerfile", dockerfile_path)
 
-    # Start building Dockerfile.
-    dockerfile_list.append(f"FROM {_get_base_image_name(name)}{LEND}")
-    dockerfile_list.append(f"RUN apt-get update{LEND}")
 
-    # Create 'app' folder for application files.
-    dockerfile_list.append(f"RUN mkdir -p {_get_constant('APP_DIR_ON_IMAGE')}{LEND}")
+def _render_dockerfile(
+    base_image: str,
+    code_paths: List[str],
+    apt_packages: List[str] = None,
+    buildkit: bool = False,
+    multistage: bool = False,
+    wheelhouse: bool = False,
+    lockfile: bool = False,
+    slim: bool = False,
+    precompile: bool = False,
+) -> str:
+    """
+    Renders the project Dockerfile. Identical arguments always give
+    identical output, so unchanged projects hit the layer cache.
 
-    # Install Git only if needed.
-    if len(code_paths) > 0:
-        if any([c.endswith(".git") for c in code_paths]):
-            dockerfile_list.append(f"RUN apt-get install -y git{LEND}")
+    Instructions are ordered from least to most frequently changed:
+    system packages, Python requirements, git repository snapshots and
+    finally the local project files. Repository snapshots are part of
+    the build context (see '_sync_git_sources'), so git is never
+    installed in the image. With 'multistage' the compilers stay in a
+    builder stage and only the installed packages are copied into the
+    final image. Bytecode is compiled in the final stage, as it holds the
+    paths the files are imported from.
 
-    # Copy 'requirements.txt' file and run.
-    dockerfile_list.append(
-        f"COPY requirements.txt /{_get_constant('APP_DIR_ON_IMAGE')}{LEND}"
-    )
-    dockerfile_list.append(
-        f"RUN pip install -r /{_get_constant('APP_DIR_ON_IMAGE')}/requirements.txt"
+    Args:
+        base_image (str): Base Docker image.
+
+        code_paths (list): Local paths and git repository URLs to add.
+
+        apt_packages (list): Extra system packages to install.
+
+        buildkit (bool): Use BuildKit cache mounts for apt and pip.
+
+        multistage (bool): Use a separate builder stage.
+
+        wheelhouse (bool): Install requirements offline from the
+         'wheelhouse' folder of the build context.
+
+        lockfile (bool): Install from 'requirements.lock' instead of
+         'requirements.txt'.
+
+        slim (bool): Remove bytecode caches and test suites of the
+         installed packages in the install step.
+
+        precompile (bool): Write the bytecode of the installed packages
+         and the project files into the image.
+
+    Returns:
+        (str): Dockerfile contents.
+    """
+    app_dir = "/" + _get_constant("APP_DIR_ON_IMAGE")
+    req_file = _get_constant("LOCKFILE_NAME") if lockfile else "requirements.txt"
+    apt_packages = list(apt_packages or [])
+    repos = [c for c in code_paths if c.endswith(".git")]
+    local_files = [c for c in code_paths if not c.endswith(".git")]
+    lines = []
+    if buildkit:
+        lines.append(_get_constant("DOCKERFILE_SYNTAX"))
+
+    if multistage:
+        lines.append(f"FROM {base_image} AS builder")
+        lines.extend(_apt_install_step(["build-essential"] + apt_packages, buildkit))
+        lines.append(f"COPY {req_file} {app_dir}/")
+        lines.extend(
+            _pip_install_step(
+                f"{app_dir}/{req_file}", buildkit, True, wheelhouse, lockfile, slim
+            )
+        )
+        lines.append("")
+        lines.append(f"FROM {base_image}")
+        lines.extend(_apt_install_step(apt_packages, buildkit))
+        lines.append("COPY --from=builder /install /usr/local")
+        if precompile:
+            lines.extend(_compile_step(_SITE_PACKAGES))
+        lines.append(f"COPY {req_file} {app_dir}/")
+    else:
+        lines.append(f"FROM {base_image}")
+        lines.extend(_apt_install_step(apt_packages, buildkit))
+        lines.append(f"COPY {req_file} {app_dir}/")
+        lines.extend(
+            _pip_install_step(
+                f"{app_dir}/{req_file}", buildkit, False, wheelhouse, lockfile, slim
+            )
+        )
+        if precompile:
+            lines.extend(_compile_step(_SITE_PACKAGES))
+
+    # Repository snapshots only change with a new commit.
+    for repo in repos:
+        folder = _repo_folder(repo)
+        lines.append(f"COPY git/{folder} {app_dir}/{folder}")
+    # Local files change most often, so they are copied last.
+    for code_path in local_files:
+        folder = code_path.rstrip("/").rsplit("/", 1)[-1]
+        lines.append(f"COPY tmp/{folder} {app_dir}/{folder}")
+    if precompile and len(code_paths) > 0:
+        lines.extend(_compile_step(app_dir))
+    return "\n".join(lines) + "\n"
+
+
+def _apt_install_step(packages: List[str], buildkit: bool) -> List[str]:
+    """
+    Returns a single RUN instruction that updates the package lists,
+    installs the packages and leaves no package lists or caches in the
+    layer. Returns no instruction if there are no packages.
+    """
+    if len(packages) == 0:
+        return []
+    install = "apt-get install -y --no-install-recommends " + " ".join(
+        sorted(set(packages))
     )
+    if buildkit:
+        # The caches live in BuildKit mounts and are reused between builds.
+        return [
+            "RUN --mount=type=cache,target=/var/cache/apt,sharing=locked \\",
+            "    --mount=type=cache,target=/var/lib/apt,sharing=locked \\",
+            "    rm -f /etc/apt/apt.conf.d/docker-clean \\",
+            "    && apt-get update \\",
+            f"    && {install}",
+        ]
+    return [
+        "RUN apt-get update \\",
+        f"    && {install} \\",
+        "    && rm -rf /var/lib/apt/lists/*",
+    ]
 
-    # Copy or clone user files.
-    if len(code_paths) > 0:
-        for code_file in code_paths:
-            if code_file.endswith(".git"):
-                code_folder = code_file.rsplit("/", 1)[1].rsplit(".", 1)[0]
-                dockerfile_list.append(
-                    f"RUN git clone {code_file} ./{_get_constant('APP_DIR_ON_IMAGE')}/{code_folder} {LEND}"
-                )
-            else:
-                code_folder = code_file.rsplit("/", 1)[1]
-                dockerfile_list.append(
-                    f"COPY /tmp/{code_file.rsplit('/', 1)[1]} ./{_get_constant('APP_DIR_ON_IMAGE')}/{code_folder}{LEND}"
-                )
 
-    with open(_get_project_folder(name) + "/Dockerfile", "w") as dfile:
-        for line in dockerfile_list:
-            dfile.write(line + LEND)
+# Shell expression for the site-packages folder of the image's Python.
+_SITE_PACKAGES = (
+    '"$(python -c \'import sysconfig; print(sysconfig.get_paths()["purelib"])\')"'
+)
 
-    # Register Dockerfile.
-    _add_field_to_registry(
-        name, "dockerfile", _get_project_folder(name) + "/Dockerfile"
+
+def _pip_install_step(
+    requirements: str,
+    buildkit: bool,
+    prefix: bool,
+    wheelhouse: bool = False,
+    lockfile: bool = False,
+    slim: bool = False,
+) -> List[str]:
+    """
+    Returns the instructions installing the Python requirements. With
+    'prefix' the packages are installed under '/install' so they can be
+    copied out of a builder stage. With 'wheelhouse' nothing is
+    downloaded: pip installs from the wheels in the build context. With
+    'lockfile' the requirements file is a hashed lockfile from
+    '_lock_requirements', which already lists every dependency. With
+    'slim' the installed packages are trimmed in the same RUN, so the
+    removed files never reach a layer.
+    """
+    install = "pip install"
+    if prefix:
+        install += " --prefix=/install"
+    if lockfile:
+        install += " --no-deps"
+    if wheelhouse:
+        install += " --no-index --find-links=/wheelhouse"
+    if not buildkit:
+        # BuildKit keeps the pip cache in a cache mount instead.
+        install += " --no-cache-dir"
+    command = f"{install} -r {requirements}"
+    if wheelhouse and lockfile:
+        # Locally built wheels do not match the index hashes, so the pins
+        # are installed without them. The wheels were built from the
+        # same pins.
+        command = (
+            f"sed 's/ --hash=[^ ]*//g' {requirements} > /tmp/pins.txt \\\n"
+            f"    && {install} -r /tmp/pins.txt"
+        )
+    if slim:
+        command += " \\\n    && " + _slim_command(prefix)
+    if buildkit and wheelhouse:
+        # Bind mounting keeps the wheels out of the image layers.
+        return [
+            "RUN --mount=type=bind,source=wheelhouse,target=/wheelhouse \\",
+            f"    {command}",
+        ]
+    if buildkit:
+        return [
+            "RUN --mount=type=cache,target=/root/.cache/pip \\",
+            f"    {command}",
+        ]
+    if wheelhouse:
+        return [
+            "COPY wheelhouse /wheelhouse",
+            f"RUN {command} \\",
+            "    && rm -rf /wheelhouse",
+        ]
+    return [f"RUN {command}"]
+
+
+def _slim_command(prefix: bool) -> str:
+    """
+    Returns a shell command removing the bytecode caches and test suites
+    of the installed packages. They are not needed to run the project and
+    bytecode is written again on first import.
+
+    Args:
+        prefix (bool): Packages were installed under '/install'.
+    """
+    target = "/install" if prefix else _SITE_PACKAGES
+    return (
+        f"find {target} -depth -type d"
+        " \\( -name __pycache__ -o -name tests \\) -exec rm -rf {} +"
     )
 
 
+def _compile_step(target: str) -> List[str]:
+    """
+    Returns a RUN instruction writing the bytecode of all Python files in
+    'target', so it is not compiled on first import in every new
+    container. Files that do not compile are left as source.
+    """
+    return [f"RUN python -m compileall -q -j 0 {target} || true"]
+
+
+def _repo_folder(repo: str) -> str:
+    """
+    Returns the folder name a git repository is cloned into.
+    """
+    return repo.rsplit("/", 1)[1].rsplit(".", 1)[0]
+
+
+@_traced()
 def _get_custom_dockerfile(name: str) -> bool:
     """
     Returns the path to a custom/user-defined Dockerfile if one has
@@ -125,14 +355,10 @@ def _get_custom_dockerfile(name: str) -> bool:
         (bool): True if a custom Dockerfile is found, False if none is found.
     """
     # Find Dockerfile.
-    data = _get_config_data(name)
-    if "docker-file" in data.keys():
-        docker_file_loc = data["docker-file"]
-        if docker_file_loc is None:
-            return False
-        if not os.path.exists(docker_file_loc):
-            return False
-    else:
+    docker_file_loc = _get_project_config(name).docker_file
+    if docker_file_loc is None:
+        return False
+    if not os.path.exists(docker_file_loc):
         return False
 
     # Copy Dockerfile to project folder.
@@ -152,55 +378,1681 @@ def _get_custom_dockerfile(name: str) -> bool:
 # =============================================================================
 # Docker image creation.
 # -----------------------------------------------------------------------------
-def _build_or_get_image(name: str) -> NoReturn:
+@_traced()
+def _build_or_get_image(
+    name: str, force: bool = False, refresh_base: bool = False
+) -> bool:
     """
     Decides whether to get a user-defined Docker image or to
     build one from the registered Dockerfile.
+
+    Args:
+        name (str): Project name.
+
+        force (bool): Set True to rebuild even if nothing changed since
+         the last build. Default is False.
+
+        refresh_base (bool): Pull the base image even if the cached
+         digest has not expired. Default is False.
+
+    Returns:
+        (bool): True if a new image was built.
     """
-    conf_data = _get_config_data(name)
-    if "docker-image" in conf_data.keys():
-        image_name = conf_data["docker-image"]
-        if image_name is not None:
-            # Register Docker image.
-            print(
-                f"{_get_constant('MSG_PREFIX')}Using user-defined Docker image: {image_name}"
-            )
-            _add_field_to_registry(name, "docker-image", image_name)
-            return
-    _get_or_create_dockerfile(name)
-    _build_docker_image(name)
+    image_name = _get_project_config(name).docker_image
+    if image_name is not None:
+        # Register Docker image.
+        print(
+            f"{_get_constant('MSG_PREFIX')}Using user-defined Docker image: {image_name}"
+        )
+        _add_field_to_registry(name, "docker-image", image_name)
+        return False
+    _get_or_create_dockerfile(name, refresh_base=refresh_base)
+    return _build_docker_image(name, force=force, refresh_base=refresh_base)
 
 
-def _build_docker_image(name: str) -> NoReturn:
+@_traced()
+def _build_docker_image(
+    name: str, force: bool = False, refresh_base: bool = False
+) -> bool:
     """
     Build the docker image from the information in the project
-    folder.
+    folder. The build is skipped if the build inputs hash to the same
+    value as the last build and that image still exists locally.
+
+    Args:
+        name (str): Project name.
+
+        force (bool): Set True to build even if nothing changed. Default
+         is False.
+
+        refresh_base (bool): Let Docker pull the base image. Generated
+         Dockerfiles pin the base image digest, so this only matters for
+         custom Dockerfiles. Default is False.
+
+    Returns:
+        (bool): True if the image was built, False if the build was skipped.
     """
+    client = docker.from_env()
+    base_image = _get_base_image_name(name)
+    git_sources = _sync_git_sources(name)
+    build_hash = _compute_build_hash(
+        name, _get_image_id(client, base_image), git_sources
+    )
+    if not force and _is_build_current(name, build_hash, client):
+        print(
+            f"{_get_constant('MSG_PREFIX')}Docker image is up to date, no changes since last build: {_get_registry_project(name)['docker-image']}"
+        )
+        return False
     print(f"{_get_constant('MSG_PREFIX')}Building Docker image from Dockerfile...")
-    dockerfile_path = _get_registry_data()[name]["dockerfile"]
-    # Clear temp files if any left from previous or failed build.
-    _remove_temp_files(name)
-    # Temporarily copy files to be transferred.
-    _temp_copy_local_files(name)
+    # Collect the build context before removing anything, so that a
+    # missing file fails the build early.
+    context_entries = _get_build_context_entries(name, git_sources)
+    if _get_project_config(name).use_wheelhouse:
+        folder, wheels = _prepare_wheelhouse(name, client, base_image)
+        # The folder entry makes 'COPY wheelhouse' valid without wheels.
+        context_entries.append(("wheelhouse", folder))
+        context_entries.extend(("wheelhouse/" + w, folder + "/" + w) for w in wheels)
+    _check_context_budget(name, context_entries)
     # Remove existing project image if allowed.
     _delete_docker_image(name)
     image_name = _generate_image_name(name)
-    client = docker.from_env()
-    d_image, logs = client.images.build(
-        path=dockerfile_path.rsplit("/", 1)[0],
-        # fileobj=dockerfile_path,
-        tag=image_name,
-        pull=True,
-        rm=True,
-        forcerm=True,
-    )
-    # Delete temporary files after successful build.
-    _remove_temp_files(name)
-    # Register Docker image.
+    context = _BuildContextStream(context_entries)
+    progress = _BuildProgress()
+    logs = []
+    try:
+        with _trace_span("docker.images.build", image=image_name):
+            if _get_project_config(name).docker_buildkit:
+                stream = _stream_buildkit_build(image_name, context, refresh_base)
+            else:
+                stream = client.api.build(
+                    fileobj=context,
+                    custom_context=True,
+                    tag=image_name,
+                    pull=refresh_base,
+                    rm=True,
+                    forcerm=True,
+                    decode=True,
+                )
+            for log in stream:
+                logs.append(log)
+                progress.update(log)
+                if "error" in log:
+                    raise docker.errors.BuildError(log["error"], logs)
+    except Exception as e:
+        context.close()
+        if isinstance(e, docker.errors.BuildError):
+            # Keep the logs of failed builds too.
+            _save_build_logs_to_file(name, logs, progress.finish())
+        if context.error is not None:
+            # The build usually fails first when the context cannot be
+            # written, which hides the real cause.
+            raise context.error from e
+        raise
+    finally:
+        context.close()
+    if context.error is not None:
+        raise context.error
     print(f"{_get_constant('MSG_PREFIX')}Docker image build succeeded: {image_name}")
-    _add_field_to_registry(name, "docker-image", image_name)
+    with open(_get_project_folder(name) + "/Dockerfile", "r") as dfile:
+        report = _get_layer_report(client, image_name, dfile.read())
+    previous = _get_registry_project(name).get(_get_constant("IMAGE_SIZE_KEY"))
+    print(_get_constant("MSG_PREFIX") + _format_layer_report(report, previous), end="")
     # Send logs to file.
-    _save_build_logs_to_file(name, logs)
+    step_log = _save_build_logs_to_file(name, logs, progress.finish(), report)
+    _profile_imports(name, client, image_name, step_log)
+    # Register Docker image, with the hash of the base image used by this build.
+    build_hash = _compute_build_hash(
+        name, _get_image_id(client, base_image), git_sources
+    )
+    with _registry_transaction() as txn:
+        txn.set_field(name, _get_constant("DOCKER_IMAGE_KEY"), image_name)
+        txn.set_field(name, _get_constant("BUILD_HASH_KEY"), build_hash)
+        txn.set_field(name, _get_constant("BUILD_STEP_LOG_KEY"), step_log)
+        txn.set_field(name, _get_constant("IMAGE_SIZE_KEY"), report["size"])
+        txn.set_field(name, _get_constant("IMAGE_SIZE_PREVIOUS_KEY"), previous)
+    # Remove old project images. The build succeeded even if this fails.
+    try:
+        removed, reclaimed = _collect_project_images(name, client)
+    except docker.errors.DockerException as e:
+        print(
+            f"{_get_constant('MSG_PREFIX')}Could not remove old images, run 'mldeploy gc' to retry: {e}"
+        )
+        return True
+    if len(removed) > 0:
+        print(
+            f"{_get_constant('MSG_PREFIX')}Removed {len(removed)} old image(s), up to {reclaimed / 1e6:.1f} MB reclaimed."
+        )
+    return True
+
+
+def _stream_buildkit_build(
+    image_name: str, context: Iterator[bytes], pull: bool = False
+) -> Iterator[Dict]:
+    """
+    Builds the image with BuildKit through the 'docker' command line tool,
+    which is needed for the cache mounts in the Dockerfile. The build
+    context tar is streamed to 'docker build -' on stdin.
+
+    Args:
+        image_name (str): Image name and tag.
+
+        context (iterable): Chunks of the build context tar archive.
+
+        pull (bool): Always pull the base image.
+
+    Yields:
+        (dict): Build log entries, as they are produced, in the same form
+         as the Docker SDK.
+
+    Raises:
+        docker.errors.BuildError: If the build fails.
+    """
+    env = dict(os.environ, DOCKER_BUILDKIT="1")
+    pull_args = ["--pull"] if pull else []
+    proc = subprocess.Popen(
+        ["docker", "build"] + pull_args + ["--progress=plain", "-t", image_name, "-"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=env,
+    )
+
+    def _feed_context():
+        try:
+            for chunk in context:
+                proc.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            proc.stdin.close()
+
+    feeder = threading.Thread(target=_feed_context, daemon=True)
+    feeder.start()
+    logs = []
+    for line in proc.stdout:
+        log = {"stream": line.decode(errors="replace")}
+        logs.append(log)
+        yield log
+    proc.wait()
+    feeder.join()
+    if proc.returncode != 0:
+        raise docker.errors.BuildError(
+            reason=f"'docker build' exited with code {proc.returncode}",
+            build_log=logs,
+        )
+
+
+class _BuildProgress:
+    """
+    Follows the build output while it streams in. Each Dockerfile step is
+    shown as it starts, and its wall time and whether it was served from
+    the layer cache are recorded. Understands the classic builder output
+    ('Step 2/7 : RUN ...') and BuildKit plain progress ('#5 [2/7] RUN ...').
+    """
+
+    CLASSIC_STEP = re.compile(r"^Step (\d+/\d+) : (.*)$")
+    CLASSIC_CACHED = re.compile(r"^ ---> Using cache$")
+    BUILDKIT_STEP = re.compile(r"^#(\d+) \[([\w.-]+ )?(\d+/\d+)\] (.*)$")
+    BUILDKIT_END = re.compile(r"^#(\d+) (CACHED|DONE|ERROR)")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.steps = []
+        # Steps still running, by BuildKit vertex ID ('' for the classic builder).
+        self._open = {}
+
+    def update(self, log: Dict) -> NoReturn:
+        """Processes one build log entry."""
+        for line in str(log.get("stream", "")).splitlines():
+            self._update_line(line.rstrip())
+
+    def _update_line(self, line: str) -> NoReturn:
+        match = self.CLASSIC_STEP.match(line)
+        if match:
+            self._close("")
+            self._open_step("", match.group(1), match.group(2))
+            return
+        if self.CLASSIC_CACHED.match(line) and "" in self._open:
+            self._open[""]["cached"] = True
+            return
+        match = self.BUILDKIT_STEP.match(line)
+        if match:
+            if match.group(1) not in self._open:
+                label = (match.group(2) or "") + match.group(3)
+                self._open_step(match.group(1), label, match.group(4))
+            return
+        match = self.BUILDKIT_END.match(line)
+        if match and match.group(1) in self._open:
+            if match.group(2) == "CACHED":
+                self._open[match.group(1)]["cached"] = True
+            self._close(match.group(1))
+
+    def _open_step(self, key: str, label: str, instruction: str) -> NoReturn:
+        print(f"{_get_constant('MSG_PREFIX')}Step {label}: {instruction}")
+        self._open[key] = {
+            "step": label,
+            "instruction": instruction,
+            "cached": False,
+            "start": time.monotonic(),
+        }
+
+    def _close(self, key: str) -> NoReturn:
+        step = self._open.pop(key, None)
+        if step is None:
+            return
+        step["seconds"] = round(time.monotonic() - step.pop("start"), 3)
+        state = "cached" if step["cached"] else "done"
+        print(
+            f"{_get_constant('MSG_PREFIX')}Step {step['step']} {state} in {step['seconds']:.1f}s"
+        )
+        self.steps.append(step)
+
+    def finish(self) -> List[Dict]:
+        """
+        Closes any running steps and returns the step records.
+        """
+        for key in list(self._open):
+            self._close(key)
+        return self.steps
+
+
+# =============================================================================
+# Build context.
+# -----------------------------------------------------------------------------
+# The build context is streamed to the Docker engine as a tar archive read
+# directly from the project folder and the 'add-files' source paths. Local
+# 'add-files' entries appear in the archive under 'tmp/<name>', which is
+# where the generated Dockerfile copies them from.
+def _get_dockerignore_patterns(name: str) -> List[str]:
+    """
+    Returns the patterns in the project's '.dockerignore' file.
+
+    Args:
+        name (str): Project name.
+    """
+    patterns = []
+    di_file = _get_project_folder(name) + "/.dockerignore"
+    if os.path.exists(di_file):
+        with open(di_file, "r") as f:
+            for line in f:
+                line = line.strip()
+                if len(line) > 0 and not line.startswith("#"):
+                    patterns.append(line)
+    return patterns
+
+
+def _walk_context_files(
+    src: str, prefix: str, matcher: "docker.utils.build.PatternMatcher"
+) -> List[Tuple[str, str]]:
+    """
+    Returns (archive name, source path) for every file below 'src' that is
+    not excluded by the ignore patterns, using the same matching rules as
+    the Docker CLI. Archive names start with 'prefix'.
+    """
+    entries = []
+    for rel_path in sorted(matcher.walk(src)):
+        path = os.path.join(src, rel_path)
+        if not os.path.isdir(path) or os.path.islink(path):
+            entries.append(("/".join([prefix, rel_path]).lstrip("/"), path))
+    return entries
+
+
+@_traced()
+def _get_build_context_entries(
+    name: str, git_sources: Union[Dict[str, Tuple[str, str]], None] = None
+) -> List[Tuple[str, str]]:
+    """
+    Lists the files that make up the Docker build context, honouring the
+    project's '.dockerignore' file.
+
+    Args:
+        name (str): Project name.
+
+        git_sources (dict): Commit SHA and snapshot folder per git
+         repository, from '_sync_git_sources'. Repositories are left out
+         if not given.
+
+    Returns:
+        (list): (archive name, source path) tuples.
+
+    Raises:
+        ValueError: If an 'add-files' entry is neither a file nor a directory.
+    """
+    patterns = _get_dockerignore_patterns(name)
+    matcher = docker.utils.build.PatternMatcher(patterns)
+    # Build logs and the legacy 'tmp' copy folder never belong in the image.
+    project_matcher = docker.utils.build.PatternMatcher(
+        [_get_constant("DOCKER_LOG_FOLDER"), "tmp"] + patterns
+    )
+    entries = list(_walk_context_files(_get_project_folder(name), "", project_matcher))
+    for url, (_, snapshot) in (git_sources or {}).items():
+        entries.extend(
+            _walk_context_files(snapshot, "git/" + _repo_folder(url), matcher)
+        )
+    for src in _get_code_paths(name):
+        if src.endswith(".git"):
+            continue
+        arcname = "tmp/" + src.rstrip("/").rsplit("/", 1)[-1]
+        if os.path.isdir(src):
+            entries.extend(_walk_context_files(src, arcname, matcher))
+        elif os.path.isfile(src):
+            entries.append((arcname, src))
+        else:
+            raise ValueError(
+                f"{_get_constant('FAIL_PREFIX')}Unknown object to copy: {src}"
+            )
+    return entries
+
+
+# Folder names and file extensions that rarely belong in an image, with the
+# ignore pattern suggested for them.
+_CONTEXT_SUGGESTIONS = {
+    "folders": [
+        ".venv",
+        "venv",
+        "env",
+        "__pycache__",
+        ".ipynb_checkpoints",
+        ".pytest_cache",
+        ".mypy_cache",
+        ".tox",
+        "node_modules",
+        ".idea",
+        ".vscode",
+        "data",
+        "dist",
+        "build",
+    ],
+    "extensions": [
+        ".pyc",
+        ".csv",
+        ".parquet",
+        ".h5",
+        ".pkl",
+        ".zip",
+        ".gz",
+        ".tar",
+        ".log",
+    ],
+}
+
+
+def _get_context_report(entries: List[Tuple[str, str]], top: int = 10) -> Dict:
+    """
+    Summarizes the size of a build context.
+
+    Args:
+        entries (list): (archive name, source path) tuples from
+         '_get_build_context_entries'.
+
+        top (int): Number of files and folders to list.
+
+    Returns:
+        (dict): 'total' bytes, 'files' count, the largest 'top_files' and
+         'top_folders' as (archive name, bytes) pairs, and 'suggestions'
+         as (ignore pattern, bytes) pairs.
+    """
+    sizes = []
+    for arcname, src in entries:
+        if os.path.isfile(src) and not os.path.islink(src):
+            sizes.append((arcname, os.path.getsize(src)))
+    folders = {}
+    suggestions = {}
+    for arcname, size in sizes:
+        parts = arcname.split("/")
+        for i in range(1, len(parts)):
+            folder = "/".join(parts[:i])
+            folders[folder] = folders.get(folder, 0) + size
+            if parts[i - 1] in _CONTEXT_SUGGESTIONS["folders"]:
+                pattern = f"**/{parts[i - 1]}"
+                suggestions[pattern] = suggestions.get(pattern, 0) + size
+                break
+        else:
+            ext = os.path.splitext(arcname)[1].lower()
+            if ext in _CONTEXT_SUGGESTIONS["extensions"]:
+                pattern = f"**/*{ext}"
+                suggestions[pattern] = suggestions.get(pattern, 0) + size
+
+    def by_size(item: Tuple[str, int]) -> Tuple[int, str]:
+        return -item[1], item[0]
+
+    return {
+        "total": sum(size for _, size in sizes),
+        "files": len(sizes),
+        "top_files": sorted(sizes, key=by_size)[:top],
+        "top_folders": sorted(folders.items(), key=by_size)[:top],
+        "suggestions": sorted(suggestions.items(), key=by_size),
+    }
+
+
+def _format_context_report(report: Dict) -> str:
+    """
+    Formats a build context report for display.
+
+    Args:
+        report (dict): Report from '_get_context_report'.
+    """
+
+    def mb(size: int) -> str:
+        return f"{size / 1e6:10.2f} MB"
+
+    lines = [
+        f"Build context: {report['files']} files, {mb(report['total']).strip()}",
+        "",
+        "Largest folders:",
+    ]
+    lines.extend(f"\t{mb(size)}  {name}/" for name, size in report["top_folders"])
+    lines.extend(["", "Largest files:"])
+    lines.extend(f"\t{mb(size)}  {name}" for name, size in report["top_files"])
+    if len(report["suggestions"]) > 0:
+        lines.extend(["", "Suggested '.dockerignore' patterns:"])
+        lines.extend(
+            f"\t{mb(size)}  {pattern}" for pattern, size in report["suggestions"]
+        )
+    return "\n".join(lines) + "\n"
+
+
+@_traced()
+def _analyze_build_context(name: str) -> Dict:
+    """
+    Prints a report of what the project's build context contains, using
+    the same ignore rules as the build.
+
+    Args:
+        name (str): Project name.
+
+    Returns:
+        (dict): Report from '_get_context_report'.
+    """
+    entries = _get_build_context_entries(name, _sync_git_sources(name))
+    report = _get_context_report(entries)
+    print(_format_context_report(report))
+    limit = _get_project_config(name).context_size_limit_mb
+    if limit is not None:
+        print(
+            f"Size budget: {report['total'] / 1e6:.2f} MB of {limit:.2f} MB ('context-size-limit-mb')\n"
+        )
+    return report
+
+
+def _check_context_budget(name: str, entries: List[Tuple[str, str]]) -> NoReturn:
+    """
+    Checks the build context against the project's size budget.
+
+    Args:
+        name (str): Project name.
+
+        entries (list): (archive name, source path) tuples.
+
+    Raises:
+        ValueError: If the context is larger than 'context-size-limit-mb'.
+    """
+    limit = _get_project_config(name).context_size_limit_mb
+    if limit is None:
+        return
+    report = _get_context_report(entries)
+    if report["total"] > limit * 1e6:
+        raise ValueError(
+            f"{_get_constant('FAIL_PREFIX')}Build context is {report['total'] / 1e6:.2f} MB, over the {limit:.2f} MB budget set by 'context-size-limit-mb'.\n"
+            + _format_context_report(report)
+        )
+
+
+class _BuildContextStream:
+    """
+    Iterable, file-like tar archive of the build context. A background
+    thread writes the archive into a pipe while the Docker client reads
+    from the other end, so the context is never copied or held in memory.
+
+    Args:
+        entries (list): (archive name, source path) tuples from
+         '_get_build_context_entries'.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, entries: List[Tuple[str, str]]):
+        read_fd, write_fd = os.pipe()
+        self._reader = os.fdopen(read_fd, "rb")
+        self._writer = os.fdopen(write_fd, "wb")
+        self.error = None
+        self._thread = threading.Thread(
+            target=self._write_archive, args=(entries,), daemon=True
+        )
+        self._thread.start()
+
+    def _write_archive(self, entries: List[Tuple[str, str]]) -> NoReturn:
+        """Writes the tar archive to the pipe."""
+        try:
+            with tarfile.open(fileobj=self._writer, mode="w|") as tar:
+                for arcname, src in entries:
+                    tar.add(src, arcname=arcname, recursive=False)
+        except BrokenPipeError:
+            # The reader was closed early, e.g. the build failed.
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self._writer.close()
+            except OSError:
+                pass
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads up to 'size' bytes of the archive."""
+        return self._reader.read(size)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self._reader.read(self.CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self) -> NoReturn:
+        """Closes the stream and waits for the writer thread to finish."""
+        self._reader.close()
+        self._thread.join()
+
+
+# =============================================================================
+# Base image cache.
+# -----------------------------------------------------------------------------
+# The digest each base image resolved to is kept in the application data
+# folder with the time it was resolved. Until the TTL expires, builds use the
+# local copy of that digest without contacting the registry.
+_BASE_IMAGE_LOCK = threading.Lock()
+
+
+def _get_repo_digest(image: "docker.models.images.Image", image_name: str) -> str:
+    """
+    Returns the 'sha256:...' registry digest of a pulled image.
+
+    Args:
+        image (docker.models.images.Image): The pulled image.
+
+        image_name (str): The name the image was pulled by.
+
+    Raises:
+        ValueError: If the image has no registry digest.
+    """
+    repo = image_name.rsplit("@", 1)[0]
+    if ":" in repo.rsplit("/", 1)[-1]:
+        repo = repo.rsplit(":", 1)[0]
+    repo_digests = image.attrs.get("RepoDigests") or []
+    for repo_digest in repo_digests:
+        if repo_digest.rsplit("@", 1)[0] == repo:
+            return repo_digest.rsplit("@", 1)[1]
+    if len(repo_digests) > 0:
+        return repo_digests[0].rsplit("@", 1)[1]
+    raise ValueError(
+        f"{_get_constant('FAIL_PREFIX')}No registry digest for base image: {image_name}"
+    )
+
+
+@_traced()
+def _resolve_base_image(
+    client: docker.DockerClient, base_image: str, ttl: int, refresh: bool = False
+) -> str:
+    """
+    Returns the base image pinned to a digest, e.g.
+    'python:3.8-slim-buster@sha256:...'. The image is only pulled if the
+    cached digest is older than 'ttl' hours, is not available locally,
+    or 'refresh' is set. If the pull fails, a cached digest that is still
+    available locally is used.
+
+    Args:
+        client (docker.DockerClient): Docker client.
+
+        base_image (str): Base image name from the project configuration.
+
+        ttl (int): Hours a resolved digest is used without pulling.
+
+        refresh (bool): Pull even if the cached digest has not expired.
+
+    Returns:
+        (str): The pinned base image reference.
+    """
+    if "@sha256:" in base_image:
+        return base_image
+    cache_path = _get_appdata_folder() + "/" + _get_constant("BASE_IMAGE_CACHE_NAME")
+    with _BASE_IMAGE_LOCK:
+        cache = _read_json_file(cache_path, {})
+        entry = cache.get(base_image)
+        pinned = f"{base_image}@{entry['digest']}" if entry else None
+        fresh = entry is not None and time.time() - entry["resolved"] < ttl * 3600
+        if fresh and not refresh and len(_get_image_id(client, pinned)) > 0:
+            return pinned
+        print(f"{_get_constant('MSG_PREFIX')}Pulling base image: {base_image}")
+        try:
+            with _trace_span("docker.images.pull", image=base_image):
+                image = client.images.pull(base_image)
+        except docker.errors.APIError:
+            if pinned is not None and len(_get_image_id(client, pinned)) > 0:
+                print(
+                    f"{_get_constant('MSG_PREFIX')}Pull failed, using cached base image: {pinned}"
+                )
+                return pinned
+            raise
+        digest = _get_repo_digest(image, base_image)
+        cache[base_image] = {"digest": digest, "resolved": time.time()}
+        _write_json_file(cache_path, cache)
+    return f"{base_image}@{digest}"
+
+
+# =============================================================================
+# Git source cache.
+# -----------------------------------------------------------------------------
+# Git repositories in 'add-files' are kept as bare mirrors in the application
+# data folder and updated with an incremental fetch. Each build resolves the
+# repository to a commit SHA and adds a snapshot of that commit (without
+# history) to the build context, so an unchanged SHA is a layer cache hit.
+_GIT_LOCKS = {}
+_GIT_LOCKS_LOCK = threading.Lock()
+
+
+def _run_git(args: List[str], **kwargs) -> bytes:
+    """
+    Runs a git command and returns its output.
+
+    Raises:
+        ValueError: If the command fails.
+    """
+    try:
+        return subprocess.run(
+            ["git"] + args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            **kwargs,
+        ).stdout
+    except subprocess.CalledProcessError as e:
+        raise ValueError(
+            f"{_get_constant('FAIL_PREFIX')}'git {args[0]}' failed: {e.stderr.decode(errors='replace').strip()}"
+        )
+
+
+def _get_git_cache_folder(url: str) -> str:
+    """
+    Returns the cache folder for a git repository, named after a hash of
+    its URL.
+    """
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    return f"{_get_appdata_folder()}/{_get_constant('GIT_CACHE_FOLDER')}/{key}"
+
+
+@_traced()
+def _update_git_mirror(url: str) -> str:
+    """
+    Creates or incrementally updates the bare mirror of a repository and
+    returns the commit SHA of its default branch. If the fetch fails but a
+    mirror exists, the mirror's last known commit is used.
+
+    Args:
+        url (str): Repository URL.
+
+    Returns:
+        (str): Commit SHA.
+    """
+    mirror = _get_git_cache_folder(url) + "/mirror.git"
+    if not os.path.exists(mirror):
+        print(f"{_get_constant('MSG_PREFIX')}Mirroring git repository: {url}")
+        os.makedirs(os.path.dirname(mirror), exist_ok=True)
+        # Remove what an interrupted or failed clone left behind.
+        shutil.rmtree(mirror + ".tmp", ignore_errors=True)
+        _run_git(["clone", "--mirror", "--quiet", url, mirror + ".tmp"])
+        os.replace(mirror + ".tmp", mirror)
+    else:
+        try:
+            _run_git(["remote", "update", "--prune"], cwd=mirror)
+        except ValueError as e:
+            print(f"{e}\n{_get_constant('MSG_PREFIX')}Using cached mirror of: {url}")
+    return _run_git(["rev-parse", "HEAD^{commit}"], cwd=mirror).decode().strip()
+
+
+@_traced()
+def _get_git_snapshot(url: str, sha: str) -> str:
+    """
+    Returns a folder holding the files of a commit, without history. The
+    snapshot is extracted from the mirror with 'git archive' the first
+    time it is needed. Every call marks the snapshot as used, see
+    '_prune_git_snapshots'.
+
+    Args:
+        url (str): Repository URL.
+
+        sha (str): Commit SHA.
+
+    Returns:
+        (str): Snapshot folder.
+    """
+    cache = _get_git_cache_folder(url)
+    snapshot = f"{cache}/snapshot-{sha}"
+    if os.path.isdir(snapshot):
+        os.utime(snapshot)
+        return snapshot
+    tmp_snapshot = f"{snapshot}.{os.getpid()}.tmp"
+    proc = subprocess.Popen(
+        ["git", "archive", "--format=tar", sha],
+        cwd=cache + "/mirror.git",
+        stdout=subprocess.PIPE,
+    )
+    # Use the safe extraction filter where the Python version has one.
+    filter_kwargs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+            tar.extractall(tmp_snapshot, **filter_kwargs)
+        returncode = proc.wait()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        shutil.rmtree(tmp_snapshot, ignore_errors=True)
+        raise
+    if returncode != 0:
+        shutil.rmtree(tmp_snapshot, ignore_errors=True)
+        raise ValueError(
+            f"{_get_constant('FAIL_PREFIX')}'git archive' failed for {url} at {sha}"
+        )
+    os.replace(tmp_snapshot, snapshot)
+    os.utime(snapshot)
+    return snapshot
+
+
+def _prune_git_snapshots(url: str) -> NoReturn:
+    """
+    Removes the snapshots of a repository except the most recently used
+    ones ('GIT_SNAPSHOTS_KEPT'). Builds read their snapshot while the
+    context is streamed, after the sync, so the previous snapshot is kept
+    for a build that may still be running. Extractions in progress are
+    left alone.
+
+    Args:
+        url (str): Repository URL.
+    """
+    cache = _get_git_cache_folder(url)
+    snapshots = []
+    for entry in os.listdir(cache):
+        if entry.startswith("snapshot-") and not entry.endswith(".tmp"):
+            try:
+                used = os.path.getmtime(f"{cache}/{entry}")
+            except OSError:
+                # Removed by another process meanwhile.
+                continue
+            snapshots.append((used, f"{cache}/{entry}"))
+    snapshots.sort(reverse=True)
+    for _, snapshot in snapshots[_get_constant("GIT_SNAPSHOTS_KEPT") :]:
+        shutil.rmtree(snapshot, ignore_errors=True)
+
+
+def _sync_git_sources(name: str) -> Dict[str, Tuple[str, str]]:
+    """
+    Updates the mirrors of the project's git repositories and prepares a
+    snapshot of each one's current commit.
+
+    Args:
+        name (str): Project name.
+
+    Returns:
+        (dict): (commit SHA, snapshot folder) per repository URL.
+    """
+    sources = {}
+    for url in [c for c in _get_code_paths(name) if c.endswith(".git")]:
+        with _GIT_LOCKS_LOCK:
+            lock = _GIT_LOCKS.setdefault(url, threading.Lock())
+        # Parallel builds of projects sharing a repository use one mirror.
+        with lock:
+            sha = _update_git_mirror(url)
+            sources[url] = (sha, _get_git_snapshot(url, sha))
+            _prune_git_snapshots(url)
+    return sources
+
+
+# =============================================================================
+# Requirements lock.
+# -----------------------------------------------------------------------------
+# 'mldeploy lock' resolves 'requirements.txt' inside the base image into
+# 'requirements.lock': every package pinned to an exact version with the
+# hash of the file pip chose. Lockfiles are cached in the application data
+# folder by a hash of their inputs, so resolving again is only needed when
+# the requirements or the base image change.
+
+# Resolves the requirements given in argv[1] with 'pip install --dry-run
+# --report' and prints the pinned, hashed lines.
+_LOCK_SCRIPT = (
+    "import json, subprocess, sys\n"
+    "with open('/tmp/requirements.txt', 'w') as f:\n"
+    "    f.write(sys.argv[1])\n"
+    "pip = [sys.executable, '-m', 'pip', '--disable-pip-version-check']\n"
+    "subprocess.run(pip + ['install', '--quiet', 'pip>=22.2'],\n"
+    "               check=True, stdout=sys.stderr)\n"
+    "subprocess.run(pip + ['install', '--dry-run', '--ignore-installed', '--quiet',\n"
+    "               '--report', '/tmp/report.json', '-r', '/tmp/requirements.txt'],\n"
+    "               check=True, stdout=sys.stderr)\n"
+    "with open('/tmp/report.json') as f:\n"
+    "    report = json.load(f)\n"
+    "pins = {}\n"
+    "for item in report['install']:\n"
+    "    meta, info = item['metadata'], item['download_info'].get('archive_info', {})\n"
+    "    hashes = info.get('hashes') or dict([info['hash'].split('=', 1)] if 'hash' in info else [])\n"
+    "    if 'sha256' not in hashes:\n"
+    "        sys.exit('No sha256 hash for: ' + meta['name'])\n"
+    "    pins[meta['name'].lower()] = meta['name'] + '==' + meta['version'] + ' --hash=sha256:' + hashes['sha256']\n"
+    "print('LOCK:' + json.dumps([pins[k] for k in sorted(pins)]))\n"
+)
+
+
+def _get_lockfile_path(name: str) -> str:
+    """
+    Returns the path of the project's lockfile.
+    """
+    return _get_project_folder(name) + "/" + _get_constant("LOCKFILE_NAME")
+
+
+def _get_lock_input_hash(name: str, base_image: str) -> str:
+    """
+    Returns the hash of the inputs to a lockfile: the contents of
+    'requirements.txt' and the pinned base image.
+
+    Args:
+        name (str): Project name.
+
+        base_image (str): Base image pinned to a digest.
+    """
+    digest = hashlib.sha256()
+    with open(_get_project_folder(name) + "/requirements.txt", "rb") as f:
+        digest.update(f.read())
+    digest.update(b"\0" + base_image.encode())
+    return digest.hexdigest()
+
+
+def _read_lock_input_hash(path: str) -> Union[str, None]:
+    """
+    Returns the input hash recorded in a lockfile, or None.
+    """
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                if line.startswith("# input-hash: "):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return None
+
+
+@_traced()
+def _lock_requirements(
+    name: str,
+    refresh: bool = False,
+    client: docker.DockerClient = None,
+    base_image: str = None,
+) -> bool:
+    """
+    Writes the project's 'requirements.lock' if it is missing or out of
+    date. A cached lockfile for the same inputs is reused; otherwise the
+    requirements are resolved inside the base image, so the pins and
+    hashes match the platform of the image.
+
+    Args:
+        name (str): Project name.
+
+        refresh (bool): Resolve again even if a cached lockfile exists.
+
+        client (docker.DockerClient): Docker client. Default creates one.
+
+        base_image (str): Base image pinned to a digest. Default resolves
+         the configured base image.
+
+    Returns:
+        (bool): True if the lockfile was written.
+
+    Raises:
+        ValueError: If the project has no 'requirements.txt' or the
+         requirements cannot be resolved.
+    """
+    if not os.path.isfile(_get_project_folder(name) + "/requirements.txt"):
+        raise ValueError(
+            f"{_get_constant('FAIL_PREFIX')}Project '{name}' has no 'requirements.txt' to lock."
+        )
+    client = client if client is not None else docker.from_env()
+    if base_image is None:
+        config = _get_project_config(name)
+        base_image = _resolve_base_image(
+            client, config.base_image, config.base_image_ttl
+        )
+    input_hash = _get_lock_input_hash(name, base_image)
+    lock_path = _get_lockfile_path(name)
+    if not refresh and _read_lock_input_hash(lock_path) == input_hash:
+        return False
+    cache_path = f"{_get_appdata_folder()}/{_get_constant('LOCKFILE_CACHE_FOLDER')}/{input_hash}.lock"
+    if refresh or not os.path.isfile(cache_path):
+        print(f"{_get_constant('MSG_PREFIX')}Resolving requirements in {base_image}...")
+        with open(_get_project_folder(name) + "/requirements.txt", "r") as f:
+            requirements = f.read()
+        try:
+            with _trace_span("docker.containers.run", image=base_image, task="lock"):
+                output = client.containers.run(
+                    base_image,
+                    ["python", "-c", _LOCK_SCRIPT, requirements],
+                    remove=True,
+                )
+        except docker.errors.ContainerError as e:
+            raise ValueError(
+                f"{_get_constant('FAIL_PREFIX')}Could not resolve requirements: {e.stderr.decode(errors='replace').strip() if e.stderr else e}"
+            )
+        pins = json.loads(output.decode().rsplit("LOCK:", 1)[1])
+        lines = [
+            "# This file is generated by 'mldeploy lock' from 'requirements.txt'.",
+            f"# input-hash: {input_hash}",
+            f"# base-image: {base_image}",
+        ] + pins
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(cache_path + ".tmp", cache_path)
+    shutil.copy(cache_path, lock_path)
+    print(f"{_get_constant('MSG_PREFIX')}Requirements locked: {lock_path}")
+    return True
+
+
+# =============================================================================
+# Wheelhouse.
+# -----------------------------------------------------------------------------
+# Wheels for project requirements are built once and kept in the application
+# data folder under 'wheelhouse/<abi>', shared by every project whose base
+# image has the same Python ABI. The folder's index maps each requirement
+# line, together with the pip options it was built with, to the wheel files
+# it needs, including dependencies. Requirements that are not pinned to an
+# exact version are built again once their entry is older than
+# 'WHEELHOUSE_UNPINNED_TTL_HOURS', so they pick up new releases. Builds copy
+# only the needed wheels into the build context and install offline.
+_WHEELHOUSE_LOCK = threading.Lock()
+
+# Prints an ABI key for the Python in the base image.
+_ABI_SCRIPT = (
+    "import platform, sys, sysconfig\n"
+    "print('-'.join([sys.implementation.cache_tag, sysconfig.get_platform(),"
+    " platform.libc_ver()[0] or 'nolibc']).replace('.', '_'))\n"
+)
+
+# Builds wheels for each requirement line given as JSON in argv[1], passing
+# the pip options in argv[2], and prints the wheel files used per line.
+# 'pip wheel' saves every wheel a requirement needs to an empty wheel
+# folder, including wheels it finds in '/wheelhouse', so the contents of
+# that folder are the wheel list. New wheels are then moved to '/wheelhouse'.
+_WHEEL_SCRIPT = (
+    "import json, os, shutil, subprocess, sys, tempfile\n"
+    "reqs, opts = json.loads(sys.argv[1]), json.loads(sys.argv[2])\n"
+    "result = {}\n"
+    "for req in reqs:\n"
+    "    tmp = tempfile.mkdtemp()\n"
+    "    cmd = [sys.executable, '-m', 'pip', 'wheel', '--no-cache-dir',\n"
+    "           '--wheel-dir', tmp, '--find-links', '/wheelhouse']\n"
+    "    out = subprocess.run(cmd + opts + [req], stdout=subprocess.PIPE,\n"
+    "                         stderr=subprocess.STDOUT, universal_newlines=True)\n"
+    "    sys.stderr.write(out.stdout)\n"
+    "    wheels = sorted(w for w in os.listdir(tmp) if w.endswith('.whl'))\n"
+    "    for w in wheels:\n"
+    "        if not os.path.isfile('/wheelhouse/' + w):\n"
+    "            shutil.copy(tmp + '/' + w, '/wheelhouse/' + w + '.tmp')\n"
+    "            os.replace('/wheelhouse/' + w + '.tmp', '/wheelhouse/' + w)\n"
+    "    shutil.rmtree(tmp)\n"
+    "    result[req] = wheels if out.returncode == 0 else None\n"
+    "print('WHEELS:' + json.dumps(result))\n"
+)
+
+
+def _get_wheelhouse_folder(client: docker.DockerClient, base_image: str) -> str:
+    """
+    Returns the wheelhouse folder for the Python ABI of the base image.
+    The ABI is looked up by running the image once and is remembered
+    per image ID.
+
+    Args:
+        client (docker.DockerClient): Docker client.
+
+        base_image (str): Base image name.
+    """
+    root = _get_appdata_folder() + "/" + _get_constant("WHEELHOUSE_FOLDER")
+    abi_path = root + "/" + _get_constant("WHEELHOUSE_ABI_FILE_NAME")
+    image_id = _get_image_id(client, base_image)
+    abis = _read_json_file(abi_path, {})
+    abi = abis.get(image_id)
+    if abi is None:
+        with _trace_span("docker.containers.run", image=base_image, task="abi"):
+            output = client.containers.run(
+                base_image, ["python", "-c", _ABI_SCRIPT], remove=True
+            )
+        abi = output.decode().strip().splitlines()[-1]
+        image_id = _get_image_id(client, base_image)
+        if len(image_id) > 0:
+            abis[image_id] = abi
+            _write_json_file(abi_path, abis)
+    return root + "/" + abi
+
+
+def _read_requirements(name: str) -> Tuple[List[str], List[str]]:
+    """
+    Reads the project's requirements: the pins of 'requirements.lock' if
+    the project is locked, otherwise 'requirements.txt'. Hashes are left
+    out.
+
+    Args:
+        name (str): Project name.
+
+    Returns:
+        (list, list): pip options and requirement lines.
+    """
+    options, requirements = [], []
+    req_path = _get_lockfile_path(name)
+    if not os.path.isfile(req_path):
+        req_path = _get_project_folder(name) + "/requirements.txt"
+    if os.path.isfile(req_path):
+        with open(req_path, "r") as f:
+            for line in f:
+                line = line.split(" #", 1)[0].strip()
+                line = re.sub(r"\s+--hash=\S+", "", line)
+                if len(line) == 0 or line.startswith("#"):
+                    continue
+                if line.startswith("-"):
+                    options.extend(shlex.split(line))
+                else:
+                    requirements.append(line)
+    return options, requirements
+
+
+def _build_wheels(
+    client: docker.DockerClient,
+    base_image: str,
+    folder: str,
+    requirements: List[str],
+    options: List[str],
+) -> Dict:
+    """
+    Builds wheels for the requirements inside the base image, so that
+    they match its Python ABI, and saves them to the wheelhouse folder.
+
+    Returns:
+        (dict): Wheel files per requirement line, None for failures.
+    """
+    run_kwargs = {}
+    if hasattr(os, "getuid"):
+        # Keep the wheels owned by the current user.
+        run_kwargs["user"] = f"{os.getuid()}:{os.getgid()}"
+    with _trace_span("docker.containers.run", image=base_image, task="wheels"):
+        output = client.containers.run(
+            base_image,
+            [
+                "python",
+                "-c",
+                _WHEEL_SCRIPT,
+                json.dumps(requirements),
+                json.dumps(options),
+            ],
+            environment={"HOME": "/tmp"},
+            volumes={folder: {"bind": "/wheelhouse", "mode": "rw"}},
+            remove=True,
+            **run_kwargs,
+        )
+    result = json.loads(output.decode().rsplit("WHEELS:", 1)[1])
+    for req, wheels in result.items():
+        if wheels is not None:
+            result[req] = [w for w in wheels if os.path.isfile(folder + "/" + w)]
+    return result
+
+
+def _is_pinned_requirement(requirement: str) -> bool:
+    """
+    Returns True if a requirement line pins one exact version, e.g.
+    'numpy==1.19.0' or 'pandas[excel]==1.1.0; python_version>"3.6"'.
+    """
+    spec = requirement.split(";", 1)[0].strip()
+    return (
+        re.fullmatch(r"[A-Za-z0-9._\-]+(\[[^\]]*\])?\s*===?\s*[^\s*,]+", spec)
+        is not None
+    )
+
+
+def _is_wheel_entry_current(
+    entry: Union[Dict, None], requirement: str, folder: str, now: float
+) -> bool:
+    """
+    Returns True if a wheelhouse index entry can be used: its wheels are
+    in the folder and, for a requirement that is not pinned, it is not
+    older than 'WHEELHOUSE_UNPINNED_TTL_HOURS'.
+
+    Args:
+        entry (dict, None): Index entry with 'wheels' and 'built' time.
+
+        requirement (str): Requirement line.
+
+        folder (str): Wheelhouse folder.
+
+        now (float): Current time in seconds since the epoch.
+    """
+    if not isinstance(entry, dict):
+        return False
+    if not all(os.path.isfile(folder + "/" + w) for w in entry["wheels"]):
+        return False
+    ttl = _get_constant("WHEELHOUSE_UNPINNED_TTL_HOURS") * 3600
+    return _is_pinned_requirement(requirement) or now - entry["built"] < ttl
+
+
+@_traced()
+def _prepare_wheelhouse(
+    name: str, client: docker.DockerClient, base_image: str
+) -> Tuple[str, List[str]]:
+    """
+    Makes sure the wheelhouse holds wheels for all of the project's
+    requirements, building only the ones not seen before with the same
+    pip options, and unpinned ones whose wheels are out of date.
+
+    Args:
+        name (str): Project name.
+
+        client (docker.DockerClient): Docker client.
+
+        base_image (str): Base image name.
+
+    Returns:
+        (str, list): Wheelhouse folder and the wheel files the project needs.
+
+    Raises:
+        ValueError: If wheels could not be built for a requirement.
+    """
+    folder = _get_wheelhouse_folder(client, base_image)
+    index_path = folder + "/" + _get_constant("WHEELHOUSE_INDEX_NAME")
+    options, requirements = _read_requirements(name)
+    # Index keys include the pip options, e.g. an extra index URL.
+    keys = {r: " ".join(options + [r]) for r in requirements}
+    now = time.time()
+    failed = []
+    with _WHEELHOUSE_LOCK:
+        os.makedirs(folder, exist_ok=True)
+        index = _read_json_file(index_path, {})
+        missing = [
+            r
+            for r in requirements
+            if not _is_wheel_entry_current(index.get(keys[r]), r, folder, now)
+        ]
+        if len(missing) > 0:
+            print(
+                f"{_get_constant('MSG_PREFIX')}Building wheels for {len(missing)} requirement(s)..."
+            )
+            built = _build_wheels(client, base_image, folder, missing, options)
+            for r in missing:
+                if built.get(r) is not None:
+                    index[keys[r]] = {"wheels": built[r], "built": now}
+                elif isinstance(index.get(keys[r]), dict) and all(
+                    os.path.isfile(folder + "/" + w) for w in index[keys[r]]["wheels"]
+                ):
+                    # An unpinned requirement could not be refreshed, e.g.
+                    # offline. Its previous wheels are still valid.
+                    print(
+                        f"{_get_constant('MSG_PREFIX')}Could not refresh wheels for '{r}', using the previous ones."
+                    )
+                else:
+                    failed.append(r)
+            _write_json_file(index_path, index)
+    if len(failed) > 0:
+        raise ValueError(
+            f"{_get_constant('FAIL_PREFIX')}Could not build wheels for: {', '.join(failed)}"
+        )
+    return folder, sorted(
+        set(w for r in requirements for w in index[keys[r]]["wheels"])
+    )
+
+
+# =============================================================================
+# Image garbage collection.
+# -----------------------------------------------------------------------------
+# Every build tags a new '<project>_mldeploy:<timestamp>' image. Old images
+# are removed according to the project's retention policy: an image is kept
+# if it is among the newest 'image-retention-count' images, or younger than
+# 'image-retention-days'. The registered image is never removed.
+def _get_image_created(image: "docker.models.images.Image") -> datetime:
+    """
+    Returns the creation time of an image, in UTC.
+    """
+    return datetime.strptime(image.attrs["Created"][:19], "%Y-%m-%dT%H:%M:%S")
+
+
+def _select_images_to_remove(
+    images: List["docker.models.images.Image"],
+    keep_last: Union[int, None],
+    keep_days: Union[int, None],
+    protected: List[str],
+    now: datetime,
+) -> List["docker.models.images.Image"]:
+    """
+    Applies the retention policy to a project's images.
+
+    Args:
+        images (list): The project's images.
+
+        keep_last (int, None): Number of newest images to keep.
+
+        keep_days (int, None): Keep images younger than this many days.
+
+        protected (list): Tags that are always kept.
+
+        now (datetime): Current UTC time.
+
+    Returns:
+        (list): Images to remove, oldest first.
+    """
+    newest_first = sorted(images, key=_get_image_created, reverse=True)
+    remove = []
+    for i, image in enumerate(newest_first):
+        if keep_last is not None and i < keep_last:
+            continue
+        if keep_days is not None and now - _get_image_created(image) < timedelta(
+            days=keep_days
+        ):
+            continue
+        if any(tag in protected for tag in image.tags):
+            continue
+        remove.append(image)
+    return remove[::-1]
+
+
+@_traced()
+def _collect_project_images(
+    name: str, client: docker.DockerClient = None, dry_run: bool = False
+) -> Tuple[List[str], int]:
+    """
+    Removes the project's old images according to its retention policy.
+    Images are found with a repository filter on the Docker engine, and
+    removed in parallel batches.
+
+    Args:
+        name (str): Project name.
+
+        client (docker.DockerClient): Docker client. Default creates one.
+
+        dry_run (bool): Only report what would be removed.
+
+    Returns:
+        (list, int): Removed image tags and their total size in bytes.
+         Layers shared with kept images are not freed, so the size is an
+         upper bound of the reclaimed space.
+    """
+    client = client if client is not None else docker.from_env()
+    config = _get_project_config(name)
+    repo = _generate_image_name(name).split(":", 1)[0]
+    images = client.images.list(name=repo)
+    protected = [_get_registry_project(name).get(_get_constant("DOCKER_IMAGE_KEY"), "")]
+    remove = _select_images_to_remove(
+        images,
+        config.image_retention_count,
+        config.image_retention_days,
+        protected,
+        datetime.utcnow(),
+    )
+    tags = [t for im in remove for t in im.tags if t.startswith(repo + ":")]
+    reclaimed = sum(im.attrs.get("Size", 0) for im in remove)
+    if dry_run or len(tags) == 0:
+        return tags, reclaimed
+
+    def _remove(tag: str) -> Union[str, None]:
+        try:
+            client.images.remove(tag)
+            return tag
+        except docker.errors.APIError as e:
+            print(f"{_get_constant('FAIL_PREFIX')}Could not remove image '{tag}': {e}")
+            return None
+
+    batch_size = _get_constant("IMAGE_GC_BATCH_SIZE")
+    with _trace_span("docker.images.remove", count=len(tags)):
+        with ThreadPoolExecutor(max_workers=batch_size) as pool:
+            removed = [t for t in pool.map(_remove, tags) if t is not None]
+    reclaimed = sum(
+        im.attrs.get("Size", 0) for im in remove if any(t in removed for t in im.tags)
+    )
+    return removed, reclaimed
+
+
+# =============================================================================
+# Image size report.
+# -----------------------------------------------------------------------------
+# Every instruction after the last FROM adds one entry to the image history,
+# newest first, so the newest entries map to the Dockerfile lines in order.
+# The remaining entries belong to the base image.
+def _get_final_stage_instructions(dockerfile: str) -> List[Tuple[int, str]]:
+    """
+    Returns the instructions of the last stage of a Dockerfile, without
+    its FROM line.
+
+    Args:
+        dockerfile (str): Dockerfile contents.
+
+    Returns:
+        (list): Tuples of (line number, instruction). Continuation lines
+         are joined into their instruction.
+    """
+    instructions = []
+    current = None
+    for number, line in enumerate(dockerfile.splitlines(), start=1):
+        stripped = line.strip()
+        if current is None:
+            if len(stripped) == 0 or stripped.startswith("#"):
+                continue
+            current = (number, "")
+        text = current[1] + " " + stripped.rstrip("\\").strip()
+        current = (current[0], text.strip())
+        if not stripped.endswith("\\"):
+            if current[1].upper().startswith("FROM "):
+                instructions = []
+            else:
+                instructions.append(current)
+            current = None
+    return instructions
+
+
+def _get_layer_report(
+    client: docker.DockerClient, image_name: str, dockerfile: str
+) -> Dict:
+    """
+    Maps the layer sizes in the history of a built image to the lines of
+    the Dockerfile it was built from.
+
+    Args:
+        client (docker.DockerClient): Docker client.
+
+        image_name (str): Built image.
+
+        dockerfile (str): Dockerfile contents.
+
+    Returns:
+        (dict): With 'size' and 'base_size' in bytes, and 'layers', a list
+         of {'line', 'instruction', 'size'} in Dockerfile order.
+    """
+    history = client.api.history(image_name)
+    instructions = _get_final_stage_instructions(dockerfile)
+    count = min(len(instructions), len(history))
+    own = list(reversed(history[:count]))
+    layers = [
+        {"line": line, "instruction": instruction, "size": entry.get("Size", 0)}
+        for (line, instruction), entry in zip(instructions[-count:], own)
+    ]
+    base_size = sum(entry.get("Size", 0) for entry in history[count:])
+    return {
+        "size": base_size + sum(layer["size"] for layer in layers),
+        "base_size": base_size,
+        "layers": layers if count > 0 else [],
+    }
+
+
+def _format_layer_report(report: Dict, previous: Union[int, None] = None) -> str:
+    """
+    Formats a layer report from '_get_layer_report' for display.
+
+    Args:
+        report (dict): Layer report.
+
+        previous (int): Size in bytes of the previous image, if known.
+    """
+    change = ""
+    if previous is not None:
+        change = f", {(report['size'] - previous) / 1e6:+.1f} MB since last build"
+    lines = [
+        f"Image size: {report['size'] / 1e6:.1f} MB (base image {report['base_size'] / 1e6:.1f} MB){change}\n"
+    ]
+    for layer in report["layers"]:
+        instruction = layer["instruction"]
+        if len(instruction) > 60:
+            instruction = instruction[:57] + "..."
+        lines.append(
+            f"\tline {layer['line']:>3}  {layer['size'] / 1e6:9.1f} MB  {instruction}\n"
+        )
+    return "".join(lines)
+
+
+# =============================================================================
+# Import time profile.
+# -----------------------------------------------------------------------------
+# Imports the top level modules imported by the file in argv[1], without
+# running the file itself. Run with '-X importtime' the timings are written
+# to stderr; '__import__' is used because 'importlib.import_module' is not
+# timed. The script first writes a marker line with the modules it is
+# about to import, so the timings of interpreter startup and of the script
+# itself can be told apart from those of the profiled imports. Relative
+# imports are resolved against the folder of the file, which is where a
+# script finds them.
+_IMPORT_MARKER = "mldeploy-imports:"
+_IMPORT_SCRIPT = (
+    "import ast, os, sys\n"
+    "path = sys.argv[1]\n"
+    "sys.path.insert(0, os.path.dirname(path))\n"
+    "with open(path) as f:\n"
+    "    tree = ast.parse(f.read())\n"
+    "modules = []\n"
+    "for node in ast.walk(tree):\n"
+    "    if isinstance(node, ast.Import):\n"
+    "        modules.extend(alias.name for alias in node.names)\n"
+    "    elif isinstance(node, ast.ImportFrom) and node.level <= 1 and node.module:\n"
+    "        modules.append(node.module)\n"
+    "    elif isinstance(node, ast.ImportFrom) and node.level == 1:\n"
+    "        modules.extend(alias.name for alias in node.names)\n"
+    "    elif isinstance(node, ast.ImportFrom):\n"
+    "        sys.stderr.write('Skipped relative import: ' + '.' * node.level + (node.module or '') + '\\n')\n"
+    "modules = list(dict.fromkeys(modules))\n"
+    f"sys.stderr.write('{_IMPORT_MARKER}' + ','.join(modules) + '\\n')\n"
+    "sys.stderr.flush()\n"
+    "for module in modules:\n"
+    "    try:\n"
+    "        __import__(module)\n"
+    "    except Exception as e:\n"
+    "        sys.stderr.write('Could not import ' + module + ': ' + repr(e) + '\\n')\n"
+    "    sys.stderr.flush()\n"
+)
+
+
+def _get_main_file_on_image(name: str) -> Union[str, None]:
+    """
+    Returns the path of the project's 'main-file' in the image, or None if
+    no main file is set. A local path inside one of the 'add-files'
+    folders is mapped to where that folder is copied, any other path is
+    taken relative to the app folder.
+
+    Args:
+        name (str): Project name.
+    """
+    main_file = _get_project_config(name).main_file
+    if main_file is None or len(main_file.strip()) == 0:
+        return None
+    app_dir = "/" + _get_constant("APP_DIR_ON_IMAGE")
+    for code_path in _get_code_paths(name):
+        if code_path.endswith(".git"):
+            continue
+        root = code_path.rstrip("/")
+        if main_file.startswith(root + "/"):
+            folder = root.rsplit("/", 1)[-1]
+            return f"{app_dir}/{folder}/{main_file[len(root) + 1:]}"
+    if main_file.startswith("/"):
+        return main_file
+    return f"{app_dir}/{main_file}"
+
+
+def _parse_import_profile(profile: str) -> List[Dict]:
+    """
+    Parses the output of 'python -X importtime' running '_IMPORT_SCRIPT'
+    into the modules imported directly by the profiled code. Modules
+    imported before the marker line (interpreter startup and the script
+    itself) and modules not named by the profiled imports are left out.
+
+    Args:
+        profile (str): Import time output.
+
+    Returns:
+        (list): Dicts of {'module', 'self_us', 'cumulative_us'}, slowest
+         first.
+    """
+    imports = []
+    targets = None
+    for line in profile.splitlines():
+        if line.startswith(_IMPORT_MARKER):
+            targets = set(filter(None, line[len(_IMPORT_MARKER) :].split(",")))
+            continue
+        if targets is None or not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        module = fields[2][1:].rstrip()
+        # Nested imports are indented below the module importing them.
+        if module.startswith(" "):
+            continue
+        module = module.strip()
+        # 'import a.b' may show up as the parent package 'a'.
+        if module not in targets and not any(
+            t.startswith(module + ".") for t in targets
+        ):
+            continue
+        imports.append(
+            {
+                "module": module,
+                "self_us": int(fields[0]),
+                "cumulative_us": int(fields[1]),
+            }
+        )
+    return sorted(imports, key=lambda i: i["cumulative_us"], reverse=True)
+
+
+@_traced()
+def _profile_imports(
+    name: str, client: docker.DockerClient, image_name: str, step_log: str
+) -> Union[str, None]:
+    """
+    Records an import time profile of the project's main file in the
+    built image, next to the build logs, and shows the slowest imports.
+    Only runs when 'profile-imports' is set in the project configuration.
+    A failed profile does not fail the build.
+
+    Args:
+        name (str): Project name.
+
+        client (docker.DockerClient): Docker client.
+
+        image_name (str): Built image.
+
+        step_log (str): Path of the build step log.
+
+    Returns:
+        (str): Path of the profile, or None if profiling is off, there is
+         no main file, or the profile failed.
+    """
+    if not _get_project_config(name).profile_imports:
+        return None
+    main_file = _get_main_file_on_image(name)
+    if main_file is None:
+        return None
+    try:
+        output = client.containers.run(
+            image_name,
+            ["python", "-X", "importtime", "-c", _IMPORT_SCRIPT, main_file],
+            stdout=False,
+            stderr=True,
+            remove=True,
+        )
+    except (docker.errors.ContainerError, docker.errors.APIError) as e:
+        print(f"{_get_constant('MSG_PREFIX')}Import time profile failed: {e}")
+        return None
+    profile = output.decode(errors="replace")
+    path = step_log.rsplit(".", 1)[0] + "_importtime.txt"
+    with open(path, "w") as f:
+        f.write(profile)
+    lines = [f"Import time of {main_file}:\n"]
+    for entry in _parse_import_profile(profile)[:5]:
+        lines.append(f"\t{entry['cumulative_us'] / 1e6:7.2f}s  {entry['module']}\n")
+    print(_get_constant("MSG_PREFIX") + "".join(lines), end="")
+    return path
+
+
+# =============================================================================
+# Build cache.
+# -----------------------------------------------------------------------------
+def _get_image_id(client: docker.DockerClient, image_name: Union[str, None]) -> str:
+    """
+    Returns the ID of a local Docker image, or an empty string if the
+    image is not available locally.
+
+    Args:
+        client (docker.DockerClient): Docker client.
+
+        image_name (str): Image name and tag.
+    """
+    if image_name is None:
+        return ""
+    try:
+        return client.images.get(image_name).id
+    except docker.errors.ImageNotFound:
+        return ""
+
+
+@_traced()
+def _compute_build_hash(
+    name: str,
+    base_image_id: str,
+    git_sources: Union[Dict[str, Tuple[str, str]], None] = None,
+) -> str:
+    """
+    Computes a content hash over everything that goes into the project
+    image: the Dockerfile, the requirements and lockfile, '.dockerignore', the base
+    image ID, the contents of the local 'add-files' entries and the
+    commit SHA of each git repository.
+
+    Args:
+        name (str): Project name.
+
+        base_image_id (str): ID of the local base image, or '' if missing.
+
+        git_sources (dict): Commit SHA and snapshot folder per git
+         repository, from '_sync_git_sources'. Repositories without one
+         are included by URL.
+
+    Returns:
+        (str): SHA-256 hex digest.
+    """
+    proj_folder = _get_project_folder(name)
+    digest = hashlib.sha256()
+    for fname in [
+        "Dockerfile",
+        "requirements.txt",
+        _get_constant("LOCKFILE_NAME"),
+        ".dockerignore",
+    ]:
+        fpath = proj_folder + "/" + fname
+        file_digest = _get_file_digest(fpath) if os.path.isfile(fpath) else ""
+        digest.update(f"{fname}\0{file_digest}\n".encode())
+    digest.update(f"base-image\0{base_image_id}\n".encode())
+    git_sources = git_sources or {}
+    for code_path in _get_code_paths(name):
+        if code_path.endswith(".git"):
+            entry = git_sources.get(code_path, (code_path,))[0]
+        else:
+            entry = _get_tree_digest(code_path)
+        digest.update(f"add-file\0{code_path}\0{entry}\n".encode())
+    _save_file_digest_cache()
+    return digest.hexdigest()
+
+
+def _is_build_current(name: str, build_hash: str, client: docker.DockerClient) -> bool:
+    """
+    Returns True if the registered image was built from the same inputs
+    and still exists in the local Docker engine.
+
+    Args:
+        name (str): Project name.
+
+        build_hash (str): Hash from '_compute_build_hash'.
+
+        client (docker.DockerClient): Docker client.
+    """
+    reg_data = _get_registry_project(name)
+    if reg_data.get(_get_constant("BUILD_HASH_KEY")) != build_hash:
+        return False
+    reg_image = reg_data.get(_get_constant("DOCKER_IMAGE_KEY"), "")
+    return len(reg_image) > 0 and len(_get_image_id(client, reg_image)) > 0
 
 
 # =============================================================================
@@ -213,11 +2065,7 @@ def _get_base_image_name(name: str) -> str:
     Args:
         name (str): Project name.
     """
-    yaml_obj = ryml.YAML()
-    with open(_get_project_folder(name) + "/config.yml", "r") as f:
-        doc = yaml_obj.load(f)
-    base_docker_image = doc["base-image"]
-    return base_docker_image
+    return _get_project_config(name).base_image
 
 
 def _get_code_paths(name: str) -> List:
@@ -225,15 +2073,7 @@ def _get_code_paths(name: str) -> List:
     Returns the paths of the folders that must be copied or cloned
     into the image.
     """
-    yaml_obj = ryml.YAML()
-    with open(_get_project_folder(name) + "/config.yml", "r") as f:
-        doc = yaml_obj.load(f)
-    file_list = doc["add-files"] if "add-files" in doc.keys() else []
-    if file_list is None:
-        file_list = []
-    else:
-        file_list = [] if all([n is None for n in file_list]) else file_list
-    return file_list
+    return _get_project_config(name).add_files
 
 
 def _generate_image_name(name: str) -> str:
@@ -252,19 +2092,34 @@ def _generate_image_name(name: str) -> str:
 # =============================================================================
 # Docker logging.
 # -----------------------------------------------------------------------------
-def _save_build_logs_to_file(name: str, logs_iter: Iterator[str]) -> NoReturn:
+@_traced()
+def _save_build_logs_to_file(
+    name: str,
+    logs_iter: Iterator[str],
+    steps: Union[List[Dict], None] = None,
+    layers: Union[Dict, None] = None,
+) -> str:
     """
-    Saves the docker build logs to a .txt file.
+    Saves the docker build logs to a .txt file, and the per-step timings
+    and layer sizes to a JSON lines file of the same name.
 
     Args:
         name (str): Project name.
+
+        logs_iter (iterable): Build log entries.
+
+        steps (list): Step records from '_BuildProgress', if any.
+
+        layers (dict): Layer report from '_get_layer_report', if any.
+
+    Returns:
+        (str): Path of the JSON lines step log.
     """
     # Setup file and folder names.
     log_filename = (
         name
         + _get_constant("DOCKER_LOG_FILE_TAG")
         + datetime.now().strftime("%Y%m%d-%H%M%S")
-        + ".txt"
     )
     folder_location = (
         _get_project_folder(name) + "/" + _get_constant("DOCKER_LOG_FOLDER") + "/"
@@ -272,10 +2127,44 @@ def _save_build_logs_to_file(name: str, logs_iter: Iterator[str]) -> NoReturn:
     # Create folder if it does not exist.
     if not os.path.exists(folder_location):
         os.makedirs(folder_location)
-    with open(folder_location + log_filename, "w") as f:
+    with open(folder_location + log_filename + ".txt", "w") as f:
         for log in logs_iter:
             if "stream" in log:
                 f.write(str(log["stream"]))
+    steps = steps if steps is not None else []
+    cached = len([s for s in steps if s["cached"]])
+    seconds = sum(s["seconds"] for s in steps)
+    with open(folder_location + log_filename + ".jsonl", "w") as f:
+        for step in steps:
+            f.write(json.dumps(dict(step, type="step")) + "\n")
+        if layers is not None:
+            for layer in layers["layers"]:
+                f.write(json.dumps(dict(layer, type="layer")) + "\n")
+            f.write(
+                json.dumps(
+                    {
+                        "type": "image",
+                        "size": layers["size"],
+                        "base_size": layers["base_size"],
+                    }
+                )
+                + "\n"
+            )
+        f.write(
+            json.dumps(
+                {
+                    "type": "build",
+                    "steps": len(steps),
+                    "cached": cached,
+                    "seconds": seconds,
+                }
+            )
+            + "\n"
+        )
+    print(
+        f"{_get_constant('MSG_PREFIX')}{len(steps)} build steps, {cached} from cache, {seconds:.1f}s"
+    )
     print(
-        f"{_get_constant('MSG_PREFIX')}View Docker build log: {folder_location}{log_filename}"
+        f"{_get_constant('MSG_PREFIX')}View Docker build log: {folder_location}{log_filename}.txt"
     )
+    return folder_location + log_filename + ".jsonl"
@@ -5,6 +5,10 @@
 #
 # ***This file MAY import from all other 'mldeploy' files.***
 #
+# Only 'utils' is imported at module level. The modules that pull in heavy
+# packages ('aws', 'docker_tools', 'cleanup', 'startup') are imported inside
+# the commands that need them, so light commands like 'ls' start quickly.
+#
 # The CLI is built using the following packages:
 #   - fire: Google-supported, turns functions into CLI
 #   - ruamel.yaml: Edit YAML files without affecting the structure or comments.
@@ -15,22 +19,15 @@
 # =============================================================================
 # Imports.
 # -----------------------------------------------------------------------------
-import fire  # The python-fire CLI engine.
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+import fnmatch
 import os
 import sys
-from typing import NoReturn, Dict
-
-from .aws import _deploy_stack, _undeploy_stack, _add_cloudformation_template
-from .docker_tools import _build_or_get_image
-from .cleanup import _delete_project
-from .startup import (
-    _create_registry_file_if_not_exists,
-    _add_project_to_registry,
-    _create_new_project_folder,
-    _copy_and_update_config,
-    _create_requirements_file,
-    _copy_dockerignore,
-)
+import time
+from typing import NoReturn, Callable, Dict, Iterator, List, Union
+
 from .utils import (
     _get_registry_data,
     _get_field_if_exists,
@@ -39,10 +36,262 @@ from .utils import (
     _get_appdata_folder,
     _get_constant,
     _check_for_project_name_and_exists,
+    _check_project_config,
+    _get_project_config,
+    _find_projects,
     _print_project_status,
+    _RegistryTransaction,
+    _thread_output,
+    _start_tracing,
+    _stop_tracing,
+    _export_trace,
+    _get_trace_summary,
+    _trace_span,
 )
 
 
+# =============================================================================
+# CLI helpers - Not exposed as commands.
+# -----------------------------------------------------------------------------
+def _pop_trace_option(argv: List[str]) -> Union[str, None]:
+    """
+    Removes the '--trace' or '--trace=<file>' option from the command line
+    arguments so it is not passed on to the command.
+
+    Args:
+        argv (list): Command line arguments, modified in place.
+
+    Returns:
+        (str, None): Path for the trace file, or None if tracing was not
+         requested.
+    """
+    for i, arg in enumerate(argv):
+        if arg == "--trace" or arg.startswith("--trace="):
+            argv.pop(i)
+            if "=" in arg:
+                return arg.split("=", 1)[1]
+            return f"mldeploy_trace_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    return None
+
+
+@contextmanager
+def _command_trace(command: str, trace_path: Union[str, None]) -> Iterator[None]:
+    """
+    Traces the command run inside the block if a trace path is given,
+    then writes the Chrome-trace file and prints a summary table.
+
+    Args:
+        command (str): Name of the command being run.
+
+        trace_path (str, None): Path for the trace file. Tracing is off if None.
+    """
+    if trace_path is None:
+        yield
+        return
+    _start_tracing()
+    try:
+        with _trace_span(f"command.{command}"):
+            yield
+    finally:
+        events = _stop_tracing()
+        _export_trace(trace_path, events)
+        print(f"\n{_get_trace_summary(events)}\n")
+        print(f"{_get_constant('MSG_PREFIX')}Trace written to: {trace_path}")
+
+
+def _select_projects(
+    names: List[str],
+    all_projects: bool = False,
+    status: str = "",
+    name_filter: str = "",
+) -> List[str]:
+    """
+    Resolves the projects a multi-project command works on: the named
+    projects, all registered projects, and/or the projects with the given
+    deployment status. Exits if a named project does not exist.
+
+    Args:
+        names (list): Project names.
+
+        all_projects (bool): Select every registered project.
+
+        status (str): Select projects with this deployment status.
+
+        name_filter (str): Keep only projects whose name matches this
+         shell-style pattern, e.g. 'churn-*'. On its own, it selects from
+         all registered projects.
+
+    Returns:
+        (list): Project names, without duplicates, in a stable order.
+    """
+    reg_data = _get_registry_data()
+    missing = [n for n in names if n not in reg_data]
+    if len(missing) > 0:
+        print(
+            f"{_get_constant('FAIL_PREFIX')}Project(s) do not exist: {', '.join(missing)}"
+        )
+        sys.exit(1)
+    selected = list(names)
+    if all_projects or (len(name_filter) > 0 and len(names) == 0 and len(status) == 0):
+        selected.extend(sorted(reg_data.keys()))
+    if len(status) > 0:
+        selected.extend(
+            sorted(_find_projects(_get_constant("DEPLOY_STATUS_KEY"), status))
+        )
+    if len(name_filter) > 0:
+        selected = fnmatch.filter(selected, name_filter)
+    return list(dict.fromkeys(selected))
+
+
+def _build_project(name: str, force: bool, refresh_base: bool) -> str:
+    """
+    Builds one project for a multi-project build.
+
+    Args:
+        name (str): Project name.
+
+        force (bool): Rebuild the image even if nothing changed.
+
+        refresh_base (bool): Pull the base image even if the cached
+         digest has not expired.
+
+    Returns:
+        (str): 'built' or 'up to date'.
+    """
+    from .aws import _add_cloudformation_template
+    from .docker_tools import _build_or_get_image
+
+    _get_project_config(name)
+    built = _build_or_get_image(name, force=force, refresh_base=refresh_base)
+    _add_cloudformation_template(name)
+    return "built" if built else "up to date"
+
+
+def _run_project_jobs(
+    names: List[str], job: Callable, jobs: int, verb: str
+) -> List[Dict]:
+    """
+    Runs 'job(name)' for each project on a pool of worker threads. The
+    output of each job is buffered, and a progress line is printed as each
+    project finishes. Registry writes from the jobs are safe because they
+    go through registry transactions.
+
+    Args:
+        names (list): Project names.
+
+        job (callable): Function taking a project name and returning an
+         outcome string.
+
+        jobs (int): Maximum number of projects processed at once.
+
+        verb (str): Verb for the progress display, e.g. 'Building'.
+
+    Returns:
+        (list): One dict per project with 'name', 'outcome', 'seconds',
+         'ok' and 'output', in the order of 'names'.
+    """
+    print(
+        f"{_get_constant('MSG_PREFIX')}{verb} {len(names)} project(s), {jobs} at a time..."
+    )
+    results = {}
+    with _thread_output() as output:
+
+        def _run(name: str) -> Dict:
+            output.capture()
+            start = time.monotonic()
+            try:
+                outcome, ok = job(name), True
+            except (Exception, SystemExit) as e:
+                outcome, ok = f"failed: {str(e) or type(e).__name__}", False
+            return {
+                "name": name,
+                "outcome": outcome,
+                "ok": ok,
+                "seconds": time.monotonic() - start,
+                "output": output.release(),
+            }
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_run, n) for n in names]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result["name"]] = result
+                running = len([f for f in futures if f.running()])
+                print(
+                    f"{_get_constant('MSG_PREFIX')}[{len(results)}/{len(names)}] {result['name']}: {result['outcome']} ({result['seconds']:.1f}s, {running} running)"
+                )
+    return [results[n] for n in names]
+
+
+def _run_stack_jobs(
+    names: List[str], operation: Callable, jobs: int, verb: str
+) -> NoReturn:
+    """
+    Runs a stack operation for each project concurrently and follows each
+    stack to completion. CloudFormation calls are rate limited per region
+    (see 'aws._get_cloudformation_client'). The registry changes recorded
+    so far are written each time a stack finishes, and again if the run
+    is interrupted, so stacks that were created are never lost from the
+    registry. Exits with an error if any project failed.
+
+    Args:
+        names (list): Project names.
+
+        operation (callable): '_deploy_stack' or '_undeploy_stack'.
+
+        jobs (int): Maximum number of stack operations at once.
+
+        verb (str): Verb for the progress display, e.g. 'Deploying'.
+    """
+    if jobs < 1:
+        print(f"{_get_constant('FAIL_PREFIX')}'jobs' must be at least 1, got: {jobs}")
+        sys.exit(1)
+    if len(names) == 0:
+        print(f"{_get_constant('MSG_PREFIX')}No projects selected.")
+        return
+
+    txn = _RegistryTransaction()
+
+    def job(name: str) -> str:
+        _check_project_config(name)
+        try:
+            ok = operation(name, txn=txn)
+        finally:
+            txn.commit()
+        if not ok:
+            raise ValueError("stack operation failed or was not started")
+        return "done"
+
+    try:
+        results = _run_project_jobs(names, job, jobs, verb)
+    finally:
+        txn.commit()
+    _print_job_summary(results)
+    if any(not r["ok"] for r in results):
+        sys.exit(1)
+
+
+def _print_job_summary(results: List[Dict]) -> NoReturn:
+    """
+    Prints the per-project outcome and timing of a multi-project command,
+    followed by the output of the projects that failed.
+
+    Args:
+        results (list): Results from '_run_project_jobs'.
+    """
+    headers = ["Project", "Outcome", "Time"]
+    rows = [[r["name"], r["outcome"], f"{r['seconds']:.1f}s"] for r in results]
+    widths = [max(len(c) for c in col) + 3 for col in zip(headers, *rows)]
+    lines = ["".join(h.ljust(w) for h, w in zip(headers, widths))]
+    lines.append("-" * len(lines[0]))
+    lines.extend("".join(c.ljust(w) for c, w in zip(row, widths)) for row in rows)
+    print("\n" + "\n".join(lines) + "\n")
+    for r in results:
+        if not r["ok"] and len(r["output"]) > 0:
+            print(f"--- Output for '{r['name']}' ---")
+            print(r["output"])
+
+
 # =============================================================================
 # CLI Functions - Commands to the user at the command line.
 # -----------------------------------------------------------------------------
@@ -83,7 +332,7 @@ def ls() -> NoReturn:
     print(f"\n--- (End of list) ---\n")
 
 
-def create(name: str, path: str = _get_appdata_folder()) -> NoReturn:
+def create(name: str, path: str = "") -> NoReturn:
     """
     Creates a new project, including project folder, configuration file,
     and project registry.
@@ -95,6 +344,16 @@ def create(name: str, path: str = _get_appdata_folder()) -> NoReturn:
         path (str): Optional. The path to where the project contents
          shall reside. Default is the local application data folder.
     """
+    from .startup import (
+        _create_registry_file_if_not_exists,
+        _add_project_to_registry,
+        _create_new_project_folder,
+        _copy_and_update_config,
+        _create_requirements_file,
+        _copy_dockerignore,
+    )
+
+    path = path if len(path) > 0 else _get_appdata_folder()
     path_dir = path + name if path.endswith("/") else path + "/" + name
     reg_data = _get_registry_data()
     if name in reg_data.keys():
@@ -134,6 +393,8 @@ def delete(name: str) -> NoReturn:
     Args:
         name (str): Name of the project to delete.
     """
+    from .cleanup import _delete_project
+
     reg_data = _get_registry_data()
     if name not in reg_data.keys():
         print(
@@ -158,54 +419,277 @@ def delete(name: str) -> NoReturn:
             )
 
 
-def build(name: str = "") -> NoReturn:
+def build(
+    *names: str,
+    all: bool = False,
+    status: str = "",
+    jobs: int = 4,
+    force: bool = False,
+    refresh_base: bool = False,
+    analyze_context: bool = False,
+    name: str = "",
+) -> NoReturn:
     """
     Builds the project's Docker image from configuration files or uses
-    user-defined Dockerfile or Docker image.
+    user-defined Dockerfile or Docker image. The build is skipped if
+    nothing changed since the last build.
+
+    Several projects are built in parallel when more than one name is
+    given, or with '--all' or '--status'.
 
     Args:
-        name (str): Name of the project to delete.
+        names (str): Names of the projects to build. Default is the
+         project in the current folder.
+
+        all (bool): Build all registered projects.
+
+        status (str): Build the projects with this deployment status,
+         e.g. 'Deployed'.
+
+        jobs (int): Maximum number of projects built at once. Default is 4.
+
+        force (bool): Rebuild the image even if nothing changed.
+
+        refresh_base (bool): Pull the base image now instead of reusing
+         the cached digest until 'base-image-ttl' expires.
+
+        analyze_context (bool): Only report the size of the build context
+         and suggest ignore patterns, without building.
+
+        name (str): Name of the project to build, same as giving one name.
     """
-    proj_name = _check_for_project_name_and_exists(name)
-    _build_or_get_image(proj_name)
-    _add_cloudformation_template(proj_name)
-    print(f"{_get_constant('MSG_PREFIX')}Project build successful.")
+    names = list(names) + ([name] if len(name) > 0 else [])
+    if analyze_context:
+        from .docker_tools import _analyze_build_context
 
+        if all or len(status) > 0 or len(names) > 1:
+            proj_names = _select_projects(names, all_projects=all, status=status)
+        else:
+            proj_names = [_check_for_project_name_and_exists(names[0] if names else "")]
+        for proj_name in proj_names:
+            _check_project_config(proj_name)
+            print(f"{_get_constant('MSG_PREFIX')}Build context of '{proj_name}':\n")
+            _analyze_build_context(proj_name)
+        return
+    if not all and len(status) == 0 and len(names) <= 1:
+        from .aws import _add_cloudformation_template
+        from .docker_tools import _build_or_get_image
 
-def deploy(name: str = "") -> NoReturn:
+        proj_name = _check_for_project_name_and_exists(names[0] if names else "")
+        _check_project_config(proj_name)
+        try:
+            _build_or_get_image(proj_name, force=force, refresh_base=refresh_base)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        _add_cloudformation_template(proj_name)
+        print(f"{_get_constant('MSG_PREFIX')}Project build successful.")
+        return
+    if jobs < 1:
+        print(f"{_get_constant('FAIL_PREFIX')}'jobs' must be at least 1, got: {jobs}")
+        sys.exit(1)
+    proj_names = _select_projects(names, all_projects=all, status=status)
+    if len(proj_names) == 0:
+        print(f"{_get_constant('MSG_PREFIX')}No projects to build.")
+        return
+    results = _run_project_jobs(
+        proj_names, lambda n: _build_project(n, force, refresh_base), jobs, "Building"
+    )
+    _print_job_summary(results)
+    if any(not r["ok"] for r in results):
+        sys.exit(1)
+
+
+def lock(name: str = "", refresh: bool = False) -> NoReturn:
     """
-    Deploys the specified project to cloud resources.
+    Resolves the project's 'requirements.txt' into 'requirements.lock',
+    with every package pinned to an exact version and hash. Once a project
+    is locked, builds install from the lockfile and keep it up to date
+    with 'requirements.txt'.
+
+    Projects that also use the shared wheelhouse ('use-wheelhouse') install
+    the pinned versions without checking the hashes, because locally built
+    wheels do not match the hashes of the package index.
 
     Args:
-        name (str): Name of the project to deploy.
+        name (str): Name of the project to lock.
+
+        refresh (bool): Resolve again, picking up new package releases.
     """
+    from .docker_tools import _lock_requirements
+
     proj_name = _check_for_project_name_and_exists(name)
+    _check_project_config(proj_name)
+    try:
+        written = _lock_requirements(proj_name, refresh=refresh)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    if not written:
+        print(f"{_get_constant('MSG_PREFIX')}Lockfile is up to date.")
+
+
+def gc(*names: str, all: bool = False, dry_run: bool = False) -> NoReturn:
+    """
+    Removes old Docker images of projects according to their retention
+    policy ('image-retention-count' and 'image-retention-days'). This also
+    runs automatically after each build.
+
+    Args:
+        names (str): Names of the projects. Default is the project in the
+         current folder.
+
+        all (bool): Clean up all registered projects.
+
+        dry_run (bool): Only show what would be removed.
+    """
+    from .docker_tools import _collect_project_images
+
+    if all or len(names) > 0:
+        proj_names = _select_projects(list(names), all_projects=all)
+    else:
+        proj_names = [_check_for_project_name_and_exists("")]
+    action = "Would remove" if dry_run else "Removed"
+    total_images, total_bytes = 0, 0
+    for proj_name in proj_names:
+        _check_project_config(proj_name)
+        removed, reclaimed = _collect_project_images(proj_name, dry_run=dry_run)
+        total_images += len(removed)
+        total_bytes += reclaimed
+        print(
+            f"{_get_constant('MSG_PREFIX')}{proj_name}: {action} {len(removed)} image(s), up to {reclaimed / 1e6:.1f} MB."
+        )
+        for tag in removed:
+            print(f"\t{tag}")
     print(
-        f"{_get_constant('MSG_PREFIX')}Deploying project:_print_project_status {proj_name}"
+        f"{_get_constant('MSG_PREFIX')}{action} {total_images} image(s) in total, up to {total_bytes / 1e6:.1f} MB reclaimed."
     )
-    _deploy_stack(name)
 
 
-def undeploy(name: str = "") -> NoReturn:
+def deploy(
+    *names: str,
+    all: bool = False,
+    filter: str = "",
+    jobs: int = 4,
+    name: str = "",
+) -> NoReturn:
+    """
+    Deploys the specified project to cloud resources and follows the
+    stack until it is created.
+
+    Several projects are deployed concurrently when more than one name is
+    given, or with '--all' or '--filter'.
+
+    Args:
+        names (str): Names of the projects to deploy. Default is the
+         project in the current folder.
+
+        all (bool): Deploy all registered projects that are not deployed.
+
+        filter (str): Deploy the projects whose name matches this
+         pattern, e.g. 'churn-*'.
+
+        jobs (int): Maximum number of stacks deployed at once. Default is 4.
+
+        name (str): Name of the project to deploy, same as giving one name.
+    """
+    from .aws import _deploy_stack
+
+    names = list(names) + ([name] if len(name) > 0 else [])
+    if not all and len(filter) == 0 and len(names) <= 1:
+        proj_name = _check_for_project_name_and_exists(names[0] if names else "")
+        _check_project_config(proj_name)
+        print(f"{_get_constant('MSG_PREFIX')}Deploying project: {proj_name}")
+        if not _deploy_stack(proj_name):
+            sys.exit(1)
+        return
+    proj_names = _select_projects(names, all_projects=all, name_filter=filter)
+    if len(names) == 0:
+        # Projects selected by '--all' or '--filter' that are already
+        # deployed are left as they are.
+        proj_names = [
+            n
+            for n in proj_names
+            if _get_field_if_exists(n, _get_constant("DEPLOY_STATUS_KEY"))
+            != _get_constant("STATUS_DEPLOYED")
+        ]
+    _run_stack_jobs(proj_names, _deploy_stack, jobs, "Deploying")
+
+
+def undeploy(
+    *names: str,
+    all: bool = False,
+    filter: str = "",
+    jobs: int = 4,
+    name: str = "",
+) -> NoReturn:
     """
     Removes the stack associated with the specified project
     from AWS and CloudFormation. This leaves the project files
     on the local machine unaffected.
+
+    Several projects are removed concurrently when more than one name is
+    given, or with '--all' or '--filter'.
+
+    Args:
+        names (str): Names of the projects to remove. Default is the
+         project in the current folder.
+
+        all (bool): Remove the stacks of all deployed projects.
+
+        filter (str): Remove the stacks of the projects whose name
+         matches this pattern.
+
+        jobs (int): Maximum number of stacks removed at once. Default is 4.
+
+        name (str): Name of the project to remove, same as giving one name.
     """
-    proj_name = _check_for_project_name_and_exists(name)
-    print(f"{_get_constant('MSG_PREFIX')}Removing deployment: {proj_name}")
-    _undeploy_stack(name)
+    from .aws import _undeploy_stack
+
+    names = list(names) + ([name] if len(name) > 0 else [])
+    if not all and len(filter) == 0 and len(names) <= 1:
+        proj_name = _check_for_project_name_and_exists(names[0] if names else "")
+        print(f"{_get_constant('MSG_PREFIX')}Removing deployment: {proj_name}")
+        if not _undeploy_stack(proj_name):
+            sys.exit(1)
+        return
+    if all:
+        proj_names = _select_projects(
+            names, status=_get_constant("STATUS_DEPLOYED"), name_filter=filter
+        )
+    else:
+        proj_names = _select_projects(names, name_filter=filter)
+    if len(names) == 0:
+        proj_names = [
+            n
+            for n in proj_names
+            if _get_field_if_exists(n, _get_constant("DEPLOY_STATUS_KEY"))
+            == _get_constant("STATUS_DEPLOYED")
+        ]
+    _run_stack_jobs(proj_names, _undeploy_stack, jobs, "Removing")
 
 
-def update(name: str = "") -> NoReturn:
+def update(name: str = "", dry_run: bool = False) -> NoReturn:
     """
-    Updates the specified project stack.
+    Updates the deployed stack of the specified project to its current
+    CloudFormation template through a change set, without removing the
+    stack. The template is rendered again from the project configuration,
+    replacing '.cloudformation.yml'. Resources that would be replaced are listed before the update.
 
     Args:
         name (str): Name of the project to update.
+
+        dry_run (bool): Only show the changes.
     """
+    from .aws import _update_stack
+
     proj_name = _check_for_project_name_and_exists(name)
-    print(f"{_get_constant('MSG_PREFIX')}***PROJECT UPDATE PLACEHOLDER***{proj_name}")
+    _check_project_config(proj_name)
+    try:
+        _update_stack(proj_name, dry_run=dry_run)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
 
 
 def status(name: str = "") -> NoReturn:
@@ -216,4 +700,4 @@ def status(name: str = "") -> NoReturn:
         name (str): Name of the project to update.
     """
     proj_name = _check_for_project_name_and_exists(name)
-    _print_project_status(proj_name)
\ No newline at end of file
+    _print_project_status(proj_name)
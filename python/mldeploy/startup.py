@@ -15,7 +15,6 @@
 # =============================================================================
 # Imports.
 # -----------------------------------------------------------------------------
-import json
 import os
 import ruamel.yaml as ryml  # Allows modification of YAML file without disrupting comments.
 import shutil
@@ -24,16 +23,18 @@ from typing import NoReturn
 from .utils import (
     _add_salt,
     _get_project_folder,
-    _get_registry_data,
     _get_registry_path,
-    _get_appdata_folder,
+    _initialize_registry,
+    _registry_transaction,
     _get_constant,
+    _traced,
 )
 
 
 # =============================================================================
 # Helper functions for project creation.
 # -----------------------------------------------------------------------------
+@_traced()
 def _create_registry_file_if_not_exists() -> NoReturn:
     """
     Creates a registry file in the central code location. Registry file
@@ -43,14 +44,11 @@ def _create_registry_file_if_not_exists() -> NoReturn:
     if os.path.exists(_get_registry_path()):
         return
     else:
-        data = {}
-        if not os.path.exists(_get_appdata_folder()):
-            os.makedirs(_get_appdata_folder())
-        with open(_get_registry_path(), "w") as f:
-            json.dump(data, f)
+        _initialize_registry()
         return
 
 
+@_traced()
 def _add_project_to_registry(project_path: str) -> NoReturn:
     """
     Adds a new project entry to the registry file.
@@ -62,26 +60,25 @@ def _add_project_to_registry(project_path: str) -> NoReturn:
          the project will be located.
     """
     project_name = project_path.rsplit("/", 1)[1]
-    data = _get_registry_data()
-    data.update(
-        {
-            f"{project_name}": {
+    with _registry_transaction() as txn:
+        txn.add_project(
+            project_name,
+            {
                 _get_constant("PROJ_FOLDER_KEY"): project_path,
                 _get_constant("SALT_KEY"): _add_salt(8),
                 _get_constant("DEPLOY_STATUS_KEY"): _get_constant(
                     "STATUS_NOT_DEPLOYED"
                 ),
-            }
-        }
-    )
-    with open(_get_registry_path(), "w") as f:
-        json.dump(data, f)
+            },
+        )
 
 
+@_traced()
 def _copy_and_update_config(name: str) -> NoReturn:
     """
     Copies and updates the YAML configuration file, customizing
-    it for the new project.
+    it for the new project. The round-trip loader is used here so the
+    comments in the template are kept when the file is written back.
 
     Args:
         name (str): The name of the project.
@@ -100,6 +97,7 @@ def _copy_and_update_config(name: str) -> NoReturn:
     return
 
 
+@_traced()
 def _create_requirements_file(name: str) -> NoReturn:
     """
     Creates a new requirements file for the project.
@@ -115,6 +113,7 @@ def _create_requirements_file(name: str) -> NoReturn:
                 f.write(module + "\n")
 
 
+@_traced()
 def _copy_dockerignore(name: str) -> NoReturn:
     """
     Copies the '.dockerignore' file to the project folder.
@@ -126,6 +125,7 @@ def _copy_dockerignore(name: str) -> NoReturn:
     shutil.copy(src=_get_constant("TEMPLATES_FOLDER") + "/.dockerignore", dst=di_file)
 
 
+@_traced()
 def _create_new_project_folder(name: str) -> NoReturn:
     """
     Creates a new project folder.
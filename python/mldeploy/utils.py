@@ -8,6 +8,9 @@
 #
 # The CLI is built using the following packages:
 #   - ruamel.yaml: Edit YAML files without affecting the structure or comments.
+#
+# Heavy third-party packages ('docker', 'ruamel.yaml') are imported inside
+# the functions that use them so that light commands start quickly.
 # -----------------------------------------------------------------------------
 # Author: kingfischer16 (https://github.com/kingfischer16/mldeploy)
 # =============================================================================
@@ -16,16 +19,43 @@
 # Imports.
 # -----------------------------------------------------------------------------
 from collections import OrderedDict
-import docker
+from contextlib import contextmanager
+import functools
+import hashlib
+import importlib
+import io
 import json
 import os
 import pathlib
 import random
-import ruamel.yaml as ryml  # Allows modification of YAML file without disrupting comments.
-import shutil
+import sqlite3
 import string
 import sys
-from typing import NoReturn, List, Union, Dict, Any
+import threading
+import time
+from typing import NoReturn, List, Union, Dict, Any, Iterator, Callable
+
+try:
+    import fcntl  # Advisory file locks on POSIX.
+except ImportError:
+    fcntl = None
+    import msvcrt  # File locks on Windows.
+
+
+# Modules loaded on first attribute access, e.g. 'utils.docker'.
+_LAZY_MODULES = {"docker": "docker", "ryml": "ruamel.yaml"}
+
+
+def __getattr__(attr: str) -> Any:
+    """
+    Imports the heavy third-party modules listed in '_LAZY_MODULES' on
+    first access as attributes of this module.
+    """
+    if attr in _LAZY_MODULES:
+        module = importlib.import_module(_LAZY_MODULES[attr])
+        globals()[attr] = module
+        return module
+    raise AttributeError(f"module '{__name__}' has no attribute '{attr}'")
 
 
 # =============================================================================
@@ -47,27 +77,57 @@ def _get_constant(key: str) -> Union[str, list]:
         "CURR_DIR": str(os.path.dirname(os.path.realpath(__file__))),
         "TEMPLATES_FOLDER": str(os.path.dirname(os.path.realpath(__file__)))
         + "/config_templates",
+        "DEPLOY_TEMPLATES_FOLDER": str(os.path.dirname(os.path.realpath(__file__)))
+        + "/deploy_templates",
         "PLATFORM": sys.platform,
         "DOCKER_LOG_FOLDER": "docker_build_logs",
         "DOCKER_LOG_FILE_TAG": "_docker_build_log_",
         "REG_FILE_NAME": ".registry.json",
+        "REG_DB_FILE_NAME": ".registry.db",
+        "REG_LOCK_FILE_NAME": ".registry.lock",
+        "FILE_DIGEST_CACHE_NAME": ".file_digests.json",
+        "BASE_IMAGE_CACHE_NAME": ".base_images.json",
+        "GIT_CACHE_FOLDER": "git_cache",
+        "GIT_SNAPSHOTS_KEPT": 2,
+        "LOCKFILE_NAME": "requirements.lock",
+        "LOCKFILE_CACHE_FOLDER": "lockfiles",
+        "WHEELHOUSE_FOLDER": "wheelhouse",
+        "WHEELHOUSE_INDEX_NAME": "index.json",
+        "WHEELHOUSE_ABI_FILE_NAME": "abi.json",
+        "WHEELHOUSE_UNPINNED_TTL_HOURS": 24,
+        "REG_BACKEND_ENV_VAR": "MLDEPLOY_REGISTRY_BACKEND",
+        "S3_ENDPOINT_ENV_VAR": "MLDEPLOY_S3_ENDPOINT_URL",
+        "REG_BACKENDS": ["json", "sqlite"],
         "CLOUDFORMATION_FILE_NAME": ".cloudformation.yml",
         # AWS prefix names.
         "S3_STORE_PREF": "mldeployStore",
+        "S3_TEMPLATE_PREFIX": "cloudformation/",
+        "S3_UPLOAD_WORKERS": 8,
+        # CloudFormation API calls per second and burst, per region.
+        "CFN_API_RATE": 4.0,
+        "CFN_API_BURST": 8,
+        "CFN_API_MAX_ATTEMPTS": 8,
         # Registry key names.
         "CLOUDFORMATION_LOCATION_KEY": "cloudformation_template",
         "DEPLOY_STATUS_KEY": "deployment_status",
         "DOCKER_IMAGE_KEY": "docker-image",
+        "BUILD_HASH_KEY": "build-hash",
+        "BUILD_STEP_LOG_KEY": "build-step-log",
+        "IMAGE_SIZE_KEY": "image-size",
+        "IMAGE_SIZE_PREVIOUS_KEY": "image-size-previous",
         "PROJ_FOLDER_KEY": "location",
         "SALT_KEY": "salt",
         "STACK_NAME_KEY": "stack_name",
         "STACK_ID_KEY": "stack_id",
+        "STACK_TEMPLATE_HASH_KEY": "stack-template-hash",
         # Standard values in registry.
         "STATUS_DEPLOYED": "Deployed",
         "STATUS_NOT_DEPLOYED": "Not deployed",
         # Docker image constructions.
         "DEFAULT_PROJECT_MODULES": ["boto3"],
         "APP_DIR_ON_IMAGE": "app",
+        "DOCKERFILE_SYNTAX": "# syntax=docker/dockerfile:1",
+        "IMAGE_GC_BATCH_SIZE": 4,
         # User messages.
         "MSG_PREFIX": "\033[1;36;40m MLDeploy Message:: \033[m",
         "FAIL_PREFIX": "\033[1;31;40m MLDeploy Failure:: \033[m",
@@ -76,6 +136,197 @@ def _get_constant(key: str) -> Union[str, list]:
     return d_constants[key]
 
 
+# =============================================================================
+# Tracing utilities.
+# -----------------------------------------------------------------------------
+# Timed spans are only recorded while tracing is enabled ('--trace' on the
+# command line). When disabled, '_trace_span' returns a shared no-op object
+# and '_traced' adds a single flag check per call.
+_TRACE = {"enabled": False, "origin": 0.0, "events": []}
+
+
+class _NullSpan:
+    """
+    No-op span returned while tracing is disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """
+    A timed span, recorded as a Chrome-trace complete ('X') event when
+    the span ends.
+
+    Args:
+        name (str): Span name, e.g. 'docker.build'.
+
+        args (dict): Extra details shown with the span in the trace viewer.
+    """
+
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: Dict):
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        end = time.perf_counter()
+        event = {
+            "name": self.name,
+            "cat": "mldeploy",
+            "ph": "X",
+            "ts": (self.start - _TRACE["origin"]) * 1e6,
+            "dur": (end - self.start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if exc[0] is not None:
+            self.args["error"] = exc[0].__name__
+        if len(self.args) > 0:
+            event["args"] = {k: str(v) for k, v in self.args.items()}
+        _TRACE["events"].append(event)
+        return False
+
+
+def _trace_span(name: str, **args) -> Union[_Span, _NullSpan]:
+    """
+    Returns a context manager that times the enclosed block.
+
+    Example:
+        with _trace_span("docker.build", image=image_name):
+            client.images.build(...)
+
+    Args:
+        name (str): Span name.
+
+        **args: Extra details to attach to the span.
+    """
+    if _TRACE["enabled"]:
+        return _Span(name, args)
+    return _NULL_SPAN
+
+
+def _traced(name: Union[str, None] = None) -> Callable:
+    """
+    Decorator that records each call of the function as a span.
+
+    Args:
+        name (str): Optional. Span name. Default is '<module>.<function>'.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _TRACE["enabled"]:
+                return func(*args, **kwargs)
+            with _Span(span_name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _start_tracing() -> NoReturn:
+    """
+    Enables tracing and discards any previously recorded spans.
+    """
+    _TRACE["events"] = []
+    _TRACE["origin"] = time.perf_counter()
+    _TRACE["enabled"] = True
+
+
+def _stop_tracing() -> List[Dict]:
+    """
+    Disables tracing.
+
+    Returns:
+        (list): The recorded Chrome-trace events.
+    """
+    _TRACE["enabled"] = False
+    return list(_TRACE["events"])
+
+
+def _export_trace(path: str, events: List[Dict]) -> NoReturn:
+    """
+    Writes spans to a Chrome-trace JSON file, which can be opened in
+    'chrome://tracing' or https://ui.perfetto.dev.
+
+    Args:
+        path (str): Output file path.
+
+        events (list): Events from '_stop_tracing'.
+    """
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _get_trace_summary(events: List[Dict]) -> str:
+    """
+    Returns a flat table of the recorded spans, grouped by name and sorted
+    by total time. 'Self' is the time not spent in nested spans.
+
+    Args:
+        events (list): Events from '_stop_tracing'.
+
+    Returns:
+        (str): The summary table.
+    """
+    stats = OrderedDict()
+    # Work out self time per thread from span nesting.
+    by_thread = {}
+    for e in events:
+        by_thread.setdefault(e["tid"], []).append(e)
+    for thread_events in by_thread.values():
+        stack = []
+        for e in sorted(thread_events, key=lambda x: (x["ts"], -x["dur"])):
+            while len(stack) > 0 and stack[-1]["ts"] + stack[-1]["dur"] <= e["ts"]:
+                stack.pop()
+            st = stats.setdefault(
+                e["name"], {"calls": 0, "total": 0.0, "self": 0.0, "max": 0.0}
+            )
+            st["calls"] += 1
+            st["total"] += e["dur"]
+            st["self"] += e["dur"]
+            st["max"] = max(st["max"], e["dur"])
+            if len(stack) > 0:
+                stats[stack[-1]["name"]]["self"] -= e["dur"]
+            stack.append(e)
+    headers = ["Span", "Calls", "Total ms", "Self ms", "Max ms"]
+    rows = [
+        [
+            k,
+            str(v["calls"]),
+            f"{v['total'] / 1000:.1f}",
+            f"{v['self'] / 1000:.1f}",
+            f"{v['max'] / 1000:.1f}",
+        ]
+        for k, v in sorted(stats.items(), key=lambda kv: -kv[1]["total"])
+    ]
+    widths = [max([len(r[i]) for r in [headers] + rows]) + 3 for i in range(5)]
+    lines = ["".join(h.ljust(w) for h, w in zip(headers, widths))]
+    lines.append("-" * len(lines[0]))
+    lines.extend("".join(c.ljust(w) for c, w in zip(r, widths)) for r in rows)
+    return "\n".join(lines)
+
+
 # =============================================================================
 # Registry utilities.
 # -----------------------------------------------------------------------------
@@ -95,26 +346,592 @@ def _get_appdata_folder() -> str:
     return str(appdata_folder) + "/mldeploy"
 
 
+def _get_registry_backend_name() -> str:
+    """
+    Returns the name of the registry storage backend to use. This is set
+    with the 'MLDEPLOY_REGISTRY_BACKEND' environment variable and defaults
+    to 'json'.
+
+    Raises:
+        ValueError: If the backend name is not recognized.
+    """
+    backend_name = os.environ.get(_get_constant("REG_BACKEND_ENV_VAR"), "json")
+    backend_name = backend_name.strip().lower() or "json"
+    if backend_name not in _get_constant("REG_BACKENDS"):
+        raise ValueError(
+            f"Unknown registry backend '{backend_name}'. Choose from: {_get_constant('REG_BACKENDS')}"
+        )
+    return backend_name
+
+
 def _get_registry_path() -> str:
     """
     Returns the full file path of the 'mldeploy' registry file.
     """
     appdata_folder = _get_appdata_folder()
+    if _get_registry_backend_name() == "sqlite":
+        return appdata_folder + "/" + _get_constant("REG_DB_FILE_NAME")
     return appdata_folder + "/" + _get_constant("REG_FILE_NAME")
 
 
+# =============================================================================
+# Registry storage backends.
+# -----------------------------------------------------------------------------
+class _JsonRegistryBackend:
+    """
+    Stores the whole registry as a single JSON document. Every write
+    rewrites the full file, and reads go through the cached document.
+
+    Args:
+        path (str): Path to the '.registry.json' file.
+    """
+
+    # Single projects cannot be read or written on their own.
+    ROW_ACCESS = False
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def exists(self) -> bool:
+        """Returns True if the registry file exists."""
+        return os.path.exists(self.path)
+
+    def initialize(self) -> NoReturn:
+        """Creates an empty registry file if none exists."""
+        if not self.exists():
+            self.save({})
+
+    def load(self) -> Dict:
+        """Returns the full registry."""
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def save(self, data: Dict, changed: Union[List[str], None] = None) -> NoReturn:
+        """
+        Writes the full registry to a temporary file and renames it over
+        the registry, so readers never see a partially written file.
+        'changed' is ignored.
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class _SqliteRegistryBackend:
+    """
+    Stores the registry in a SQLite database with one row per project.
+    Single projects are read and written by name, so neither needs the
+    full table, and lookups on deployment status and Docker image use
+    indexes.
+
+    On first use an existing '.registry.json' file is imported into the
+    database. The JSON file is left in place but is no longer written.
+
+    Args:
+        path (str): Path to the '.registry.db' file.
+
+        json_path (str): Path to the '.registry.json' file to migrate from.
+    """
+
+    # Single projects can be read and written on their own.
+    ROW_ACCESS = True
+
+    # Registry fields promoted to their own indexed columns.
+    INDEXED_FIELDS = {
+        "location": "location",
+        "deployment_status": "deployment_status",
+        "docker-image": "docker_image",
+    }
+
+    def __init__(self, path: str, json_path: str):
+        self.path = path
+        self.json_path = json_path
+        self._ready = False
+
+    def exists(self) -> bool:
+        """Returns True if the database file exists."""
+        return os.path.exists(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a connection, creating the schema on first use."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            self._create_schema(conn)
+            self._migrate_from_json(conn)
+            self._ready = True
+        return conn
+
+    def _create_schema(self, conn: sqlite3.Connection) -> NoReturn:
+        """Creates the tables and indexes if they do not exist."""
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS projects ("
+                "name TEXT PRIMARY KEY, location TEXT, deployment_status TEXT, "
+                "docker_image TEXT, data TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_projects_status "
+                "ON projects (deployment_status)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_projects_image ON projects (docker_image)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    def _migrate_from_json(self, conn: sqlite3.Connection) -> NoReturn:
+        """
+        One-shot import of the JSON registry. Runs only once per database.
+        """
+        migrated = conn.execute(
+            "SELECT value FROM meta WHERE key = 'json_migrated'"
+        ).fetchone()
+        if migrated is not None:
+            return
+        data = {}
+        if os.path.exists(self.json_path):
+            with open(self.json_path, "r") as f:
+                data = json.load(f)
+        with conn:
+            conn.executemany(
+                self._UPSERT_SQL, [self._row(k, v) for k, v in data.items()]
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (str(len(data)),),
+            )
+
+    _UPSERT_SQL = (
+        "INSERT OR REPLACE INTO projects "
+        "(name, location, deployment_status, docker_image, data) VALUES (?, ?, ?, ?, ?)"
+    )
+
+    def _row(self, name: str, fields: Dict) -> tuple:
+        """Returns the table row for a project's registry fields."""
+        return (
+            name,
+            fields.get("location"),
+            fields.get("deployment_status"),
+            fields.get("docker-image"),
+            json.dumps(fields),
+        )
+
+    def initialize(self) -> NoReturn:
+        """Creates the database, migrating the JSON registry if found."""
+        self._connect().close()
+
+    def load(self) -> Dict:
+        """Returns the full registry."""
+        if not self.exists() and not os.path.exists(self.json_path):
+            return {}
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT name, data FROM projects").fetchall()
+        finally:
+            conn.close()
+        return {name: json.loads(fields) for name, fields in rows}
+
+    def load_projects(self, names: List[str]) -> Dict:
+        """Returns the registry fields of the named projects that exist."""
+        if not self.exists() and not os.path.exists(self.json_path):
+            return {}
+        names = list(dict.fromkeys(names))
+        rows = []
+        conn = self._connect()
+        try:
+            # Stay below SQLite's limit on query parameters.
+            for i in range(0, len(names), 500):
+                chunk = names[i : i + 500]
+                rows.extend(
+                    conn.execute(
+                        "SELECT name, data FROM projects WHERE name IN "
+                        f"({', '.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                )
+        finally:
+            conn.close()
+        return {name: json.loads(fields) for name, fields in rows}
+
+    def save(self, data: Dict, changed: Union[List[str], None] = None) -> NoReturn:
+        """
+        Writes the rows of the 'changed' projects in one transaction. Projects
+        missing from 'data' are deleted. Rewrites all rows if 'changed' is None.
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                if changed is None:
+                    conn.execute("DELETE FROM projects")
+                    changed = list(data.keys())
+                for name in changed:
+                    if name in data:
+                        conn.execute(self._UPSERT_SQL, self._row(name, data[name]))
+                    else:
+                        conn.execute("DELETE FROM projects WHERE name = ?", (name,))
+        finally:
+            conn.close()
+
+    def find(self, field: str, value: str) -> List[str]:
+        """
+        Returns the projects where 'field' equals 'value', through the
+        column index for indexed fields.
+        """
+        if field in self.INDEXED_FIELDS:
+            sql = f"SELECT name FROM projects WHERE {self.INDEXED_FIELDS[field]} = ?"
+            params = (value,)
+        else:
+            sql = "SELECT name FROM projects WHERE json_extract(data, ?) = ?"
+            params = ('$."' + field.replace('"', '""') + '"', value)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        return [r[0] for r in rows]
+
+
+_REGISTRY_BACKENDS = {}
+
+
+def _get_registry_backend() -> Union[_JsonRegistryBackend, _SqliteRegistryBackend]:
+    """
+    Returns the storage backend for the registry, as selected by
+    '_get_registry_backend_name'. Backends are created once per process.
+    """
+    backend_name = _get_registry_backend_name()
+    reg_path = _get_registry_path()
+    key = (backend_name, reg_path)
+    if key not in _REGISTRY_BACKENDS:
+        if backend_name == "sqlite":
+            json_path = _get_appdata_folder() + "/" + _get_constant("REG_FILE_NAME")
+            _REGISTRY_BACKENDS[key] = _SqliteRegistryBackend(reg_path, json_path)
+        else:
+            _REGISTRY_BACKENDS[key] = _JsonRegistryBackend(reg_path)
+    return _REGISTRY_BACKENDS[key]
+
+
+# =============================================================================
+# Registry access.
+# -----------------------------------------------------------------------------
+# In-process cache of the parsed registry. Entries are keyed on the registry
+# path and the file's stat signature so writes from other processes are seen.
+_REGISTRY_CACHE = {"key": None, "data": None}
+_REGISTRY_CACHE_STATS = {"parses": 0, "hits": 0}
+_REGISTRY_CACHE_LOCK = threading.RLock()
+
+
+def _get_file_signature(path: str) -> Union[tuple, None]:
+    """
+    Returns a tuple identifying the current version of a file on disk,
+    or None if the file cannot be found.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        (tuple, None): Path, inode, size and modification times of the file.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+
+@_traced("registry.read")
 def _get_registry_data() -> Dict:
     """
     Returns the registry data as a Python dictionary.
+
+    The parsed registry is cached for the lifetime of the process and is
+    only loaded again when the registry file changes on disk. The returned
+    dictionary is shared with the cache and must not be modified in place;
+    copy it before making changes (see '_write_registry_data').
     """
-    try:
-        with open(_get_registry_path(), "r") as f:
-            data = json.load(f)
-    except:
-        data = {}
+    backend = _get_registry_backend()
+    key = _get_file_signature(backend.path)
+    with _REGISTRY_CACHE_LOCK:
+        if key is not None and key == _REGISTRY_CACHE["key"]:
+            _REGISTRY_CACHE_STATS["hits"] += 1
+            return _REGISTRY_CACHE["data"]
+        try:
+            data = backend.load()
+        except:
+            data = {}
+        _REGISTRY_CACHE_STATS["parses"] += 1
+        # Re-read the signature, the SQLite backend may have just created
+        # the database by migrating the JSON registry.
+        key = _get_file_signature(backend.path)
+        if key is not None:
+            _REGISTRY_CACHE["key"] = key
+            _REGISTRY_CACHE["data"] = data
     return data
 
 
+@_traced("registry.write")
+def _write_registry_data(
+    data: Dict, changed: Union[List[str], None] = None
+) -> NoReturn:
+    """
+    Writes the registry through the storage backend and refreshes the
+    in-process cache so the next read does not load the registry again.
+
+    Args:
+        data (dict): The complete registry contents.
+
+        changed (list): Optional. Names of the projects that were added,
+         updated or removed. Backends that store projects separately only
+         write these. Default is None, which writes everything.
+    """
+    backend = _get_registry_backend()
+    with _REGISTRY_CACHE_LOCK:
+        backend.save(data, changed)
+        key = _get_file_signature(backend.path)
+        _REGISTRY_CACHE["key"] = key
+        _REGISTRY_CACHE["data"] = data if key is not None else None
+
+
+def _get_registry_project(name: str) -> Union[Dict, None]:
+    """
+    Returns the registry fields of one project, or None if it is not in
+    the registry. The cached registry is used while it is current. Otherwise
+    backends with row access read just this project, and the full registry
+    is not loaded.
+
+    The returned dictionary must not be modified in place.
+
+    Args:
+        name (str): Project name.
+    """
+    backend = _get_registry_backend()
+    if not backend.ROW_ACCESS:
+        return _get_registry_data().get(name)
+    key = _get_file_signature(backend.path)
+    with _REGISTRY_CACHE_LOCK:
+        if key is not None and key == _REGISTRY_CACHE["key"]:
+            _REGISTRY_CACHE_STATS["hits"] += 1
+            return _REGISTRY_CACHE["data"].get(name)
+    return backend.load_projects([name]).get(name)
+
+
+def _write_registry_rows(rows: Dict, changed: List[str]) -> NoReturn:
+    """
+    Writes the changed projects through a backend with row access. The
+    cached registry is updated in place if it was current, otherwise it is
+    dropped. Call this while holding '_registry_lock'.
+
+    Args:
+        rows (dict): Registry fields of the changed projects. Changed
+         projects missing from 'rows' are deleted.
+
+        changed (list): Names of the projects that were added, updated or
+         removed.
+    """
+    backend = _get_registry_backend()
+    with _REGISTRY_CACHE_LOCK:
+        key = _get_file_signature(backend.path)
+        current = key is not None and key == _REGISTRY_CACHE["key"]
+        backend.save(rows, changed)
+        if not current:
+            _REGISTRY_CACHE["key"] = None
+            _REGISTRY_CACHE["data"] = None
+            return
+        data = dict(_REGISTRY_CACHE["data"])
+        for name in changed:
+            if name in rows:
+                data[name] = rows[name]
+            else:
+                data.pop(name, None)
+        _REGISTRY_CACHE["key"] = _get_file_signature(backend.path)
+        _REGISTRY_CACHE["data"] = data
+
+
+def _initialize_registry() -> NoReturn:
+    """
+    Creates the application data folder and an empty registry if they
+    do not exist yet. With the SQLite backend this also migrates an
+    existing JSON registry.
+    """
+    if not os.path.exists(_get_appdata_folder()):
+        os.makedirs(_get_appdata_folder())
+    _get_registry_backend().initialize()
+
+
+def _find_projects(field: str, value: str) -> List[str]:
+    """
+    Returns the names of all projects whose registry field equals the
+    given value, e.g. all projects with 'deployment_status' 'Deployed'.
+
+    Args:
+        field (str): Registry field name.
+
+        value (str): Value to match.
+
+    Returns:
+        (list): Matching project names.
+    """
+    backend = _get_registry_backend()
+    if backend.ROW_ACCESS:
+        return backend.find(field, value)
+    return [k for k, v in _get_registry_data().items() if v.get(field) == value]
+
+
+@contextmanager
+def _registry_lock() -> Iterator[None]:
+    """
+    Holds an exclusive advisory lock on the registry so that concurrent
+    'mldeploy' processes do not overwrite each other's changes. Blocks
+    until the lock is available.
+    """
+    appdata_folder = _get_appdata_folder()
+    if not os.path.exists(appdata_folder):
+        # No registry yet, nothing to protect.
+        yield
+        return
+    lock_path = appdata_folder + "/" + _get_constant("REG_LOCK_FILE_NAME")
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+
+class _RegistryTransaction:
+    """
+    Collects changes to the registry so they can be committed with a
+    single write. Use through '_registry_transaction', or call 'commit'
+    directly to write the changes recorded so far. Changes may be recorded
+    from several threads.
+    """
+
+    def __init__(self):
+        self.changes = []
+        self._lock = threading.Lock()
+
+    def set_field(self, name: str, field_name: str, contents: str) -> NoReturn:
+        """Adds or updates a field for an existing project."""
+        with self._lock:
+            self.changes.append(("set", name, field_name, contents))
+
+    def add_project(self, name: str, fields: Dict) -> NoReturn:
+        """Adds a project, replacing any existing entry with the same name."""
+        with self._lock:
+            self.changes.append(("add", name, None, dict(fields)))
+
+    def delete_project(self, name: str) -> NoReturn:
+        """Removes a project from the registry if it exists."""
+        with self._lock:
+            self.changes.append(("delete", name, None, None))
+
+    def commit(self) -> NoReturn:
+        """
+        Writes the changes recorded so far: the registry is re-read under
+        the registry lock, the changes are applied, and the result is
+        written once. The transaction is empty afterwards.
+        """
+        with self._lock:
+            changes, self.changes = self.changes, []
+        if len(changes) == 0:
+            return
+        pending = _RegistryTransaction()
+        pending.changes = changes
+        with _trace_span("registry.commit", changes=len(changes)), _registry_lock():
+            if _get_registry_backend().ROW_ACCESS:
+                # Only the rows of the changed projects are read and written.
+                rows = _get_registry_backend().load_projects([c[1] for c in changes])
+                new_rows, changed = pending.apply(rows)
+                _write_registry_rows(new_rows, changed)
+            else:
+                new_data, changed = pending.apply(_get_registry_data())
+                _write_registry_data(new_data, changed=changed)
+
+    def apply(self, reg_data: Dict) -> (Dict, List[str]):
+        """
+        Applies the collected changes to a copy of the registry.
+
+        Args:
+            reg_data (dict): The current registry contents.
+
+        Fields set on a project that is no longer in the registry, e.g.
+        one deleted while the transaction was open, are skipped so the
+        changes to other projects are still written.
+
+        Returns:
+            (dict, list): The updated registry and the changed project names.
+        """
+        new_data = dict(reg_data)
+        changed = []
+        for action, name, field_name, contents in self.changes:
+            if action == "set":
+                if name not in new_data:
+                    continue
+                new_data[name] = dict(new_data[name])
+                new_data[name][field_name] = contents
+            elif action == "add":
+                new_data[name] = contents
+            else:
+                new_data.pop(name, None)
+            if name not in changed:
+                changed.append(name)
+        return new_data, changed
+
+
+@contextmanager
+def _registry_transaction() -> Iterator[_RegistryTransaction]:
+    """
+    Unit of work for the registry. Changes recorded on the yielded
+    transaction are committed when the block exits without an error:
+    the registry is re-read under the registry lock, all changes are
+    applied, and the result is written once.
+
+    Example:
+        with _registry_transaction() as txn:
+            txn.set_field(name, "stack_name", stack_name)
+            txn.set_field(name, "stack_id", stack_id)
+    """
+    txn = _RegistryTransaction()
+    yield txn
+    txn.commit()
+
+
+def _clear_registry_cache() -> NoReturn:
+    """
+    Drops the cached registry so the next read parses the file again.
+    """
+    with _REGISTRY_CACHE_LOCK:
+        _REGISTRY_CACHE["key"] = None
+        _REGISTRY_CACHE["data"] = None
+
+
+def _get_registry_cache_stats() -> Dict:
+    """
+    Returns counters for the registry cache.
+
+    Returns:
+        (dict): The number of times the registry file was parsed ('parses')
+         and the number of parses avoided by the cache ('hits').
+    """
+    with _REGISTRY_CACHE_LOCK:
+        return dict(_REGISTRY_CACHE_STATS)
+
+
 def _get_field_if_exists(name: str, field: str) -> str:
     """
     Returns the contents of the field from the registry if
@@ -131,12 +948,12 @@ def _get_field_if_exists(name: str, field: str) -> str:
     Raises:
         ValueError: If the project name is not in the registry.
     """
-    reg_data = _get_registry_data()
-    if name not in reg_data.keys():
+    fields = _get_registry_project(name)
+    if fields is None:
         raise ValueError(f"Project '{name}' not found in registry.")
     contents = "(None)"
-    if field in reg_data[name].keys():
-        contents = reg_data[name][field]
+    if field in fields.keys():
+        contents = fields[field]
     if len(contents) == 0:
         contents = "(None)"
     return contents
@@ -154,12 +971,10 @@ def _add_field_to_registry(name: str, field_name: str, contents: str) -> NoRetur
 
         contents (str): The value field to add or update in the registry.
     """
-    reg_data = _get_registry_data()
-    if name not in reg_data.keys():
+    if _get_registry_project(name) is None:
         raise ValueError(f"Project '{name}' not found in registry.")
-    reg_data[name][field_name] = contents
-    with open(_get_registry_path(), "w") as f:
-        json.dump(reg_data, f)
+    with _registry_transaction() as txn:
+        txn.set_field(name, field_name, contents)
 
 
 def _add_salt(length: int = 4) -> str:
@@ -191,35 +1006,299 @@ def _get_project_folder(name: str) -> str:
     Returns:
         (str): The path of the project folder.
     """
-    reg_data = _get_registry_data()
-    return reg_data[name]["location"]
+    return _get_registry_project(name)["location"]
 
 
 # =============================================================================
 # Configuration file utilities.
 # -----------------------------------------------------------------------------
+# Parsed YAML files keyed on (path, loader type), validated against the
+# file's stat signature, and one loader instance per loader type.
+_YAML_CACHE = {}
+_YAML_LOADERS = {}
+_YAML_LOCK = threading.RLock()
+
+
+def _get_yaml_loader(typ: str = "safe") -> "ryml.YAML":
+    """
+    Returns a shared 'ruamel.yaml' loader. The 'safe' loader uses the
+    C-based parser when available and returns plain Python objects; the
+    'rt' (round-trip) loader keeps comments and formatting and should only
+    be used when the file will be written back.
+
+    Args:
+        typ (str): Loader type, 'safe' or 'rt'. Default is 'safe'.
+
+    Returns:
+        (ruamel.yaml.YAML): The loader.
+    """
+    if typ not in _YAML_LOADERS:
+        import ruamel.yaml as ryml  # Allows modification of YAML file without disrupting comments.
+
+        _YAML_LOADERS[typ] = ryml.YAML(typ=typ)
+    return _YAML_LOADERS[typ]
+
+
+def _load_yaml_cached(path: str, typ: str = "safe") -> Any:
+    """
+    Loads a YAML file, reusing the parsed contents while the file is
+    unchanged on disk. The returned object is shared and must be treated
+    as read-only.
+
+    Args:
+        path (str): Path to the YAML file.
+
+        typ (str): Loader type, see '_get_yaml_loader'. Default is 'safe'.
+
+    Returns:
+        (Any): The parsed contents of the file.
+    """
+    key = _get_file_signature(path)
+    with _YAML_LOCK:
+        cached = _YAML_CACHE.get((path, typ))
+        if key is not None and cached is not None and cached[0] == key:
+            return cached[1]
+        with _trace_span("yaml.parse", path=path), open(path, "r") as f:
+            data = _get_yaml_loader(typ).load(f)
+        if key is not None:
+            _YAML_CACHE[(path, typ)] = (key, data)
+    return data
+
+
+def _dump_yaml(data: Any) -> str:
+    """
+    Returns 'data' as YAML, written with the shared round-trip loader so
+    comments and tags from parsed files are kept.
+
+    Args:
+        data (Any): Data to dump.
+    """
+    stream = io.StringIO()
+    with _YAML_LOCK:
+        _get_yaml_loader("rt").dump(data, stream)
+    return stream.getvalue()
+
+
 def _get_config_data(name: str) -> Dict:
     """
     Given the project name and the field name(s), returns a dictionary
     with the contents of the 'config.yml' file.
 
+    The file is parsed with the fast read-only loader and cached until
+    it changes, so the returned dictionary must not be modified.
+
     Args:
         name (str): Project name.
 
     Returns:
         (dict): Contents of 'config.yml'.
     """
-    yaml_obj = ryml.YAML()
     project_path = _get_project_folder(name)
     config_file = project_path + "/config.yml"
-    with open(config_file, "r") as f:
-        doc = yaml_obj.load(f)
-    return doc
+    return _load_yaml_cached(config_file)
+
+
+class _ProjectConfig:
+    """
+    Typed, validated view of a project's 'config.yml'. Built once per
+    config file version by '_get_project_config'; attribute names are the
+    config keys with '-' replaced by '_'.
+
+    Args:
+        data (dict): Contents of 'config.yml'.
+
+    Raises:
+        ValueError: If any value is missing, has the wrong type, or is
+         inconsistent. All problems are reported together.
+    """
+
+    # (config key, type, default). Defaults follow 'default_config.yml',
+    # except 'replace-image-on-rebuild' which is off unless set.
+    FIELDS = (
+        ("project-name", str, None),
+        ("python-version", str, None),
+        ("base-image", str, None),
+        ("base-image-ttl", int, 24),
+        ("main-file", str, None),
+        ("add-files", list, []),
+        ("docker-file", str, None),
+        ("docker-image", str, None),
+        ("replace-image-on-rebuild", bool, False),
+        ("image-retention-count", int, 3),
+        ("image-retention-days", int, None),
+        ("apt-packages", list, []),
+        ("docker-buildkit", bool, False),
+        ("docker-multistage", bool, False),
+        ("use-wheelhouse", bool, False),
+        ("docker-slim", bool, False),
+        ("docker-precompile", bool, False),
+        ("profile-imports", bool, False),
+        ("context-size-limit-mb", float, None),
+        ("aws-region", str, "eu-north-1"),
+        ("cloudformation-fragments", list, []),
+        ("number-availability-zones", int, 2),
+        ("deployment-type", str, "fargate"),
+        ("use-autoscaling", bool, True),
+        ("min-instances", int, 1),
+        ("target-instances", int, 1),
+        ("max-instances", int, 3),
+        ("increase-delay", int, 10),
+        ("decrease-delay", int, 300),
+        ("max-jobs-per-instance-before-scaleup", int, None),
+        ("min-jobs-per-instance-before-scaledown", int, None),
+        ("min-cpus", float, 1.0),
+        ("min-ram", float, 1.0),
+    )
+    DEPLOYMENT_TYPES = ("fargate", "ec2")
+
+    __slots__ = tuple(key.replace("-", "_") for key, _, _ in FIELDS)
+
+    def __init__(self, data: Dict):
+        data = data if data is not None else {}
+        errors = []
+        for key, typ, default in self.FIELDS:
+            value = data.get(key)
+            if value is None:
+                value = list(default) if isinstance(default, list) else default
+            else:
+                try:
+                    value = self._coerce(value, typ)
+                except (TypeError, ValueError):
+                    errors.append(
+                        f"'{key}' must be of type {typ.__name__}, got: {value!r}"
+                    )
+                    value = default
+            setattr(self, key.replace("-", "_"), value)
+        errors.extend(self._check())
+        if len(errors) > 0:
+            raise ValueError("Invalid project configuration:\n\t" + "\n\t".join(errors))
+
+    @staticmethod
+    def _coerce(value: Any, typ: type) -> Any:
+        """Converts a YAML value to the field type."""
+        if typ is bool:
+            if isinstance(value, bool):
+                return value
+            if str(value).lower() in ("yes", "true", "on", "1"):
+                return True
+            if str(value).lower() in ("no", "false", "off", "0"):
+                return False
+            raise ValueError(value)
+        if typ is list:
+            if not isinstance(value, list):
+                raise TypeError(value)
+            return [str(v) for v in value if v is not None]
+        if typ in (int, float) and isinstance(value, bool):
+            raise TypeError(value)
+        if typ is int and isinstance(value, float) and not value.is_integer():
+            raise ValueError(value)
+        if typ is str and isinstance(value, (list, dict)):
+            raise TypeError(value)
+        return typ(value)
+
+    def _check(self) -> List[str]:
+        """Returns a list of problems with the combined values."""
+        errors = []
+        if not (self.base_image or self.docker_image or self.docker_file):
+            errors.append(
+                "'base-image' is required unless 'docker-image' or 'docker-file' is set."
+            )
+        self.deployment_type = str(self.deployment_type).lower()
+        if self.deployment_type not in self.DEPLOYMENT_TYPES:
+            errors.append(
+                f"'deployment-type' must be one of {self.DEPLOYMENT_TYPES}, got: '{self.deployment_type}'"
+            )
+        for key in (
+            "base-image-ttl",
+            "image-retention-count",
+            "image-retention-days",
+            "number-availability-zones",
+            "min-instances",
+            "target-instances",
+            "max-instances",
+            "increase-delay",
+            "decrease-delay",
+        ):
+            value = getattr(self, key.replace("-", "_"))
+            if isinstance(value, int) and value < 0:
+                errors.append(f"'{key}' must not be negative, got: {value}")
+        if (
+            isinstance(self.number_availability_zones, int)
+            and self.number_availability_zones < 1
+        ):
+            errors.append("'number-availability-zones' must be at least 1.")
+        for key in ("min-cpus", "min-ram", "context-size-limit-mb"):
+            value = getattr(self, key.replace("-", "_"))
+            if isinstance(value, float) and value <= 0:
+                errors.append(f"'{key}' must be greater than 0, got: {value}")
+        if all(
+            isinstance(v, int)
+            for v in (self.min_instances, self.target_instances, self.max_instances)
+        ):
+            if self.max_instances < self.min_instances:
+                errors.append(
+                    f"'max-instances' ({self.max_instances}) must not be less than 'min-instances' ({self.min_instances})."
+                )
+            elif not (
+                self.min_instances <= self.target_instances <= self.max_instances
+            ):
+                errors.append(
+                    f"'target-instances' ({self.target_instances}) must be between 'min-instances' and 'max-instances'."
+                )
+        return errors
+
+
+# Compiled configs per project, stored with the parsed data they were
+# built from. '_get_config_data' returns the same object while the file
+# is unchanged, so identity tells whether a config is still current.
+_PROJECT_CONFIGS = {}
+
+
+def _get_project_config(name: str) -> _ProjectConfig:
+    """
+    Returns the validated configuration for the project. The config is
+    compiled once per version of 'config.yml'.
+
+    Args:
+        name (str): Project name.
+
+    Returns:
+        (_ProjectConfig): The project configuration.
+
+    Raises:
+        ValueError: If the configuration is invalid.
+    """
+    data = _get_config_data(name)
+    cached = _PROJECT_CONFIGS.get(name)
+    if cached is not None and cached[0] is data:
+        return cached[1]
+    config = _ProjectConfig(data)
+    _PROJECT_CONFIGS[name] = (data, config)
+    return config
+
+
+def _check_project_config(name: str) -> _ProjectConfig:
+    """
+    Validates the project configuration before any slow work starts.
+    If it is invalid, throws a failure message and exits.
+
+    Args:
+        name (str): Project name.
+
+    Returns:
+        (_ProjectConfig): The project configuration.
+    """
+    try:
+        return _get_project_config(name)
+    except ValueError as e:
+        print(f"{_get_constant('FAIL_PREFIX')}Project '{name}': {e}")
+        sys.exit(1)
 
 
 # =============================================================================
 # Docker image handling utilities.
 # -----------------------------------------------------------------------------
+@_traced()
 def _delete_docker_image(name: str, deleting_project: bool = False) -> NoReturn:
     """
     Deletes the currently registered image from the local Docker
@@ -234,19 +1313,15 @@ def _delete_docker_image(name: str, deleting_project: bool = False) -> NoReturn:
          is False which lets the checks happen.
     """
     # Get Docker image name.
-    reg_data = _get_registry_data()
-    config_data = _get_config_data(name)
-    if "docker-image" in reg_data[name].keys():
-        reg_docker_image = reg_data[name]["docker-image"]
+    fields = _get_registry_project(name)
+    if "docker-image" in fields.keys():
+        reg_docker_image = fields["docker-image"]
     else:
         # Exit function if no registered docker image.
         return
-    base_docker_image = config_data["base-image"]
-
-    if "docker-image" in config_data.keys():
-        custom_image = config_data["docker-image"]
-    else:
-        custom_image = ""
+    config = _get_project_config(name)
+    base_docker_image = config.base_image
+    custom_image = config.docker_image if config.docker_image is not None else ""
 
     delete_existing = False
     # Check if this is part of removing a project.
@@ -258,26 +1333,26 @@ def _delete_docker_image(name: str, deleting_project: bool = False) -> NoReturn:
     else:
         # Check if image should be deleted: if rebuild is not allowed
         # or custom image is found.
-        if "replace-image-on-rebuild" in config_data.keys():
-            delete_existing = config_data["replace-image-on-rebuild"]
-        else:
-            delete_existing = False
+        delete_existing = config.replace_image_on_rebuild
         if (len(custom_image) > 0) | (custom_image == reg_docker_image):
             delete_existing = False
 
     # Execute delete if allowed.
     if delete_existing:
+        import docker
+
         client = docker.from_env()
-        im_list = [im.tags[0] for im in client.images.list() if len(im.tags) > 0]
-        if reg_docker_image in im_list:
-            client.images.remove(reg_docker_image)
-            print(
-                f"{_get_constant('MSG_PREFIX')}Deleting existing project image: {reg_docker_image}"
-            )
-        else:
+        try:
+            client.images.get(reg_docker_image)
+        except docker.errors.ImageNotFound:
             print(
                 f"{_get_constant('FAIL_PREFIX')}Project image '{reg_docker_image}' not found."
             )
+            return
+        client.images.remove(reg_docker_image)
+        print(
+            f"{_get_constant('MSG_PREFIX')}Deleting existing project image: {reg_docker_image}"
+        )
     else:
         print(
             f"{_get_constant('MSG_PREFIX')}Project image '{reg_docker_image}' was not deleted."
@@ -285,53 +1360,198 @@ def _delete_docker_image(name: str, deleting_project: bool = False) -> NoReturn:
 
 
 # =============================================================================
-# File handling utilities.
+# Content hashing utilities.
 # -----------------------------------------------------------------------------
-def _temp_copy_local_files(name: str) -> NoReturn:
+# Digests of files already hashed, keyed on path and validated against the
+# file's stat signature. Persisted in the application data folder so large
+# unchanged files (e.g. model weights) are not read again on the next build.
+_FILE_DIGESTS = {"loaded": False, "dirty": False, "data": {}}
+_FILE_DIGESTS_LOCK = threading.RLock()
+
+
+def _get_file_digest_cache_path() -> str:
+    """
+    Returns the path of the persisted file digest cache.
     """
-    Temporarily copies the files (ignores repos to clone) to the
-    project folder /tmp directory. This must be done because the Docker
-    build command uses only the relative path and cannot pull files from
-    local root.
+    return _get_appdata_folder() + "/" + _get_constant("FILE_DIGEST_CACHE_NAME")
+
+
+def _get_file_digest(path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's contents. The file is only
+    read if it changed since it was last hashed.
 
     Args:
-        name (str): Project name.
+        path (str): Path to the file.
 
-    Raises:
-        ValueError: If the object to copy is neither a file nor a directory.
-    """
-    # Get files to copy from the project's config file.
-    conf_data = _get_config_data(name)
-    if "add-files" in conf_data.keys():
-        if conf_data["add-files"] is not None:
-            local_files = [f for f in conf_data["add-files"] if not f.endswith(".git")]
-            # Project folder gets a tmp folder.
-            dst = _get_project_folder(name) + "/tmp"
-            if not os.path.exists(dst):
-                os.mkdir(dst)
-            for src_i in local_files:
-                # Check if file or folder and copy appropriately.
-                dst_i = dst + "/" + src_i.rsplit("/", 1)[-1]
-                if os.path.isdir(src_i):
-                    shutil.copytree(src_i, dst_i)
-                elif os.path.isfile(src_i):
-                    shutil.copy(src_i, dst_i)
-                else:
-                    raise ValueError(
-                        f"{_get_constant('FAIL_PREFIX')}Unknown object to copy: {src_i}"
-                    )
+    Returns:
+        (str): The hex digest.
+    """
+    path = os.path.abspath(path)
+    sig = list(_get_file_signature(path)[1:4])
+    with _FILE_DIGESTS_LOCK:
+        if not _FILE_DIGESTS["loaded"]:
+            try:
+                with open(_get_file_digest_cache_path(), "r") as f:
+                    _FILE_DIGESTS["data"] = json.load(f)
+            except (OSError, ValueError):
+                _FILE_DIGESTS["data"] = {}
+            _FILE_DIGESTS["loaded"] = True
+        cached = _FILE_DIGESTS["data"].get(path)
+        if cached is not None and cached[:3] == sig:
+            return cached[3]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, 1 << 20), b""):
+            digest.update(chunk)
+    with _FILE_DIGESTS_LOCK:
+        _FILE_DIGESTS["data"][path] = sig + [digest.hexdigest()]
+        _FILE_DIGESTS["dirty"] = True
+    return digest.hexdigest()
+
+
+def _save_file_digest_cache() -> NoReturn:
+    """
+    Writes new file digests to the application data folder. Failing to
+    save only means the files are hashed again next time.
+    """
+    with _FILE_DIGESTS_LOCK:
+        if not _FILE_DIGESTS["dirty"] or not os.path.exists(_get_appdata_folder()):
+            return
+        cache_path = _get_file_digest_cache_path()
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(_FILE_DIGESTS["data"], f)
+            os.replace(tmp_path, cache_path)
+            _FILE_DIGESTS["dirty"] = False
+        except OSError:
+            pass
 
 
-def _remove_temp_files(name: str) -> NoReturn:
+@_traced()
+def _get_tree_digest(path: str) -> str:
     """
-    Delete everything in the /tmp folder of the project directory.
+    Returns a SHA-256 hex digest over a file or over all files below a
+    folder, including their paths relative to the folder.
 
     Args:
-        name (str): Project name.
+        path (str): Path to a file or folder.
+
+    Returns:
+        (str): The hex digest.
+    """
+    if os.path.isfile(path):
+        return _get_file_digest(path)
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for fname in sorted(files):
+            fpath = os.path.join(root, fname)
+            rel_path = os.path.relpath(fpath, path).replace(os.sep, "/")
+            if os.path.isfile(fpath):
+                digest.update(f"{rel_path}\0{_get_file_digest(fpath)}\n".encode())
+    return digest.hexdigest()
+
+
+# =============================================================================
+# Cache file utilities.
+# -----------------------------------------------------------------------------
+def _read_json_file(path: str, default: Any = None) -> Any:
+    """
+    Returns the contents of a JSON cache file, or 'default' if the file
+    is missing or unreadable.
+
+    Args:
+        path (str): Path to the file.
+
+        default (any): Value returned if the file cannot be read.
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json_file(path: str, data: Any) -> NoReturn:
+    """
+    Writes a JSON cache file through a temporary file, so that concurrent
+    readers never see a partially written file.
+
+    Args:
+        path (str): Path to the file.
+
+        data (any): JSON serializable contents.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# =============================================================================
+# Output utilities.
+# -----------------------------------------------------------------------------
+class _ThreadOutput:
+    """
+    Stand-in for 'sys.stdout' while several projects are processed in
+    worker threads. Output from a thread that called 'capture' is kept in
+    that thread's buffer; all other output goes to the real stdout.
+
+    Args:
+        stream (file): The real stdout.
     """
-    temp_loc = _get_project_folder(name) + "/tmp"
-    if os.path.exists(temp_loc):
-        shutil.rmtree(temp_loc)
+
+    def __init__(self, stream: Any):
+        self.stream = stream
+        self._buffers = {}
+
+    def capture(self) -> NoReturn:
+        """Starts buffering the output of the current thread."""
+        self._buffers[threading.get_ident()] = io.StringIO()
+
+    def release(self) -> str:
+        """Stops buffering the current thread and returns its output."""
+        buffer = self._buffers.pop(threading.get_ident(), None)
+        return buffer.getvalue() if buffer is not None else ""
+
+    def write(self, text: str) -> int:
+        buffer = self._buffers.get(threading.get_ident())
+        if buffer is not None:
+            return buffer.write(text)
+        return self.stream.write(text)
+
+    def flush(self) -> NoReturn:
+        self.stream.flush()
+
+    def isatty(self) -> bool:
+        # Buffered output is shown later, so it is never a terminal.
+        if threading.get_ident() in self._buffers:
+            return False
+        return self.stream.isatty()
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.stream, attr)
+
+
+@contextmanager
+def _thread_output() -> Iterator[_ThreadOutput]:
+    """
+    Routes 'sys.stdout' through a '_ThreadOutput' inside the block.
+    """
+    router = _ThreadOutput(sys.stdout)
+    sys.stdout = router
+    try:
+        yield router
+    finally:
+        sys.stdout = router.stream
 
 
 # =============================================================================
@@ -397,14 +1617,76 @@ def _check_for_project_name_and_exists(name: str) -> str:
     # Get project name if name not provided.
     proj_name = os.getcwd().rsplit("/", 1)[1] if len(name) <= 0 else name
     # Get list of registered projects.
-    registerd_projects = list(_get_registry_data().keys())
-    if proj_name not in registerd_projects:
+    if _get_registry_project(proj_name) is None:
         print(f"{_get_constant('FAIL_PREFIX')}Project '{proj_name}' does not exist.")
         sys.exit()
     else:
         return proj_name
 
 
+def _get_slowest_build_steps(path: str, count: int = 5) -> List[Dict]:
+    """
+    Returns the slowest steps recorded in a JSON lines build step log.
+
+    Args:
+        path (str): Path to the step log.
+
+        count (int): Maximum number of steps to return.
+
+    Returns:
+        (list): Step records, slowest first. Empty if the log is missing.
+    """
+    steps = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("type") == "step":
+                    steps.append(record)
+    except (OSError, ValueError):
+        return []
+    return sorted(steps, key=lambda s: s["seconds"], reverse=True)[:count]
+
+
+def _format_build_steps(name: str) -> str:
+    """
+    Formats the slowest steps of the project's last Docker build for the
+    status display.
+
+    Args:
+        name (str): Project name.
+    """
+    step_log = _get_registry_project(name).get(_get_constant("BUILD_STEP_LOG_KEY"))
+    steps = _get_slowest_build_steps(step_log) if step_log else []
+    if len(steps) == 0:
+        return "\tSlowest build steps: None\n"
+    lines = ["\tSlowest build steps:\n"]
+    for step in steps:
+        cached = " (cached)" if step["cached"] else ""
+        instruction = step["instruction"]
+        if len(instruction) > 60:
+            instruction = instruction[:57] + "..."
+        lines.append(f"\t\t{step['seconds']:7.1f}s  {instruction}{cached}\n")
+    return "".join(lines)
+
+
+def _format_image_size(name: str) -> str:
+    """
+    Formats the size of the project's Docker image, and the change since
+    the previous build, for the status display.
+
+    Args:
+        name (str): Project name.
+    """
+    data = _get_registry_project(name)
+    size = data.get(_get_constant("IMAGE_SIZE_KEY"))
+    if size is None:
+        return "\tImage size: None\n"
+    previous = data.get(_get_constant("IMAGE_SIZE_PREVIOUS_KEY"))
+    change = "" if previous is None else f" ({(size - previous) / 1e6:+.1f} MB)"
+    return f"\tImage size: {size / 1e6:.1f} MB{change}\n"
+
+
 def _print_project_status(name: str) -> NoReturn:
     """
     Displays the project status.
@@ -419,7 +1701,10 @@ def _print_project_status(name: str) -> NoReturn:
         + f"\tProject folder: {_get_project_folder(name)}\n\n"
         + f"DOCKER\n------\n"
         + f"\tDocker image: {_get_field_if_exists(name, _get_constant('DOCKER_IMAGE_KEY'))}\n"
-        + f"\tDocker build logs: {_get_project_folder(name)+_get_constant('DOCKER_LOG_FOLDER')}\n\n"
+        + f"\tDocker build logs: {_get_project_folder(name)+_get_constant('DOCKER_LOG_FOLDER')}\n"
+        + _format_image_size(name)
+        + _format_build_steps(name)
+        + "\n"
         + f"CLOUDFORMATION\n--------------\n"
         + f"\tDeployment status: {_get_field_if_exists(name, _get_constant('DEPLOY_STATUS_KEY'))}\n"
         + f"\tCloudFormation template: {_get_field_if_exists(name, _get_constant('CLOUDFORMATION_LOCATION_KEY'))}\n"
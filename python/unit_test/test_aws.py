@@ -0,0 +1,606 @@
+# =============================================================================
+# TEST_AWS.PY
+# -----------------------------------------------------------------------------
+# Unit tests for the 'aws.py' file.
+#
+# -----------------------------------------------------------------------------
+# Author: kingfischer16 (https://github.com/kingfischer16/mldeploy)
+# =============================================================================
+
+# =============================================================================
+# Imports.
+# -----------------------------------------------------------------------------
+from datetime import datetime
+import io
+import os
+import tempfile
+import threading
+import time
+from unittest import mock, TestCase
+
+import sys
+
+mld_path = str(os.path.realpath(__file__)).rsplit("/", 2)[0]
+sys.path.insert(0, mld_path)
+from mldeploy import aws
+
+
+# =============================================================================
+# Unit tests for CloudFormation template manipulations.
+# -----------------------------------------------------------------------------
+class TestTemplateBuilder(TestCase):
+    """
+    Test case for 'mldeploy.aws._TemplateBuilder'.
+    """
+
+    def test_fragment_merged_with_tags(self):
+        """
+        Tests that fragments keep intrinsic function tags, get parameter
+        defaults and are not modified by merging.
+        """
+        fragment = aws._load_deploy_template("create_s3_bucket")
+        self.assertIs(aws._load_deploy_template("create_s3_bucket.yml"), fragment)
+        template = aws._TemplateBuilder("Test template.")
+        template.add_fragment(fragment, {"ProjectName": "proj"})
+        template.add_fragment(fragment, {"ProjectName": "proj"})
+        text = template.to_yaml()
+        self.assertIn('BucketName: !Sub "mldeploy-${ProjectName}"', text)
+        self.assertIn("Value: !GetAtt S3ProjectBucket.Arn", text)
+        self.assertEqual(template.data["Parameters"]["ProjectName"]["Default"], "proj")
+        self.assertNotIn("Default", fragment["Parameters"]["ProjectName"])
+
+    def test_clashing_entries(self):
+        """
+        Tests that a different entry with the same name is refused.
+        """
+        template = aws._TemplateBuilder("Test template.")
+        template.add_resource("Bucket", {"Type": "AWS::S3::Bucket"})
+        template.add_resource("Bucket", {"Type": "AWS::S3::Bucket"})
+        with self.assertRaises(ValueError):
+            template.add_resource("Bucket", {"Type": "AWS::EC2::Instance"})
+
+    def test_unknown_fragment(self):
+        """
+        Tests that a missing fragment raises a ValueError.
+        """
+        with self.assertRaises(ValueError):
+            aws._load_deploy_template("no_such_fragment")
+
+    @mock.patch("mldeploy.aws._add_field_to_registry")
+    @mock.patch("mldeploy.aws._get_project_config")
+    @mock.patch("mldeploy.aws._get_field_if_exists")
+    def test_create_cloudformation_file(self, mock_field, mock_config, mock_add_field):
+        """
+        Tests that the template is built from the configuration and
+        written once.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_field.side_effect = lambda name, key: {
+                "location": tmp_dir,
+                "salt": "abc",
+            }[key]
+            mock_config.return_value.aws_region = "eu-north-1"
+            mock_config.return_value.cloudformation_fragments = ["create_s3_bucket"]
+            aws._create_cloudformation_file("proj")
+            path = tmp_dir + "/.cloudformation.yml"
+            mock_add_field.assert_called_once_with(
+                "proj", "cloudformation_template", path
+            )
+            with open(path, "r") as f:
+                text = f.read()
+            self.assertIn("BucketName: proj-store-abc", text)
+            self.assertIn("EC2proj01:", text)
+            self.assertIn("S3ProjectBucket:", text)
+            self.assertEqual(os.listdir(tmp_dir), [".cloudformation.yml"])
+            with self.assertRaises(FileExistsError):
+                aws._create_cloudformation_file("proj")
+
+    @mock.patch("mldeploy.aws._add_field_to_registry")
+    @mock.patch("mldeploy.aws._get_project_config")
+    @mock.patch("mldeploy.aws._get_field_if_exists")
+    def test_render_follows_config(self, mock_field, mock_config, mock_add_field):
+        """
+        Tests that rendering picks up configuration changes and rewrites
+        the registered template.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = tmp_dir + "/.cloudformation.yml"
+            mock_field.side_effect = lambda name, key: {
+                "location": tmp_dir,
+                "salt": "abc",
+                "cloudformation_template": path,
+            }[key]
+            mock_config.return_value.aws_region = "eu-north-1"
+            mock_config.return_value.cloudformation_fragments = []
+            with open(path, "w") as f:
+                f.write("old\n")
+            first = aws._render_cloudformation_template("proj")
+            self.assertNotIn("S3ProjectBucket:", first)
+            mock_config.return_value.cloudformation_fragments = ["create_s3_bucket"]
+            second = aws._render_cloudformation_template("proj")
+            self.assertIn("S3ProjectBucket:", second)
+            with open(path, "r") as f:
+                self.assertEqual(f.read(), second)
+            mock_add_field.assert_not_called()
+
+
+# =============================================================================
+# Unit tests for Nested stack templates.
+# -----------------------------------------------------------------------------
+class _LocalS3:
+    """
+    In-memory stand-in for the S3 client calls used by the upload, with
+    paged listings.
+    """
+
+    def __init__(self, page_size=2):
+        self.objects = {}
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.puts = []
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None):
+        keys = sorted(
+            k for (b, k) in self.objects if b == Bucket and k.startswith(Prefix)
+        )
+        start = int(ContinuationToken or 0)
+        page = keys[start : start + self.page_size]
+        response = {"Contents": [{"Key": k} for k in page], "IsTruncated": False}
+        if start + self.page_size < len(keys):
+            response["IsTruncated"] = True
+            response["NextContinuationToken"] = str(start + self.page_size)
+        return response
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with self.lock:
+            self.objects[(Bucket, Key)] = Body
+            self.puts.append(Key)
+
+
+class TestUploadNestedTemplates(TestCase):
+    """
+    Test case for 'mldeploy.aws._upload_nested_templates'.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.folder = self.tmp_dir.name
+        self._write(
+            "master.yml",
+            'A:\n  TemplateURL: !Sub "${Url}/cloudformation/network.yml"\n'
+            'B:\n  TemplateURL: !Sub "${Url}/cloudformation/api.yml"\n',
+        )
+        self._write("network.yml", "Resources: {}\n")
+        self._write("api.yml", "Resources: {}\nOutputs: {}\n")
+        self.client = _LocalS3()
+        self.addCleanup(self.tmp_dir.cleanup)
+        stdout = mock.patch("sys.stdout")
+        stdout.start()
+        self.addCleanup(stdout.stop)
+
+    def _write(self, filename, text):
+        with open(self.folder + "/" + filename, "w") as f:
+            f.write(text)
+
+    def _upload(self):
+        return aws._upload_nested_templates("bucket", self.client, folder=self.folder)
+
+    def test_unchanged_templates_not_uploaded(self):
+        """
+        Tests that a second upload of the same templates uploads nothing
+        and that changing a nested template changes the master key.
+        """
+        master_key, uploaded = self._upload()
+        self.assertEqual(len(uploaded), 3)
+        master = self.client.objects[("bucket", master_key)].decode()
+        for key in uploaded:
+            if key != master_key:
+                self.assertIn("${Url}/" + key + '"', master)
+        self.assertEqual(self._upload(), (master_key, []))
+        self._write("api.yml", "Resources: {}\n")
+        new_master_key, uploaded = self._upload()
+        self.assertNotEqual(new_master_key, master_key)
+        self.assertEqual(len(uploaded), 2)
+        self.assertEqual(len(self.client.puts), 5)
+
+
+# =============================================================================
+# Unit tests for Deployment control.
+# -----------------------------------------------------------------------------
+class TestUpdateStack(TestCase):
+    """
+    Test case for 'mldeploy.aws._update_stack'.
+    """
+
+    template = "Resources:\n  Bucket:\n    Type: AWS::S3::Bucket\n"
+
+    def setUp(self):
+        self.fields = {
+            "deployment_status": "Deployed",
+            "stack_name": "proj-mldeploy-abc",
+            "stack-template-hash": "old",
+        }
+        self.client = mock.MagicMock()
+        self.client.get_template.return_value = {"TemplateBody": "Resources: {}\n"}
+        self.client.describe_change_set.return_value = {
+            "Status": "CREATE_COMPLETE",
+            "Changes": [
+                {
+                    "ResourceChange": {
+                        "Action": "Modify",
+                        "LogicalResourceId": "Bucket",
+                        "ResourceType": "AWS::S3::Bucket",
+                        "Replacement": "True",
+                    }
+                }
+            ],
+        }
+        self.stdout = io.StringIO()
+        patchers = [
+            mock.patch.multiple(
+                "mldeploy.aws",
+                _get_field_if_exists=lambda name, key: self.fields.get(key, "(None)"),
+                _render_cloudformation_template=lambda name: self.template,
+                _add_field_to_registry=lambda name, key, value: self.fields.update(
+                    {key: value}
+                ),
+                _follow_stack=lambda *args, **kwargs: True,
+            ),
+            mock.patch("sys.stdout", self.stdout),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_changes_executed_and_recorded(self):
+        """
+        Tests that changes are shown with replacements, executed, and that
+        a second update stops locally.
+        """
+        self.assertTrue(aws._update_stack("proj", client=self.client))
+        self.client.execute_change_set.assert_called_once()
+        self.assertIn("Bucket  AWS::S3::Bucket  (replaced)", self.stdout.getvalue())
+        self.assertEqual(
+            self.fields["stack-template-hash"], aws._get_template_hash(self.template)
+        )
+        self.client.reset_mock()
+        self.assertFalse(aws._update_stack("proj", client=self.client))
+        self.assertEqual(self.client.mock_calls, [])
+
+    def test_dry_run(self):
+        """
+        Tests that a dry run deletes the change set without executing it.
+        """
+        self.assertFalse(aws._update_stack("proj", dry_run=True, client=self.client))
+        self.client.delete_change_set.assert_called_once()
+        self.client.execute_change_set.assert_not_called()
+        self.assertEqual(self.fields["stack-template-hash"], "old")
+
+    def test_deployed_template_unchanged(self):
+        """
+        Tests that no change set is created for the deployed template.
+        """
+        self.client.get_template.return_value = {"TemplateBody": self.template}
+        self.assertFalse(aws._update_stack("proj", client=self.client))
+        self.client.create_change_set.assert_not_called()
+
+    def test_change_set_without_changes(self):
+        """
+        Tests that an empty change set is deleted and not executed.
+        """
+        self.client.describe_change_set.return_value = {
+            "Status": "FAILED",
+            "StatusReason": "The submitted information didn't contain changes.",
+        }
+        self.assertFalse(aws._update_stack("proj", client=self.client))
+        self.client.delete_change_set.assert_called_once()
+        self.client.execute_change_set.assert_not_called()
+
+    def test_failed_change_set_deleted(self):
+        """
+        Tests that a change set that could not be created is deleted and
+        the error is raised.
+        """
+        self.client.describe_change_set.return_value = {
+            "Status": "FAILED",
+            "StatusReason": "Template format error",
+        }
+        with self.assertRaisesRegex(ValueError, "Template format error"):
+            aws._update_stack("proj", client=self.client)
+        self.client.delete_change_set.assert_called_once()
+        self.client.execute_change_set.assert_not_called()
+
+    def test_client_error_raised_as_value_error(self):
+        """
+        Tests that errors returned by AWS are raised as ValueErrors.
+        """
+        import botocore.exceptions
+
+        self.client.create_change_set.side_effect = botocore.exceptions.ClientError(
+            {"Error": {"Code": "ValidationError", "Message": "Bad template"}},
+            "CreateChangeSet",
+        )
+        with self.assertRaisesRegex(ValueError, "Bad template"):
+            aws._update_stack("proj", client=self.client)
+
+    def test_failed_update_raises(self):
+        """
+        Tests that a stack update that fails raises and is not recorded.
+        """
+        with mock.patch("mldeploy.aws._follow_stack", return_value=False):
+            with self.assertRaisesRegex(ValueError, "Update failed"):
+                aws._update_stack("proj", client=self.client)
+        self.assertEqual(self.fields["stack-template-hash"], "old")
+
+
+# =============================================================================
+# Unit tests for Stack events.
+# -----------------------------------------------------------------------------
+class _ScriptedCloudFormation:
+    """
+    Stand-in for 'describe_stack_events' that reveals one more event of a
+    stack on every call, newest first, with paged responses.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.revealed = {stack: 0 for stack in events}
+        self.lock = threading.Lock()
+
+    def describe_stack_events(self, StackName, NextToken=None):
+        with self.lock:
+            if NextToken is None:
+                self.revealed[StackName] = min(
+                    self.revealed[StackName] + 1, len(self.events[StackName])
+                )
+            visible = self.events[StackName][: self.revealed[StackName]][::-1]
+        start = int(NextToken or 0)
+        response = {"StackEvents": visible[start : start + 2]}
+        if start + 2 < len(visible):
+            response["NextToken"] = str(start + 2)
+        return response
+
+
+def _event(stack_name, event_id, logical, typ, status, physical="", seconds=0):
+    return {
+        "StackName": stack_name,
+        "EventId": event_id,
+        "LogicalResourceId": logical,
+        "ResourceType": typ,
+        "ResourceStatus": status,
+        "PhysicalResourceId": physical,
+        "Timestamp": datetime(2020, 1, 1, 0, 0, seconds),
+    }
+
+
+class TestStackEventFollower(TestCase):
+    """
+    Test case for 'mldeploy.aws._StackEventFollower'.
+    """
+
+    parent = "arn:aws:cloudformation:stack/proj/1"
+    nested = "arn:aws:cloudformation:stack/proj-Network/2"
+    stack_type = "AWS::CloudFormation::Stack"
+
+    def _client(self, parent_final="CREATE_COMPLETE"):
+        return _ScriptedCloudFormation(
+            {
+                self.parent: [
+                    _event(
+                        "proj",
+                        "p1",
+                        "proj",
+                        self.stack_type,
+                        "CREATE_IN_PROGRESS",
+                        self.parent,
+                        1,
+                    ),
+                    _event(
+                        "proj",
+                        "p2",
+                        "Network",
+                        self.stack_type,
+                        "CREATE_IN_PROGRESS",
+                        self.nested,
+                        2,
+                    ),
+                    _event(
+                        "proj",
+                        "p3",
+                        "Network",
+                        self.stack_type,
+                        "CREATE_COMPLETE",
+                        self.nested,
+                        5,
+                    ),
+                    _event(
+                        "proj",
+                        "p4",
+                        "proj",
+                        self.stack_type,
+                        parent_final,
+                        self.parent,
+                        6,
+                    ),
+                ],
+                self.nested: [
+                    _event(
+                        "proj-Network",
+                        "old",
+                        "Vpc",
+                        "AWS::EC2::VPC",
+                        "DELETE_COMPLETE",
+                        "vpc-0",
+                        0,
+                    ),
+                    _event(
+                        "proj-Network",
+                        "n1",
+                        "proj-Network",
+                        self.stack_type,
+                        "CREATE_IN_PROGRESS",
+                        self.nested,
+                        2,
+                    ),
+                    _event(
+                        "proj-Network",
+                        "n2",
+                        "Vpc",
+                        "AWS::EC2::VPC",
+                        "CREATE_FAILED",
+                        "vpc-1",
+                        3,
+                    ),
+                    _event(
+                        "proj-Network",
+                        "n3",
+                        "proj-Network",
+                        self.stack_type,
+                        "CREATE_COMPLETE",
+                        self.nested,
+                        4,
+                    ),
+                ],
+            }
+        )
+
+    @mock.patch.object(aws._StackEventFollower, "MIN_INTERVAL", 0.001)
+    @mock.patch.object(aws._StackEventFollower, "MAX_INTERVAL", 0.002)
+    def test_follow_nested_stacks(self):
+        """
+        Tests that nested stacks are followed, events are shown once and
+        the final status of the parent stack is returned.
+        """
+        follower = aws._StackEventFollower(self._client(), self.parent, live=False)
+        with mock.patch("sys.stdout", io.StringIO()) as stdout:
+            self.assertEqual(follower.follow(), "CREATE_COMPLETE")
+        self.assertEqual(
+            [(r["label"], r["status"]) for r in follower.resources.values()],
+            [
+                ("proj", "CREATE_COMPLETE"),
+                ("Network", "CREATE_COMPLETE"),
+                ("Network/Vpc", "CREATE_FAILED"),
+            ],
+        )
+        self.assertEqual(stdout.getvalue().count("Network/Vpc"), 1)
+        self.assertNotIn("DELETE_COMPLETE", stdout.getvalue())
+
+    @mock.patch.object(aws._StackEventFollower, "MIN_INTERVAL", 0.001)
+    @mock.patch.object(aws._StackEventFollower, "MAX_INTERVAL", 0.002)
+    def test_follow_rollback(self):
+        """
+        Tests that a rollback is reported with the failed resources.
+        """
+        client = self._client("ROLLBACK_COMPLETE")
+        with mock.patch("sys.stdout", io.StringIO()) as stdout:
+            self.assertFalse(aws._follow_stack(client, self.parent))
+        self.assertIn("ended in ROLLBACK_COMPLETE", stdout.getvalue())
+        self.assertIn("Network/Vpc:", stdout.getvalue())
+
+    @mock.patch.object(aws._StackEventFollower, "MIN_INTERVAL", 0.001)
+    @mock.patch.object(aws._StackEventFollower, "MAX_INTERVAL", 0.002)
+    def test_nested_stack_error_reported(self):
+        """
+        Tests that an error polling a nested stack is reported and the
+        parent stack is still followed.
+        """
+        client = self._client()
+        describe = client.describe_stack_events
+
+        def describe_stack_events(StackName, NextToken=None):
+            if StackName == self.nested:
+                raise RuntimeError("AccessDenied")
+            return describe(StackName, NextToken)
+
+        client.describe_stack_events = describe_stack_events
+        follower = aws._StackEventFollower(client, self.parent, live=False)
+        with mock.patch("sys.stdout", io.StringIO()) as stdout:
+            self.assertEqual(follower.follow(), "CREATE_COMPLETE")
+        self.assertEqual(list(follower.errors), ["Network"])
+        self.assertIn(
+            "Stopped following nested stack 'Network': AccessDenied",
+            stdout.getvalue(),
+        )
+
+    def test_skip_existing(self):
+        """
+        Tests that events from before the operation are not shown.
+        """
+        client = mock.MagicMock()
+        client.describe_stack_events.return_value = {
+            "StackEvents": [{"EventId": "e1"}, {"EventId": "e2"}]
+        }
+        follower = aws._StackEventFollower(client, "proj", live=False)
+        follower.skip_existing()
+        self.assertEqual(follower._get_new_events("proj"), [])
+
+
+# =============================================================================
+# Unit tests for API rate limiting.
+# -----------------------------------------------------------------------------
+class _FlakyClient:
+    """
+    Client stand-in whose 'describe_stacks' is throttled a few times.
+    """
+
+    def __init__(self, throttles):
+        self.meta = mock.MagicMock()
+        self.meta.method_to_api_mapping = {"describe_stacks": "DescribeStacks"}
+        self.region = "eu-north-1"
+        self.calls = 0
+        self.throttles = throttles
+
+    def describe_stacks(self, **kwargs):
+        import botocore.exceptions
+
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise botocore.exceptions.ClientError(
+                {"Error": {"Code": "Throttling", "Message": "Rate exceeded"}},
+                "DescribeStacks",
+            )
+        return {"Stacks": [kwargs]}
+
+
+class TestRateLimitedClient(TestCase):
+    """
+    Test case for 'mldeploy.aws._RateLimitedClient' and '_RateLimiter'.
+    """
+
+    @mock.patch("mldeploy.aws.time.sleep")
+    def test_throttling_retried(self, mock_sleep):
+        """
+        Tests that throttled calls are retried with backoff.
+        """
+        client = aws._RateLimitedClient(_FlakyClient(2), aws._RateLimiter(100, 10))
+        self.assertEqual(
+            client.describe_stacks(StackName="s"), {"Stacks": [{"StackName": "s"}]}
+        )
+        self.assertEqual(client._client.calls, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(client.region, "eu-north-1")
+
+    @mock.patch("mldeploy.aws.time.sleep")
+    def test_throttling_gives_up(self, mock_sleep):
+        """
+        Tests that the last throttling error is raised after all attempts.
+        """
+        import botocore.exceptions
+
+        client = aws._RateLimitedClient(_FlakyClient(100), aws._RateLimiter(1000, 100))
+        with self.assertRaises(botocore.exceptions.ClientError):
+            client.describe_stacks()
+        self.assertEqual(
+            client._client.calls, aws._get_constant("CFN_API_MAX_ATTEMPTS")
+        )
+
+    def test_rate_limiter_burst(self):
+        """
+        Tests that calls beyond the burst wait for new tokens.
+        """
+        limiter = aws._RateLimiter(rate=50, burst=5)
+        start = time.monotonic()
+        for _ in range(10):
+            limiter.acquire()
+        # 5 calls from the burst, 5 more at 50 per second.
+        self.assertGreaterEqual(time.monotonic() - start, 0.08)
@@ -0,0 +1,71 @@
+# =============================================================================
+# TEST_CLI.PY
+# -----------------------------------------------------------------------------
+# Unit tests for the 'cli.py' file.
+#
+# -----------------------------------------------------------------------------
+# Author: kingfischer16 (https://github.com/kingfischer16/mldeploy)
+# =============================================================================
+
+# =============================================================================
+# Imports.
+# -----------------------------------------------------------------------------
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+mld_path = str(os.path.realpath(__file__)).rsplit("/", 2)[0]
+
+# Packages that light commands must not import. Each of these adds tens to
+# hundreds of milliseconds to CLI startup.
+HEAVY_MODULES = ["boto3", "botocore", "docker", "ruamel.yaml"]
+
+
+# =============================================================================
+# Unit tests for CLI startup.
+# -----------------------------------------------------------------------------
+class TestCliStartup(TestCase):
+    """
+    Import budget for the light CLI commands: loading the CLI and running
+    'test', 'cwd' or 'ls' must not import any of the heavy packages.
+    """
+
+    def _loaded_heavy_modules(self, command: str) -> list:
+        """
+        Runs the command in a fresh interpreter and returns the heavy
+        modules that were imported.
+        """
+        script = (
+            "import sys\n"
+            "from unittest import mock\n"
+            "import mldeploy.cli\n"
+            f"with mock.patch('sys.argv', ['mldeploy', '{command}']):\n"
+            "    try:\n"
+            "        mldeploy.cli.main()\n"
+            "    except SystemExit:\n"
+            "        pass\n"
+            f"print('HEAVY:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+        )
+        with tempfile.TemporaryDirectory() as home:
+            env = dict(os.environ, HOME=home, PAGER="cat")
+            result = subprocess.run(
+                [sys.executable, "-c", script],
+                cwd=mld_path,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        loaded = result.stdout.rsplit("HEAVY:", 1)[1].strip()
+        return [m for m in loaded.split(",") if len(m) > 0]
+
+    def test_light_commands_import_budget(self):
+        """
+        Tests that no heavy package is imported for light commands.
+        """
+        for command in ["test", "cwd", "ls"]:
+            with self.subTest(command=command):
+                self.assertEqual(self._loaded_heavy_modules(command), [])
@@ -0,0 +1,983 @@
+# =============================================================================
+# TEST_DOCKER_TOOLS.PY
+# -----------------------------------------------------------------------------
+# Unit tests for the 'docker_tools.py' file.
+#
+# -----------------------------------------------------------------------------
+# Author: kingfischer16 (https://github.com/kingfischer16/mldeploy)
+# =============================================================================
+
+# =============================================================================
+# Imports.
+# -----------------------------------------------------------------------------
+import io
+import os
+import subprocess
+import tarfile
+import tempfile
+import time
+from unittest import mock, TestCase
+
+import sys
+
+mld_path = str(os.path.realpath(__file__)).rsplit("/", 2)[0]
+sys.path.insert(0, mld_path)
+from mldeploy import docker_tools
+
+
+class _TempFolderTestCase(TestCase):
+    """
+    Base test case with a temporary folder, 'self.tmp_dir', and 'patch'
+    to patch an object for the duration of one test. Both are undone by
+    'addCleanup' after each test.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def patch(self, *args, **kwargs) -> mock.MagicMock:
+        patcher = mock.patch(*args, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+
+# =============================================================================
+# Unit tests for Build cache.
+# -----------------------------------------------------------------------------
+class TestComputeBuildHash(_TempFolderTestCase):
+    """
+    Test case for 'mldeploy.docker_tools._compute_build_hash'.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.proj = self.tmp_dir.name + "/proj"
+        self.code = self.tmp_dir.name + "/code"
+        os.makedirs(self.proj)
+        os.makedirs(self.code)
+        for path, text in [
+            (self.proj + "/Dockerfile", "FROM python:3.8\n"),
+            (self.proj + "/requirements.txt", "boto3\n"),
+            (self.code + "/model.py", "x = 1\n"),
+        ]:
+            with open(path, "w") as f:
+                f.write(text)
+        self.patch("mldeploy.docker_tools._get_project_folder", return_value=self.proj)
+        self.patch(
+            "mldeploy.docker_tools._get_code_paths",
+            return_value=[self.code, "https://github.com/a/b.git"],
+        )
+        self.patch("mldeploy.docker_tools._save_file_digest_cache")
+
+    def test_build_hash_stable(self):
+        """
+        Tests that unchanged inputs give the same hash.
+        """
+        self.assertEqual(
+            docker_tools._compute_build_hash("proj", "sha256:base"),
+            docker_tools._compute_build_hash("proj", "sha256:base"),
+        )
+
+    def test_build_hash_changes(self):
+        """
+        Tests that changed code, requirements or base image change the hash.
+        """
+        first = docker_tools._compute_build_hash("proj", "sha256:base")
+        self.assertNotEqual(
+            first, docker_tools._compute_build_hash("proj", "sha256:other")
+        )
+        with open(self.code + "/model.py", "w") as f:
+            f.write("x = 22\n")
+        second = docker_tools._compute_build_hash("proj", "sha256:base")
+        self.assertNotEqual(first, second)
+        with open(self.proj + "/requirements.txt", "w") as f:
+            f.write("boto3\nnumpy\n")
+        self.assertNotEqual(
+            second, docker_tools._compute_build_hash("proj", "sha256:base")
+        )
+
+
+class TestBuildDockerImage(TestCase):
+    """
+    Test case for 'mldeploy.docker_tools._build_docker_image'.
+    """
+
+    @mock.patch("mldeploy.docker_tools._delete_docker_image")
+    @mock.patch("mldeploy.docker_tools._sync_git_sources", return_value={})
+    @mock.patch("mldeploy.docker_tools._is_build_current", return_value=True)
+    @mock.patch("mldeploy.docker_tools._compute_build_hash", return_value="abc")
+    @mock.patch("mldeploy.docker_tools._get_base_image_name", return_value="base")
+    @mock.patch("mldeploy.docker_tools._get_registry_project")
+    @mock.patch("mldeploy.docker_tools.docker.from_env")
+    def test_build_skipped_when_current(
+        self,
+        mock_env,
+        mock_reg,
+        mock_base,
+        mock_hash,
+        mock_current,
+        mock_git,
+        mock_delete,
+    ):
+        """
+        Tests that no build happens when the inputs are unchanged.
+        """
+        mock_reg.return_value = {"docker-image": "proj_mldeploy:1"}
+        with mock.patch("sys.stdout"):
+            docker_tools._build_docker_image("proj")
+        self.assertFalse(mock_env.return_value.images.build.called)
+        self.assertFalse(mock_delete.called)
+
+    def _build(self, api_build, entries):
+        """
+        Runs a build of a project with the given context entries, where
+        'api_build' stands in for the Docker build API.
+        """
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        with open(tmp_dir.name + "/Dockerfile", "w") as f:
+            f.write("FROM python:3.8\n")
+        config = mock.MagicMock(use_wheelhouse=False, docker_buildkit=False)
+        client = mock.MagicMock()
+        client.api.build.side_effect = api_build
+        with mock.patch.multiple(
+            "mldeploy.docker_tools",
+            _get_base_image_name=mock.MagicMock(return_value="base"),
+            _sync_git_sources=mock.MagicMock(return_value={}),
+            _compute_build_hash=mock.MagicMock(return_value="abc"),
+            _is_build_current=mock.MagicMock(return_value=False),
+            _get_build_context_entries=mock.MagicMock(return_value=entries),
+            _get_project_config=mock.MagicMock(return_value=config),
+            _get_project_folder=mock.MagicMock(return_value=tmp_dir.name),
+            _get_registry_project=mock.MagicMock(return_value={}),
+            _check_context_budget=mock.DEFAULT,
+            _delete_docker_image=mock.DEFAULT,
+            _get_layer_report=mock.MagicMock(return_value={"size": 1}),
+            _format_layer_report=mock.MagicMock(return_value=""),
+            _save_build_logs_to_file=mock.MagicMock(return_value="log.txt"),
+            _profile_imports=mock.DEFAULT,
+            _registry_transaction=mock.DEFAULT,
+            _collect_project_images=mock.MagicMock(
+                side_effect=docker_tools.docker.errors.APIError("engine gone")
+            ),
+        ), mock.patch("mldeploy.docker_tools.docker.from_env", return_value=client):
+            with mock.patch("sys.stdout", io.StringIO()) as stdout:
+                return docker_tools._build_docker_image("proj"), stdout.getvalue()
+
+    def test_context_error_raised(self):
+        """
+        Tests that a failure writing the build context is raised instead
+        of the build error it causes.
+        """
+
+        def api_build(fileobj, **kwargs):
+            fileobj.read()
+            raise docker_tools.docker.errors.APIError("unexpected EOF")
+
+        with self.assertRaises(FileNotFoundError):
+            self._build(api_build, [("model.py", "/no/such/file.py")])
+
+    def test_gc_error_does_not_fail_build(self):
+        """
+        Tests that a failed removal of old images is reported only.
+        """
+        built, output = self._build(lambda **kwargs: iter([]), [])
+        self.assertTrue(built)
+        self.assertIn("Could not remove old images", output)
+
+
+# =============================================================================
+# Unit tests for Build context.
+# -----------------------------------------------------------------------------
+class TestBuildContext(_TempFolderTestCase):
+    """
+    Test case for 'mldeploy.docker_tools._get_build_context_entries' and
+    'mldeploy.docker_tools._BuildContextStream'.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.proj = self.tmp_dir.name + "/proj"
+        self.code = self.tmp_dir.name + "/code"
+        for path, text in [
+            (self.proj + "/Dockerfile", "FROM python:3.8\n"),
+            (self.proj + "/.dockerignore", "# comment\n**/__pycache__\n"),
+            (self.proj + "/docker_build_logs/build.log", "old log\n"),
+            (self.proj + "/tmp/stale.py", "x = 0\n"),
+            (self.code + "/model.py", "x = 1\n"),
+            (self.code + "/__pycache__/model.pyc", "bytes"),
+            (self.tmp_dir.name + "/main.py", "print(1)\n"),
+        ]:
+            os.makedirs(path.rsplit("/", 1)[0], exist_ok=True)
+            with open(path, "w") as f:
+                f.write(text)
+        self.patch("mldeploy.docker_tools._get_project_folder", return_value=self.proj)
+        self.patch(
+            "mldeploy.docker_tools._get_code_paths",
+            return_value=[
+                self.code,
+                self.tmp_dir.name + "/main.py",
+                "https://github.com/a/b.git",
+            ],
+        )
+
+    def test_context_entries(self):
+        """
+        Tests that ignored files, logs and repos are left out of the context.
+        """
+        entries = docker_tools._get_build_context_entries("proj")
+        self.assertEqual(
+            [arcname for arcname, _ in entries],
+            [".dockerignore", "Dockerfile", "tmp/code/model.py", "tmp/main.py"],
+        )
+
+    def test_context_unknown_object(self):
+        """
+        Tests that a missing 'add-files' entry raises a ValueError.
+        """
+        with mock.patch(
+            "mldeploy.docker_tools._get_code_paths",
+            return_value=[self.tmp_dir.name + "/missing.py"],
+        ):
+            with self.assertRaises(ValueError):
+                docker_tools._get_build_context_entries("proj")
+
+    def test_context_stream_is_tar(self):
+        """
+        Tests that the stream yields a tar archive of the context entries.
+        """
+        entries = docker_tools._get_build_context_entries("proj")
+        stream = docker_tools._BuildContextStream(entries)
+        data = b"".join(stream)
+        stream.close()
+        self.assertIsNone(stream.error)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            self.assertEqual(tar.getnames(), [arcname for arcname, _ in entries])
+            self.assertEqual(tar.extractfile("tmp/code/model.py").read(), b"x = 1\n")
+
+
+class TestContextReport(_TempFolderTestCase):
+    """
+    Test case for 'mldeploy.docker_tools._get_context_report' and
+    'mldeploy.docker_tools._check_context_budget'.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.entries = []
+        for arcname, size in [
+            ("Dockerfile", 10),
+            ("tmp/code/model.py", 100),
+            ("tmp/code/.venv/lib/big.so", 5000),
+            ("tmp/code/train.csv", 2000),
+        ]:
+            path = self.tmp_dir.name + "/" + arcname.replace("/", "_")
+            with open(path, "wb") as f:
+                f.write(b"x" * size)
+            self.entries.append((arcname, path))
+
+    def test_context_report(self):
+        """
+        Tests totals, largest entries and suggested patterns.
+        """
+        report = docker_tools._get_context_report(self.entries, top=2)
+        self.assertEqual(report["total"], 7110)
+        self.assertEqual(report["files"], 4)
+        self.assertEqual(report["top_files"][0], ("tmp/code/.venv/lib/big.so", 5000))
+        self.assertEqual(report["top_folders"], [("tmp", 7100), ("tmp/code", 7100)])
+        self.assertEqual(
+            report["suggestions"], [("**/.venv", 5000), ("**/*.csv", 2000)]
+        )
+
+    @mock.patch("mldeploy.docker_tools._get_project_config")
+    def test_context_budget(self, mock_config):
+        """
+        Tests that a context over the size budget raises a ValueError.
+        """
+        mock_config.return_value.context_size_limit_mb = None
+        docker_tools._check_context_budget("proj", self.entries)
+        mock_config.return_value.context_size_limit_mb = 0.01
+        docker_tools._check_context_budget("proj", self.entries)
+        mock_config.return_value.context_size_limit_mb = 0.005
+        with self.assertRaises(ValueError):
+            docker_tools._check_context_budget("proj", self.entries)
+
+
+# =============================================================================
+# Unit tests for Dockerfile creation.
+# -----------------------------------------------------------------------------
+class TestRenderDockerfile(TestCase):
+    """
+    Test case for 'mldeploy.docker_tools._render_dockerfile'.
+    """
+
+    code_paths = ["/home/user/code", "https://github.com/user/repo.git"]
+
+    def test_render_deterministic(self):
+        """
+        Tests that the same inputs give identical output, regardless of
+        the order of the system packages.
+        """
+        first = docker_tools._render_dockerfile(
+            "python:3.8", self.code_paths, ["libb", "liba"]
+        )
+        second = docker_tools._render_dockerfile(
+            "python:3.8", self.code_paths, ["liba", "libb", "liba"]
+        )
+        self.assertEqual(first, second)
+
+    def test_render_single_stage(self):
+        """
+        Tests instruction order and the merged apt step.
+        """
+        lines = docker_tools._render_dockerfile(
+            "python:3.8", self.code_paths, ["liba"]
+        ).splitlines()
+        self.assertEqual(lines[0], "FROM python:3.8")
+        self.assertEqual(len([l for l in lines if "apt-get update" in l]), 1)
+        self.assertIn("rm -rf /var/lib/apt/lists/*", lines[3])
+        self.assertIn("--no-cache-dir", lines[5])
+        self.assertEqual(lines[6], "COPY git/repo /app/repo")
+        self.assertEqual(lines[-1], "COPY tmp/code /app/code")
+        self.assertNotIn(" git", "\n".join(lines[:6]))
+
+    def test_render_no_packages(self):
+        """
+        Tests that no apt step is emitted if no packages are needed.
+        """
+        dockerfile = docker_tools._render_dockerfile("python:3.8", ["/home/code"])
+        self.assertNotIn("apt-get", dockerfile)
+
+    def test_render_buildkit_multistage(self):
+        """
+        Tests cache mounts and that build tooling stays in the builder stage.
+        """
+        dockerfile = docker_tools._render_dockerfile(
+            "python:3.8", self.code_paths, buildkit=True, multistage=True
+        )
+        self.assertTrue(dockerfile.startswith("# syntax="))
+        self.assertIn("--mount=type=cache,target=/root/.cache/pip", dockerfile)
+        builder, final = dockerfile.split("\n\n")
+        self.assertIn("install -y --no-install-recommends build-essential", builder)
+        self.assertNotIn("apt-get", final)
+        self.assertIn("COPY git/repo /app/repo", final)
+        self.assertIn("COPY --from=builder /install /usr/local", final)
+
+    def test_render_wheelhouse(self):
+        """
+        Tests that requirements are installed offline from the wheelhouse.
+        """
+        dockerfile = docker_tools._render_dockerfile("python:3.8", [], wheelhouse=True)
+        self.assertIn("COPY wheelhouse /wheelhouse", dockerfile)
+        self.assertIn("--no-index --find-links=/wheelhouse", dockerfile)
+        dockerfile = docker_tools._render_dockerfile(
+            "python:3.8", [], buildkit=True, wheelhouse=True
+        )
+        self.assertNotIn("COPY wheelhouse", dockerfile)
+        self.assertIn("--mount=type=bind,source=wheelhouse", dockerfile)
+
+
+# =============================================================================
+# Unit tests for Wheelhouse.
+# -----------------------------------------------------------------------------
+class TestPrepareWheelhouse(_TempFolderTestCase):
+    """
+    Test case for 'mldeploy.docker_tools._prepare_wheelhouse'.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.proj = self.tmp_dir.name + "/proj"
+        self.wheels = self.tmp_dir.name + "/wheelhouse/cpython-38"
+        os.makedirs(self.proj)
+        with open(self.proj + "/requirements.txt", "w") as f:
+            f.write("# comment\n--extra-index-url https://pypi.org/simple\n")
+            f.write("numpy==1.19.0  # pinned\nsix\n")
+        self.patch("mldeploy.docker_tools._get_project_folder", return_value=self.proj)
+        self.patch(
+            "mldeploy.docker_tools._get_wheelhouse_folder", return_value=self.wheels
+        )
+
+    def _fake_build(self, client, base_image, folder, requirements, options):
+        result = {}
+        for req in requirements:
+            wheel = req.split("=")[0] + "-1.0-py3-none-any.whl"
+            open(folder + "/" + wheel, "w").close()
+            result[req] = [wheel]
+        return result
+
+    def test_read_requirements(self):
+        """
+        Tests that comments are dropped and pip options kept apart.
+        """
+        self.assertEqual(
+            docker_tools._read_requirements("proj"),
+            (
+                ["--extra-index-url", "https://pypi.org/simple"],
+                ["numpy==1.19.0", "six"],
+            ),
+        )
+
+    @mock.patch("sys.stdout")
+    def test_wheels_built_once(self, mock_stdout):
+        """
+        Tests that wheels are only built for requirements not seen before.
+        """
+        with mock.patch(
+            "mldeploy.docker_tools._build_wheels", side_effect=self._fake_build
+        ) as mock_build:
+            folder, wheels = docker_tools._prepare_wheelhouse("proj", None, "base")
+            self.assertEqual(folder, self.wheels)
+            self.assertEqual(
+                wheels, ["numpy-1.0-py3-none-any.whl", "six-1.0-py3-none-any.whl"]
+            )
+            with open(self.proj + "/requirements.txt", "a") as f:
+                f.write("pandas\n")
+            docker_tools._prepare_wheelhouse("proj", None, "base")
+        self.assertEqual(mock_build.call_count, 2)
+        self.assertEqual(mock_build.call_args[0][3], ["pandas"])
+
+    @mock.patch("sys.stdout")
+    def test_unpinned_wheels_refreshed(self, mock_stdout):
+        """
+        Tests that unpinned requirements are rebuilt once their entry
+        expires, and that all are rebuilt when the pip options change.
+        """
+        with mock.patch(
+            "mldeploy.docker_tools._build_wheels", side_effect=self._fake_build
+        ) as mock_build:
+            docker_tools._prepare_wheelhouse("proj", None, "base")
+            ttl = docker_tools._get_constant("WHEELHOUSE_UNPINNED_TTL_HOURS") * 3600
+            later = time.time() + ttl + 1
+            with mock.patch("mldeploy.docker_tools.time.time", return_value=later):
+                docker_tools._prepare_wheelhouse("proj", None, "base")
+            self.assertEqual(mock_build.call_args[0][3], ["six"])
+            with open(self.proj + "/requirements.txt", "a") as f:
+                f.write("--index-url https://mirror/simple\n")
+            docker_tools._prepare_wheelhouse("proj", None, "base")
+            self.assertEqual(mock_build.call_args[0][3], ["numpy==1.19.0", "six"])
+        self.assertEqual(mock_build.call_count, 3)
+
+    @mock.patch("sys.stdout")
+    def test_wheel_build_failure(self, mock_stdout):
+        """
+        Tests that a requirement without wheels raises a ValueError.
+        """
+        with mock.patch(
+            "mldeploy.docker_tools._build_wheels",
+            return_value={"numpy==1.19.0": None, "six": []},
+        ):
+            with self.assertRaises(ValueError):
+                docker_tools._prepare_wheelhouse("proj", None, "base")
+
+
+# =============================================================================
+# Unit tests for Docker image creation.
+# -----------------------------------------------------------------------------
+class TestBuildProgress(TestCase):
+    """
+    Test case for 'mldeploy.docker_tools._BuildProgress'.
+    """
+
+    @mock.patch("sys.stdout")
+    def test_classic_builder_steps(self, mock_stdout):
+        """
+        Tests step detection and cache hits for the classic builder output.
+        """
+        progress = docker_tools._BuildProgress()
+        for text in [
+            "Step 1/3 : FROM python:3.8\n",
+            " ---> 1234\n",
+            "Step 2/3 : COPY requirements.txt /app/\n ---> Using cache\n",
+            "Step 3/3 : RUN pip install -r /app/requirements.txt\n",
+            "Collecting numpy\n",
+        ]:
+            progress.update({"stream": text})
+        steps = progress.finish()
+        self.assertEqual([s["step"] for s in steps], ["1/3", "2/3", "3/3"])
+        self.assertEqual([s["cached"] for s in steps], [False, True, False])
+        self.assertEqual(
+            steps[2]["instruction"], "RUN pip install -r /app/requirements.txt"
+        )
+        self.assertTrue(all(s["seconds"] >= 0 for s in steps))
+
+    @mock.patch("sys.stdout")
+    def test_buildkit_steps(self, mock_stdout):
+        """
+        Tests step detection and cache hits for BuildKit plain output.
+        """
+        progress = docker_tools._BuildProgress()
+        for text in [
+            "#4 [builder 1/3] FROM docker.io/library/python:3.8\n",
+            "#5 [builder 2/3] COPY requirements.txt /app/\n",
+            "#5 CACHED\n",
+            "#6 [builder 3/3] RUN pip install -r /app/requirements.txt\n",
+            "#6 0.512 Collecting numpy\n",
+            "#6 DONE 12.3s\n",
+            "#4 DONE 0.1s\n",
+        ]:
+            progress.update({"stream": text})
+        steps = progress.finish()
+        self.assertEqual(
+            [(s["step"], s["cached"]) for s in steps],
+            [("builder 2/3", True), ("builder 3/3", False), ("builder 1/3", False)],
+        )
+
+
+# =============================================================================
+# Unit tests for Base image cache.
+# -----------------------------------------------------------------------------
+class TestResolveBaseImage(_TempFolderTestCase):
+    """
+    Test case for 'mldeploy.docker_tools._resolve_base_image'.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client = mock.MagicMock()
+        self.client.images.pull.return_value.attrs = {
+            "RepoDigests": ["other@sha256:000", "python@sha256:abc"]
+        }
+        self.patch(
+            "mldeploy.docker_tools._get_appdata_folder", return_value=self.tmp_dir.name
+        )
+        self.patch("mldeploy.docker_tools._get_image_id", return_value="id")
+        self.patch("sys.stdout")
+
+    def test_digest_pinned_and_cached(self):
+        """
+        Tests that the digest is pinned and reused until the TTL expires.
+        """
+        resolve = docker_tools._resolve_base_image
+        self.assertEqual(
+            resolve(self.client, "python:3.8", 24), "python:3.8@sha256:abc"
+        )
+        self.assertEqual(
+            resolve(self.client, "python:3.8", 24), "python:3.8@sha256:abc"
+        )
+        self.assertEqual(self.client.images.pull.call_count, 1)
+        resolve(self.client, "python:3.8", 24, refresh=True)
+        self.assertEqual(self.client.images.pull.call_count, 2)
+        resolve(self.client, "python:3.8", 0)
+        self.assertEqual(self.client.images.pull.call_count, 3)
+
+    def test_pull_failure_uses_cache(self):
+        """
+        Tests that a failed pull falls back to the cached digest.
+        """
+        docker_tools._resolve_base_image(self.client, "python:3.8", 24)
+        self.client.images.pull.side_effect = docker_tools.docker.errors.APIError(
+            "offline"
+        )
+        self.assertEqual(
+            docker_tools._resolve_base_image(self.client, "python:3.8", 0),
+            "python:3.8@sha256:abc",
+        )
+        with self.assertRaises(docker_tools.docker.errors.APIError):
+            docker_tools._resolve_base_image(self.client, "python:3.9", 24)
+
+    def test_pinned_image_unchanged(self):
+        """
+        Tests that an image already pinned to a digest is not pulled.
+        """
+        image = "python:3.8@sha256:def"
+        self.assertEqual(
+            docker_tools._resolve_base_image(self.client, image, 24), image
+        )
+        self.assertFalse(self.client.images.pull.called)
+
+
+# =============================================================================
+# Unit tests for Image garbage collection.
+# -----------------------------------------------------------------------------
+class TestImageGarbageCollection(TestCase):
+    """
+    Test case for 'mldeploy.docker_tools._select_images_to_remove' and
+    'mldeploy.docker_tools._collect_project_images'.
+    """
+
+    def _image(self, day, size=100):
+        image = mock.MagicMock()
+        image.tags = [f"proj_mldeploy:202006{day:02d}-120000"]
+        image.attrs = {
+            "Created": f"2020-06-{day:02d}T12:00:00.123456789Z",
+            "Size": size,
+        }
+        return image
+
+    def setUp(self):
+        self.images = [self._image(day) for day in [3, 1, 10, 7, 9]]
+        self.now = docker_tools.datetime(2020, 6, 10, 13, 0, 0)
+
+    def test_keep_last(self):
+        """
+        Tests that the newest images and the protected image are kept.
+        """
+        removed = docker_tools._select_images_to_remove(
+            self.images, 2, None, ["proj_mldeploy:20200601-120000"], self.now
+        )
+        self.assertEqual(
+            [im.tags[0] for im in removed],
+            ["proj_mldeploy:20200603-120000", "proj_mldeploy:20200607-120000"],
+        )
+
+    def test_keep_days(self):
+        """
+        Tests that images younger than the age limit are kept.
+        """
+        removed = docker_tools._select_images_to_remove(self.images, 1, 5, [], self.now)
+        self.assertEqual(
+            [im.tags[0] for im in removed],
+            ["proj_mldeploy:20200601-120000", "proj_mldeploy:20200603-120000"],
+        )
+
+    @mock.patch("mldeploy.docker_tools._get_registry_project")
+    @mock.patch("mldeploy.docker_tools._get_project_config")
+    def test_collect_project_images(self, mock_config, mock_reg):
+        """
+        Tests filtered lookup, removal and the reclaimed size.
+        """
+        mock_config.return_value.image_retention_count = 3
+        mock_config.return_value.image_retention_days = None
+        mock_reg.return_value = {"docker-image": "other"}
+        client = mock.MagicMock()
+        client.images.list.return_value = self.images
+        removed, reclaimed = docker_tools._collect_project_images(
+            "proj", client, dry_run=True
+        )
+        self.assertEqual(len(removed), 2)
+        self.assertFalse(client.images.remove.called)
+        removed, reclaimed = docker_tools._collect_project_images("proj", client)
+        client.images.list.assert_called_with(name="proj_mldeploy")
+        self.assertEqual(client.images.remove.call_count, 2)
+        self.assertEqual(reclaimed, 200)
+
+
+# =============================================================================
+# Unit tests for Git source cache.
+# -----------------------------------------------------------------------------
+class TestGitSourceCache(_TempFolderTestCase):
+    """
+    Test case for 'mldeploy.docker_tools._sync_git_sources'.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.repo = self.tmp_dir.name + "/repo.git"
+        os.makedirs(self.repo)
+        self._git("init", "--quiet")
+        self._commit("model.py", "x = 1\n")
+        self.patch(
+            "mldeploy.docker_tools._get_appdata_folder",
+            return_value=self.tmp_dir.name + "/appdata",
+        )
+        self.patch(
+            "mldeploy.docker_tools._get_code_paths",
+            return_value=["/home/code", self.repo],
+        )
+        self.patch("sys.stdout")
+
+    def _git(self, *args):
+        env = dict(
+            os.environ,
+            GIT_AUTHOR_NAME="a",
+            GIT_AUTHOR_EMAIL="a@b",
+            GIT_COMMITTER_NAME="a",
+            GIT_COMMITTER_EMAIL="a@b",
+        )
+        return (
+            subprocess.run(
+                ["git"] + list(args),
+                cwd=self.repo,
+                env=env,
+                check=True,
+                stdout=subprocess.PIPE,
+            )
+            .stdout.decode()
+            .strip()
+        )
+
+    def _commit(self, fname, text):
+        with open(self.repo + "/" + fname, "w") as f:
+            f.write(text)
+        self._git("add", fname)
+        self._git("commit", "--quiet", "-m", fname)
+
+    def test_sync_git_sources(self):
+        """
+        Tests that the snapshot matches the current commit and follows
+        new commits through an incremental fetch, keeping the previous
+        snapshot for builds that may still read it.
+        """
+        sha, snapshot = docker_tools._sync_git_sources("proj")[self.repo]
+        self.assertEqual(sha, self._git("rev-parse", "HEAD"))
+        self.assertEqual(os.listdir(snapshot), ["model.py"])
+        self._commit("data.txt", "1\n")
+        new_sha, new_snapshot = docker_tools._sync_git_sources("proj")[self.repo]
+        self.assertEqual(new_sha, self._git("rev-parse", "HEAD"))
+        self.assertEqual(sorted(os.listdir(new_snapshot)), ["data.txt", "model.py"])
+        self.assertTrue(os.path.exists(snapshot))
+        self._commit("more.txt", "2\n")
+        docker_tools._sync_git_sources("proj")
+        self.assertFalse(os.path.exists(snapshot))
+        self.assertTrue(os.path.exists(new_snapshot))
+
+    def test_stale_clone_removed(self):
+        """
+        Tests that a folder left by an interrupted clone does not break
+        the next clone.
+        """
+        mirror = docker_tools._get_git_cache_folder(self.repo) + "/mirror.git"
+        os.makedirs(mirror + ".tmp/objects")
+        sha = docker_tools._update_git_mirror(self.repo)
+        self.assertEqual(sha, self._git("rev-parse", "HEAD"))
+        self.assertFalse(os.path.exists(mirror + ".tmp"))
+
+    def test_failed_extraction_cleaned_up(self):
+        """
+        Tests that a failed extraction removes the partial snapshot.
+        """
+        sha = docker_tools._update_git_mirror(self.repo)
+        cache = docker_tools._get_git_cache_folder(self.repo)
+
+        def extractall(path, **kwargs):
+            os.makedirs(path + "/partial")
+            raise OSError("disk full")
+
+        with mock.patch(
+            "mldeploy.docker_tools.tarfile.TarFile.extractall", side_effect=extractall
+        ):
+            with self.assertRaises(OSError):
+                docker_tools._get_git_snapshot(self.repo, sha)
+        self.assertEqual(os.listdir(cache), ["mirror.git"])
+
+
+# =============================================================================
+# Unit tests for Requirements lock.
+# -----------------------------------------------------------------------------
+class TestLockRequirements(_TempFolderTestCase):
+    """
+    Test case for 'mldeploy.docker_tools._lock_requirements'.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.proj = self.tmp_dir.name + "/proj"
+        os.makedirs(self.proj)
+        with open(self.proj + "/requirements.txt", "w") as f:
+            f.write("numpy\n")
+        self.client = mock.MagicMock()
+        self.client.containers.run.return_value = (
+            b'LOCK:["numpy==1.19.0 --hash=sha256:abc"]\n'
+        )
+        self.patch("mldeploy.docker_tools._get_project_folder", return_value=self.proj)
+        self.patch(
+            "mldeploy.docker_tools._get_appdata_folder", return_value=self.tmp_dir.name
+        )
+        self.patch("sys.stdout")
+
+    def _lock(self, **kwargs):
+        return docker_tools._lock_requirements(
+            "proj", client=self.client, base_image="python@sha256:1", **kwargs
+        )
+
+    def test_lockfile_written_and_cached(self):
+        """
+        Tests that the lockfile is only resolved again if inputs change.
+        """
+        self.assertTrue(self._lock())
+        with open(self.proj + "/requirements.lock", "r") as f:
+            self.assertIn("numpy==1.19.0 --hash=sha256:abc\n", f.read())
+        self.assertFalse(self._lock())
+        os.remove(self.proj + "/requirements.lock")
+        self.assertTrue(self._lock())
+        self.assertEqual(self.client.containers.run.call_count, 1)
+        with open(self.proj + "/requirements.txt", "a") as f:
+            f.write("six\n")
+        self.assertTrue(self._lock())
+        self.assertEqual(self.client.containers.run.call_count, 2)
+        self.assertTrue(self._lock(refresh=True))
+        self.assertEqual(self.client.containers.run.call_count, 3)
+
+    def test_missing_requirements(self):
+        """
+        Tests that a project without 'requirements.txt' fails with a message.
+        """
+        os.remove(self.proj + "/requirements.txt")
+        with self.assertRaisesRegex(ValueError, "no 'requirements.txt'"):
+            self._lock()
+        self.client.containers.run.assert_not_called()
+
+    def test_read_locked_requirements(self):
+        """
+        Tests that the wheelhouse reads the pins without hashes.
+        """
+        self._lock()
+        self.assertEqual(
+            docker_tools._read_requirements("proj"), ([], ["numpy==1.19.0"])
+        )
+
+    def test_render_lockfile(self):
+        """
+        Tests that the Dockerfile installs from the lockfile.
+        """
+        dockerfile = docker_tools._render_dockerfile("python:3.8", [], lockfile=True)
+        self.assertIn("COPY requirements.lock /app/", dockerfile)
+        self.assertIn(
+            "pip install --no-deps --no-cache-dir -r /app/requirements.lock",
+            dockerfile,
+        )
+        dockerfile = docker_tools._render_dockerfile(
+            "python:3.8", [], wheelhouse=True, lockfile=True
+        )
+        self.assertIn("sed 's/ --hash=[^ ]*//g'", dockerfile)
+
+
+# =============================================================================
+# Unit tests for Image size report.
+# -----------------------------------------------------------------------------
+class TestLayerReport(TestCase):
+    """
+    Test case for 'mldeploy.docker_tools._get_layer_report'.
+    """
+
+    dockerfile = (
+        "FROM python:3.8 AS builder\n"
+        "RUN pip install --prefix=/install -r /app/requirements.txt\n"
+        "\n"
+        "FROM python:3.8\n"
+        "RUN apt-get update \\\n"
+        "    && apt-get install -y git\n"
+        "COPY --from=builder /install /usr/local\n"
+        "COPY tmp/src /app/src\n"
+    )
+
+    def test_final_stage_instructions(self):
+        """
+        Tests that continuation lines are joined and earlier stages dropped.
+        """
+        self.assertEqual(
+            docker_tools._get_final_stage_instructions(self.dockerfile),
+            [
+                (5, "RUN apt-get update && apt-get install -y git"),
+                (7, "COPY --from=builder /install /usr/local"),
+                (8, "COPY tmp/src /app/src"),
+            ],
+        )
+
+    def test_layers_mapped_to_lines(self):
+        """
+        Tests that the newest history entries map to the Dockerfile lines
+        and the rest count as the base image.
+        """
+        client = mock.MagicMock()
+        client.api.history.return_value = [
+            {"Size": 10},
+            {"Size": 300},
+            {"Size": 50},
+            {"Size": 0},
+            {"Size": 1000},
+        ]
+        report = docker_tools._get_layer_report(client, "img", self.dockerfile)
+        self.assertEqual(report["size"], 1360)
+        self.assertEqual(report["base_size"], 1000)
+        self.assertEqual(
+            [(layer["line"], layer["size"]) for layer in report["layers"]],
+            [(5, 50), (7, 300), (8, 10)],
+        )
+        self.assertIn(
+            "+0.0 MB since last build", docker_tools._format_layer_report(report, 1000)
+        )
+
+    def test_render_slim(self):
+        """
+        Tests that the slimming pass runs in the install step.
+        """
+        dockerfile = docker_tools._render_dockerfile(
+            "python:3.8", [], multistage=True, slim=True
+        )
+        self.assertIn(
+            "pip install --prefix=/install --no-cache-dir -r /app/requirements.txt \\\n"
+            "    && find /install -depth -type d",
+            dockerfile,
+        )
+        self.assertNotIn(
+            "__pycache__", docker_tools._render_dockerfile("python:3.8", [])
+        )
+
+
+# =============================================================================
+# Unit tests for Import time profile.
+# -----------------------------------------------------------------------------
+class TestImportProfile(TestCase):
+    """
+    Test case for the import time profile of the main file.
+    """
+
+    def test_parse_import_profile(self):
+        """
+        Tests that only the modules imported directly by the main file
+        are kept, slowest first, leaving out interpreter startup and the
+        profiling script's own imports.
+        """
+        profile = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       900 |        900 | site\n"
+            "import time:       400 |        400 | ast\n"
+            "mldeploy-imports:ast,json,pandas.io,helper,foo\n"
+            "import time:       120 |        120 |   _json\n"
+            "import time:       300 |        420 | json\n"
+            "import time:      5000 |    2000000 | pandas\n"
+            "import time:        50 |         50 | numbers\n"
+            "Could not import foo: ModuleNotFoundError()\n"
+        )
+        self.assertEqual(
+            docker_tools._parse_import_profile(profile),
+            [
+                {"module": "pandas", "self_us": 5000, "cumulative_us": 2000000},
+                {"module": "json", "self_us": 300, "cumulative_us": 420},
+            ],
+        )
+
+    @mock.patch("mldeploy.docker_tools._get_project_config")
+    def test_profile_imports_off(self, mock_config):
+        """
+        Tests that no profiling container runs unless 'profile-imports' is set.
+        """
+        mock_config.return_value.profile_imports = False
+        client = mock.MagicMock()
+        self.assertIsNone(
+            docker_tools._profile_imports("proj", client, "img", "/tmp/log.txt")
+        )
+        client.containers.run.assert_not_called()
+
+    @mock.patch("mldeploy.docker_tools._get_project_config")
+    def test_main_file_on_image(self, mock_config):
+        """
+        Tests that local main files map to their folder in the image.
+        """
+        config = mock_config.return_value
+        config.add_files = ["https://host/repo.git", "/home/me/src/"]
+        for main_file, expected in [
+            ("/home/me/src/app/main.py", "/app/src/app/main.py"),
+            ("src/main.py", "/app/src/main.py"),
+            ("", None),
+            (None, None),
+        ]:
+            config.main_file = main_file
+            self.assertEqual(docker_tools._get_main_file_on_image("proj"), expected)
+
+    def test_render_precompile(self):
+        """
+        Tests that bytecode is compiled after the files are copied.
+        """
+        dockerfile = docker_tools._render_dockerfile(
+            "python:3.8", ["/home/me/src"], precompile=True
+        )
+        self.assertTrue(
+            dockerfile.endswith(
+                "COPY tmp/src /app/src\nRUN python -m compileall -q -j 0 /app || true\n"
+            )
+        )
+        self.assertEqual(dockerfile.count("compileall"), 2)
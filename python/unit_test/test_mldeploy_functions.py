@@ -0,0 +1,219 @@
+# =============================================================================
+# TEST_MLDEPLOY_FUNCTIONS.PY
+# -----------------------------------------------------------------------------
+# Unit tests for the 'mldeploy_functions.py' file.
+#
+# -----------------------------------------------------------------------------
+# Author: kingfischer16 (https://github.com/kingfischer16/mldeploy)
+# =============================================================================
+
+# =============================================================================
+# Imports.
+# -----------------------------------------------------------------------------
+import io
+import os
+import threading
+import time
+from unittest import mock, TestCase
+
+import sys
+
+mld_path = str(os.path.realpath(__file__)).rsplit("/", 2)[0]
+sys.path.insert(0, mld_path)
+from mldeploy import mldeploy_functions
+
+
+# =============================================================================
+# Unit tests for CLI helpers.
+# -----------------------------------------------------------------------------
+class TestSelectProjects(TestCase):
+    """
+    Test case for 'mldeploy.mldeploy_functions._select_projects'.
+    """
+
+    reg_data = {
+        "b": {"deployment_status": "Deployed"},
+        "a": {"deployment_status": "Not deployed"},
+        "c": {"deployment_status": "Deployed"},
+    }
+
+    @mock.patch("mldeploy.mldeploy_functions._find_projects")
+    @mock.patch("mldeploy.mldeploy_functions._get_registry_data")
+    def test_select_projects(self, mock_reg, mock_find):
+        """
+        Tests selection by name, all and status, without duplicates.
+        """
+        mock_reg.return_value = self.reg_data
+        mock_find.return_value = ["c", "b"]
+        self.assertEqual(
+            mldeploy_functions._select_projects(["c"], all_projects=True),
+            ["c", "a", "b"],
+        )
+        self.assertEqual(
+            mldeploy_functions._select_projects([], status="Deployed"), ["b", "c"]
+        )
+
+    @mock.patch("mldeploy.mldeploy_functions._get_registry_data")
+    def test_select_projects_filter(self, mock_reg):
+        """
+        Tests that a name filter narrows, or on its own selects from, all projects.
+        """
+        mock_reg.return_value = {"churn-a": {}, "churn-b": {}, "fraud": {}}
+        self.assertEqual(
+            mldeploy_functions._select_projects([], name_filter="churn-*"),
+            ["churn-a", "churn-b"],
+        )
+        self.assertEqual(
+            mldeploy_functions._select_projects(
+                ["fraud", "churn-b"], name_filter="churn-*"
+            ),
+            ["churn-b"],
+        )
+
+    @mock.patch("mldeploy.mldeploy_functions._get_registry_data")
+    def test_select_projects_missing(self, mock_reg):
+        """
+        Tests that an unknown project name exits.
+        """
+        mock_reg.return_value = self.reg_data
+        with mock.patch("sys.stdout"):
+            with self.assertRaises(SystemExit):
+                mldeploy_functions._select_projects(["x"])
+
+
+class TestRunStackJobs(TestCase):
+    """
+    Test case for 'mldeploy.mldeploy_functions._run_stack_jobs'.
+    """
+
+    @mock.patch("mldeploy.mldeploy_functions._check_project_config")
+    @mock.patch("mldeploy.mldeploy_functions._RegistryTransaction.commit")
+    def test_registry_committed_when_interrupted(self, mock_commit, mock_check):
+        """
+        Tests that changes are committed after each stack and again when
+        the run is interrupted.
+        """
+
+        def operation(name, txn):
+            txn.set_field(name, "deployment_status", "Deployed")
+            return True
+
+        def interrupted(names, job, jobs, verb):
+            for n in names:
+                job(n)
+            raise KeyboardInterrupt()
+
+        with mock.patch(
+            "mldeploy.mldeploy_functions._run_project_jobs", side_effect=interrupted
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                mldeploy_functions._run_stack_jobs(
+                    ["p1", "p2"], operation, 2, "Deploying"
+                )
+        self.assertEqual(mock_commit.call_count, 3)
+
+
+class TestRunProjectJobs(TestCase):
+    """
+    Test case for 'mldeploy.mldeploy_functions._run_project_jobs'.
+    """
+
+    def test_run_project_jobs(self):
+        """
+        Tests bounded concurrency, buffered output and failure reporting.
+        """
+        lock = threading.Lock()
+        running = {"now": 0, "max": 0}
+
+        def job(name):
+            with lock:
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            print(f"working on {name}")
+            time.sleep(0.05)
+            with lock:
+                running["now"] -= 1
+            if name == "bad":
+                raise ValueError("broken config")
+            return "built"
+
+        names = ["p1", "bad", "p2", "p3", "p4"]
+        with mock.patch("sys.stdout"):
+            results = mldeploy_functions._run_project_jobs(names, job, 2, "Building")
+        self.assertEqual([r["name"] for r in results], names)
+        self.assertLessEqual(running["max"], 2)
+        self.assertEqual(results[0]["outcome"], "built")
+        self.assertEqual(results[0]["output"], "working on p1\n")
+        self.assertFalse(results[1]["ok"])
+        self.assertEqual(results[1]["outcome"], "failed: broken config")
+
+
+class TestUpdate(TestCase):
+    """
+    Test case for 'mldeploy.mldeploy_functions.update'.
+    """
+
+    @mock.patch("mldeploy.mldeploy_functions._check_project_config")
+    @mock.patch(
+        "mldeploy.mldeploy_functions._check_for_project_name_and_exists",
+        return_value="proj",
+    )
+    @mock.patch("mldeploy.aws._update_stack", side_effect=ValueError("failed"))
+    def test_update_failure_exits(self, mock_update, mock_name, mock_check):
+        """
+        Tests that a failed update prints the error and exits with status 1.
+        """
+        with mock.patch("sys.stdout"):
+            with self.assertRaises(SystemExit) as cm:
+                mldeploy_functions.update("proj")
+        self.assertEqual(cm.exception.code, 1)
+
+
+class TestDeploy(TestCase):
+    """
+    Test case for 'mldeploy.mldeploy_functions.deploy' and 'undeploy'.
+    """
+
+    @mock.patch("mldeploy.mldeploy_functions._check_project_config")
+    @mock.patch(
+        "mldeploy.mldeploy_functions._check_for_project_name_and_exists",
+        return_value="proj",
+    )
+    @mock.patch("mldeploy.aws._undeploy_stack", return_value=False)
+    @mock.patch("mldeploy.aws._deploy_stack", return_value=False)
+    def test_failed_stack_exits(
+        self, mock_deploy, mock_undeploy, mock_name, mock_check
+    ):
+        """
+        Tests that a single project whose stack fails exits with status 1.
+        """
+        for command in [mldeploy_functions.deploy, mldeploy_functions.undeploy]:
+            with mock.patch("sys.stdout"):
+                with self.assertRaises(SystemExit) as cm:
+                    command("proj")
+            self.assertEqual(cm.exception.code, 1)
+
+
+class TestBuild(TestCase):
+    """
+    Test case for 'mldeploy.mldeploy_functions.build'.
+    """
+
+    @mock.patch("mldeploy.mldeploy_functions._check_project_config")
+    @mock.patch(
+        "mldeploy.mldeploy_functions._check_for_project_name_and_exists",
+        return_value="proj",
+    )
+    @mock.patch(
+        "mldeploy.docker_tools._build_or_get_image",
+        side_effect=ValueError("Build context is too large"),
+    )
+    def test_build_failure_exits(self, mock_build, mock_name, mock_check):
+        """
+        Tests that a failed build prints the error and exits with status 1.
+        """
+        with mock.patch("sys.stdout", io.StringIO()) as stdout:
+            with self.assertRaises(SystemExit) as cm:
+                mldeploy_functions.build("proj")
+        self.assertEqual(cm.exception.code, 1)
+        self.assertIn("Build context is too large", stdout.getvalue())
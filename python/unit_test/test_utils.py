@@ -11,9 +11,12 @@
 # Imports.
 # -----------------------------------------------------------------------------
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import io
+import json
 import os
 import pathlib
+import tempfile
 from unittest import mock, TestCase
 
 import sys
@@ -23,6 +26,49 @@ sys.path.insert(0, mld_path + "/mldeploy/")
 import utils
 
 
+# =============================================================================
+# Unit tests for Tracing utilities.
+# -----------------------------------------------------------------------------
+class TestTracing(TestCase):
+    """
+    Test case for the 'mldeploy.utils' tracing functions.
+    """
+
+    def tearDown(self):
+        utils._stop_tracing()
+
+    def test_trace_span_disabled(self):
+        """
+        Tests that nothing is recorded while tracing is disabled.
+        """
+        utils._stop_tracing()
+        self.assertIs(utils._trace_span("a"), utils._NULL_SPAN)
+        with utils._trace_span("a"):
+            pass
+        self.assertEqual(utils._stop_tracing(), [])
+
+    def test_trace_span_nested(self):
+        """
+        Tests that nested spans are recorded and summarized.
+        """
+
+        @utils._traced("inner")
+        def inner():
+            return 1
+
+        utils._start_tracing()
+        with utils._trace_span("outer", project="proj"):
+            inner()
+            inner()
+        events = utils._stop_tracing()
+        self.assertEqual([e["name"] for e in events], ["inner", "inner", "outer"])
+        self.assertEqual(events[-1]["args"], {"project": "proj"})
+        self.assertTrue(all(e["ph"] == "X" for e in events))
+        summary = utils._get_trace_summary(events)
+        self.assertEqual(summary.splitlines()[2].split()[:2], ["outer", "1"])
+        self.assertEqual(summary.splitlines()[3].split()[:2], ["inner", "2"])
+
+
 # =============================================================================
 # Unit tests for Registry utilities.
 # -----------------------------------------------------------------------------
@@ -112,6 +158,224 @@ class TestGetRegistryData(TestCase):
         mock_load.return_value = sample_reg_data
         self.assertEqual(utils._get_registry_data(), {})
 
+    def test_get_registry_data_cache_hit(self):
+        """
+        Tests that an unchanged registry file is only parsed once.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reg_path = tmp_dir + "/.registry.json"
+            with open(reg_path, "w") as f:
+                json.dump({"proj": {"location": "/a"}}, f)
+            with mock.patch("utils._get_registry_path", return_value=reg_path):
+                utils._clear_registry_cache()
+                before = utils._get_registry_cache_stats()
+                for i in range(5):
+                    data = utils._get_registry_data()
+                after = utils._get_registry_cache_stats()
+        self.assertEqual(data, {"proj": {"location": "/a"}})
+        self.assertEqual(after["parses"] - before["parses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 4)
+
+    def test_get_registry_data_cache_invalidated(self):
+        """
+        Tests that a write by another process is picked up.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reg_path = tmp_dir + "/.registry.json"
+            with open(reg_path, "w") as f:
+                json.dump({"proj": {}}, f)
+            with mock.patch("utils._get_registry_path", return_value=reg_path):
+                utils._clear_registry_cache()
+                utils._get_registry_data()
+                # Simulate another process writing the file.
+                with open(reg_path, "w") as f:
+                    json.dump({"proj": {}, "other": {}}, f)
+                data = utils._get_registry_data()
+        self.assertEqual(set(data.keys()), {"proj", "other"})
+
+    def test_write_registry_data_refreshes_cache(self):
+        """
+        Tests that writing through the registry layer does not cause
+        the file to be parsed again.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reg_path = tmp_dir + "/.registry.json"
+            with mock.patch("utils._get_registry_path", return_value=reg_path):
+                utils._clear_registry_cache()
+                utils._write_registry_data({"proj": {}})
+                before = utils._get_registry_cache_stats()
+                data = utils._get_registry_data()
+                after = utils._get_registry_cache_stats()
+        self.assertEqual(data, {"proj": {}})
+        self.assertEqual(after["parses"], before["parses"])
+
+
+class TestSqliteRegistryBackend(TestCase):
+    """
+    Test case for the SQLite registry backend used through the
+    'mldeploy.utils' registry functions.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        for patcher in [
+            mock.patch.dict(
+                os.environ, {utils._get_constant("REG_BACKEND_ENV_VAR"): "sqlite"}
+            ),
+            mock.patch("utils._get_appdata_folder", return_value=self.tmp_dir.name),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        utils._clear_registry_cache()
+        self.addCleanup(utils._clear_registry_cache)
+
+    def test_migrates_json_registry(self):
+        """
+        Tests that an existing JSON registry is imported once.
+        """
+        json_path = self.tmp_dir.name + "/" + utils._get_constant("REG_FILE_NAME")
+        with open(json_path, "w") as f:
+            json.dump({"proj": {"location": "/a", "deployment_status": "Deployed"}}, f)
+        self.assertEqual(utils._get_registry_data()["proj"]["location"], "/a")
+        self.assertTrue(utils._get_registry_path().endswith(".registry.db"))
+        # Changes to the JSON file after migration are not imported again.
+        with open(json_path, "w") as f:
+            json.dump({"other": {}}, f)
+        utils._clear_registry_cache()
+        self.assertEqual(list(utils._get_registry_data().keys()), ["proj"])
+
+    def test_add_field_and_find(self):
+        """
+        Tests single project updates and indexed lookups.
+        """
+        utils._initialize_registry()
+        utils._write_registry_data(
+            {
+                "proj1": {"deployment_status": "Not deployed"},
+                "proj2": {"deployment_status": "Not deployed"},
+            }
+        )
+        utils._add_field_to_registry("proj2", "deployment_status", "Deployed")
+        utils._add_field_to_registry("proj1", "docker-image", "proj1_mldeploy:1")
+        utils._clear_registry_cache()
+        self.assertEqual(
+            utils._find_projects("deployment_status", "Deployed"), ["proj2"]
+        )
+        self.assertEqual(
+            utils._find_projects("docker-image", "proj1_mldeploy:1"), ["proj1"]
+        )
+        self.assertEqual(
+            utils._get_field_if_exists("proj1", "docker-image"), "proj1_mldeploy:1"
+        )
+
+    def test_single_project_access(self):
+        """
+        Tests that field reads, updates and lookups of single projects do
+        not load the full registry.
+        """
+        utils._initialize_registry()
+        utils._write_registry_data({f"proj{i}": {"location": "/a"} for i in range(50)})
+        utils._clear_registry_cache()
+        before = utils._get_registry_cache_stats()["parses"]
+        utils._add_field_to_registry("proj7", "stack_name", "s7")
+        self.assertEqual(utils._get_field_if_exists("proj7", "stack_name"), "s7")
+        self.assertEqual(utils._find_projects("stack_name", "s7"), ["proj7"])
+        self.assertIsNone(utils._get_registry_project("missing"))
+        self.assertEqual(utils._get_registry_cache_stats()["parses"], before)
+        # A cached registry is kept up to date by single project writes.
+        self.assertEqual(len(utils._get_registry_data()), 50)
+        utils._add_field_to_registry("proj8", "stack_name", "s8")
+        self.assertEqual(utils._get_registry_data()["proj8"]["stack_name"], "s8")
+        self.assertEqual(utils._get_registry_cache_stats()["parses"], before + 1)
+
+    def test_delete_project(self):
+        """
+        Tests that projects missing from the written data are deleted.
+        """
+        utils._write_registry_data({"proj1": {}, "proj2": {}})
+        utils._write_registry_data({"proj2": {}}, changed=["proj1"])
+        utils._clear_registry_cache()
+        self.assertEqual(utils._get_registry_data(), {"proj2": {}})
+
+
+class TestRegistryTransaction(TestCase):
+    """
+    Test case for 'mldeploy.utils._registry_transaction'.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        folder = mock.patch("utils._get_appdata_folder", return_value=self.tmp_dir.name)
+        folder.start()
+        self.addCleanup(folder.stop)
+        utils._clear_registry_cache()
+        self.addCleanup(utils._clear_registry_cache)
+        utils._initialize_registry()
+
+    def test_transaction_single_write(self):
+        """
+        Tests that all changes in a transaction are committed together.
+        """
+        with utils._registry_transaction() as txn:
+            txn.add_project("proj", {"location": "/a"})
+            txn.set_field("proj", "stack_name", "s")
+            txn.set_field("proj", "stack_id", "id")
+        with mock.patch("utils._write_registry_data") as mock_write:
+            with utils._registry_transaction() as txn:
+                txn.set_field("proj", "stack_name", "s2")
+                txn.set_field("proj", "stack_id", "id2")
+        self.assertEqual(mock_write.call_count, 1)
+        self.assertEqual(
+            utils._get_registry_data()["proj"],
+            {"location": "/a", "stack_name": "s", "stack_id": "id"},
+        )
+
+    def test_transaction_not_committed_on_error(self):
+        """
+        Tests that nothing is written when the block raises.
+        """
+        with self.assertRaises(RuntimeError):
+            with utils._registry_transaction() as txn:
+                txn.add_project("proj", {})
+                raise RuntimeError()
+        self.assertEqual(utils._get_registry_data(), {})
+
+    def test_commit_skips_missing_project(self):
+        """
+        Tests that a field set on a removed project does not drop the
+        changes to other projects, and that 'commit' empties the transaction.
+        """
+        with utils._registry_transaction() as txn:
+            txn.add_project("proj", {})
+        txn = utils._RegistryTransaction()
+        txn.set_field("gone", "stack_name", "s")
+        txn.set_field("proj", "stack_name", "s2")
+        txn.commit()
+        self.assertEqual(txn.changes, [])
+        self.assertEqual(utils._get_registry_data(), {"proj": {"stack_name": "s2"}})
+
+    def test_concurrent_updates_not_lost(self):
+        """
+        Tests that concurrent updates to different projects are all kept.
+        """
+        names = [f"proj{i}" for i in range(20)]
+        with utils._registry_transaction() as txn:
+            for n in names:
+                txn.add_project(n, {})
+
+        def update(n):
+            for i in range(5):
+                utils._add_field_to_registry(n, f"field{i}", n)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(update, names))
+        utils._clear_registry_cache()
+        reg_data = utils._get_registry_data()
+        for n in names:
+            self.assertEqual(len(reg_data[n]), 5)
+
 
 class TestAddFieldToRegistry(TestCase):
     """
@@ -206,6 +470,88 @@ class TestGetConfigData(TestCase):
         self.assertEqual(utils._get_config_data("proj"), test_result)
 
 
+class TestLoadYamlCached(TestCase):
+    """
+    Test case for 'mldeploy.utils._load_yaml_cached' function.
+    """
+
+    def test_load_yaml_cached(self):
+        """
+        Tests that an unchanged file is parsed once and a changed
+        file is parsed again.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file = tmp_dir + "/config.yml"
+            with open(config_file, "w") as f:
+                f.write("base-image: python:3.8\nmin-instances: 1  # comment\n")
+            loader = utils._get_yaml_loader("safe")
+            with mock.patch.object(loader, "load", wraps=loader.load) as mock_load:
+                first = utils._load_yaml_cached(config_file)
+                second = utils._load_yaml_cached(config_file)
+                self.assertEqual(mock_load.call_count, 1)
+                with open(config_file, "w") as f:
+                    f.write("base-image: python:3.9\n")
+                third = utils._load_yaml_cached(config_file)
+                self.assertEqual(mock_load.call_count, 2)
+        self.assertIs(first, second)
+        self.assertEqual(type(first), dict)
+        self.assertEqual(first, {"base-image": "python:3.8", "min-instances": 1})
+        self.assertEqual(third, {"base-image": "python:3.9"})
+
+
+class TestProjectConfig(TestCase):
+    """
+    Test case for 'mldeploy.utils._ProjectConfig' and
+    'mldeploy.utils._get_project_config'.
+    """
+
+    def test_default_config_template_is_valid(self):
+        """
+        Tests that the shipped configuration template validates.
+        """
+        template = utils._get_constant("TEMPLATES_FOLDER") + "/default_config.yml"
+        config = utils._ProjectConfig(utils._load_yaml_cached(template))
+        self.assertEqual(config.base_image, "python:3.8-slim-buster")
+        self.assertEqual(config.add_files, [])
+        self.assertTrue(config.use_autoscaling)
+        self.assertEqual(config.min_ram, 1.0)
+        self.assertFalse(hasattr(config, "__dict__"))
+
+    def test_max_instances_less_than_min(self):
+        """
+        Tests that 'max-instances' < 'min-instances' is rejected.
+        """
+        with self.assertRaises(ValueError) as cm:
+            utils._ProjectConfig(
+                {"base-image": "b", "min-instances": 3, "max-instances": 2}
+            )
+        self.assertIn("max-instances", str(cm.exception))
+
+    def test_all_errors_reported(self):
+        """
+        Tests that every problem is reported in one error.
+        """
+        with self.assertRaises(ValueError) as cm:
+            utils._ProjectConfig({"min-instances": "many", "deployment-type": "lambda"})
+        msg = str(cm.exception)
+        self.assertIn("base-image", msg)
+        self.assertIn("min-instances", msg)
+        self.assertIn("deployment-type", msg)
+
+    @mock.patch("utils._get_config_data")
+    def test_get_project_config_compiled_once(self, mock_conf):
+        """
+        Tests that the config is only compiled again when the parsed
+        data changes.
+        """
+        mock_conf.return_value = {"base-image": "b", "add-files": ["/a", None]}
+        first = utils._get_project_config("proj")
+        self.assertIs(utils._get_project_config("proj"), first)
+        self.assertEqual(first.add_files, ["/a"])
+        mock_conf.return_value = {"base-image": "c"}
+        self.assertEqual(utils._get_project_config("proj").base_image, "c")
+
+
 # =============================================================================
 # Unit tests for Docker image handling utilities.
 # -----------------------------------------------------------------------------
@@ -287,12 +633,11 @@ class TestDeleteDockerImage(TestCase):
         # Image in list.
         mock_client = mock_env.return_value
 
-        class ImTags:
-            def __init__(self):
-                self.tags = ("no_reg_image", 1)
-
-        mock_client.images.list.return_value = [ImTags()]
+        mock_client.images.get.side_effect = utils.docker.errors.ImageNotFound(
+            "no_reg_image"
+        )
         utils._delete_docker_image(proj_name, deleting_project=del_proj)
+        self.assertFalse(mock_client.images.remove.called)
         expected_output = (
             f"{utils._get_constant('FAIL_PREFIX')}Project image '{reg_im}' not found.\n"
         )
@@ -326,13 +671,9 @@ class TestDeleteDockerImage(TestCase):
         # Image in list.
         mock_client = mock_env.return_value
         mock_client.images.remove.return_value = None
-
-        class ImTags:
-            def __init__(self):
-                self.tags = ("reg_image", 1)
-
-        mock_client.images.list.return_value = [ImTags()]
         utils._delete_docker_image(proj_name, deleting_project=del_proj)
+        mock_client.images.get.assert_called_once_with(reg_im)
+        self.assertFalse(mock_client.images.list.called)
         expected_output = f"{utils._get_constant('MSG_PREFIX')}Deleting existing project image: {reg_im}\n"
         self.assertEqual(mock_stdout.getvalue(), expected_output)
 
@@ -461,159 +802,33 @@ class TestDeleteDockerImage(TestCase):
 
 
 # =============================================================================
-# Unit tests for File handling utilities.
+# Unit tests for Content hashing utilities.
 # -----------------------------------------------------------------------------
-class TestTempCopyLocalFiles(TestCase):
-    """
-    Test case for 'mldeploy.utils._temp_copy_local_files' function.
-    """
-
-    @mock.patch("utils._get_project_folder")
-    @mock.patch("utils._get_config_data", return_value={})
-    def test_temp_copy_local_files_test_1(self, mock_conf, mock_folder):
-        """
-        Test config:
-            - 'add-files' not in 'conf_data'
-        """
-        result = utils._temp_copy_local_files("proj")
-        self.assertEqual(result, None)
-        self.assertFalse(mock_folder.called)
-
-    @mock.patch("utils._get_project_folder")
-    @mock.patch("utils._get_config_data", return_value={"add-files": None})
-    def test_temp_copy_local_files_test_2(self, mock_conf, mock_folder):
-        """
-        Test config:
-            - 'add-files' in 'conf_data'
-            - 'add_files' value is None
-        """
-        result = utils._temp_copy_local_files("proj")
-        self.assertEqual(result, None)
-        self.assertFalse(mock_folder.called)
-
-    @mock.patch("utils.os.mkdir")
-    @mock.patch("utils.shutil.copytree")
-    @mock.patch("utils.os.path.isdir", return_value=True)
-    @mock.patch("utils.os.path.exists", return_value=False)
-    @mock.patch("utils._get_project_folder", return_value="/my/proj")
-    @mock.patch("utils._get_config_data")
-    def test_temp_copy_local_files_test_3(
-        self, mock_conf, mock_folder, mock_exists, mock_isdir, mock_copytree, mock_mkdir
-    ):
-        """
-        Test config:
-            - 'add-files' in 'conf_data'
-            - 'add-files' has list of files
-            - 'dst' path does not exist
-            - source path is directory
-        """
-        mock_conf.return_value = {"add-files": ["hello.py"]}
-        utils._temp_copy_local_files("proj")
-        self.assertTrue(mock_mkdir.called)
-        self.assertTrue(mock_folder.called)
-        self.assertTrue(mock_isdir.called)
-        self.assertTrue(mock_copytree.called)
-
-    @mock.patch("utils.shutil.copy")
-    @mock.patch("utils.os.path.isfile", return_value=True)
-    @mock.patch("utils.os.mkdir")
-    @mock.patch("utils.shutil.copytree")
-    @mock.patch("utils.os.path.isdir", return_value=False)
-    @mock.patch("utils.os.path.exists", return_value=True)
-    @mock.patch("utils._get_project_folder", return_value="/my/proj")
-    @mock.patch("utils._get_config_data")
-    def test_temp_copy_local_files_test_4(
-        self,
-        mock_conf,
-        mock_folder,
-        mock_exists,
-        mock_isdir,
-        mock_copytree,
-        mock_mkdir,
-        mock_isfile,
-        mock_copy,
-    ):
-        """
-        Test config:
-            - 'add-files' in 'conf_data'
-            - 'add-files' has list of files
-            - 'dst' path exists
-            - source path is file
-        """
-        mock_conf.return_value = {"add-files": ["hello.py"]}
-        utils._temp_copy_local_files("proj")
-        self.assertFalse(mock_mkdir.called)
-        self.assertTrue(mock_folder.called)
-        self.assertTrue(mock_isdir.called)
-        self.assertFalse(mock_copytree.called)
-        self.assertTrue(mock_copy.called)
-
-    @mock.patch("utils.shutil.copy")
-    @mock.patch("utils.os.path.isfile", return_value=False)
-    @mock.patch("utils.os.mkdir")
-    @mock.patch("utils.shutil.copytree")
-    @mock.patch("utils.os.path.isdir", return_value=False)
-    @mock.patch("utils.os.path.exists", return_value=True)
-    @mock.patch("utils._get_project_folder", return_value="/my/proj")
-    @mock.patch("utils._get_config_data")
-    def test_temp_copy_local_files_test_5(
-        self,
-        mock_conf,
-        mock_folder,
-        mock_exists,
-        mock_isdir,
-        mock_copytree,
-        mock_mkdir,
-        mock_isfile,
-        mock_copy,
-    ):
-        """
-        Test config:
-            - 'add-files' in 'conf_data'
-            - 'add-files' has list of files
-            - 'dst' path exists
-            - source path is file
-        """
-        mock_conf.return_value = {"add-files": ["hello.py"]}
-        with self.assertRaises(ValueError) as cm:
-            utils._temp_copy_local_files("proj")
-        exc = cm.exception
-        self.assertEqual(exc.__class__, ValueError)
-        self.assertFalse(mock_mkdir.called)
-        self.assertTrue(mock_folder.called)
-        self.assertTrue(mock_isdir.called)
-        self.assertFalse(mock_copytree.called)
-        self.assertFalse(mock_copy.called)
-
-
-class TestRemoveTempFiles(TestCase):
+class TestGetTreeDigest(TestCase):
     """
-    Test case for 'mldeploy.utils._remove_temp_files' function.
+    Test case for 'mldeploy.utils._get_tree_digest' function.
     """
 
-    @mock.patch("utils._get_project_folder", return_value="/my/proj")
-    @mock.patch("utils.os.path.exists", return_value=False)
-    @mock.patch("utils.shutil.rmtree")
-    def test_remove_temp_files_exists(self, mock_rmtree, mock_exists, mock_folder):
+    def test_get_tree_digest(self):
         """
-        Test config:
-            - path exists
-        """
-        utils._remove_temp_files("proj")
-        self.assertFalse(mock_rmtree.called)
-
-    @mock.patch("utils._get_project_folder", return_value="/my/proj")
-    @mock.patch("utils.os.path.exists", return_value=True)
-    @mock.patch("utils.shutil.rmtree")
-    def test_remove_temp_files_does_not_exist(
-        self, mock_rmtree, mock_exists, mock_folder
-    ):
+        Tests that the digest covers file contents and names, and that
+        unchanged files are not read again.
         """
-        Test config:
-            - path exists
-        """
-        utils._remove_temp_files("proj")
-        self.assertTrue(mock_rmtree.called)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(tmp_dir + "/sub")
+            with open(tmp_dir + "/sub/a.txt", "w") as f:
+                f.write("a")
+            first = utils._get_tree_digest(tmp_dir)
+            with mock.patch("utils.hashlib.sha256", wraps=utils.hashlib.sha256) as m:
+                self.assertEqual(utils._get_tree_digest(tmp_dir), first)
+                # Only the folder digest is computed, the file is cached.
+                self.assertEqual(m.call_count, 1)
+            os.rename(tmp_dir + "/sub/a.txt", tmp_dir + "/sub/b.txt")
+            second = utils._get_tree_digest(tmp_dir)
+            with open(tmp_dir + "/sub/b.txt", "w") as f:
+                f.write("bb")
+            third = utils._get_tree_digest(tmp_dir)
+        self.assertEqual(len({first, second, third}), 3)
 
 
 # =============================================================================
@@ -704,3 +919,30 @@ class TestGetRegistryLists(TestCase):
         print(correct_result)
         print(test_result)
         self.assertEqual(test_result, correct_result)
+
+
+class TestGetSlowestBuildSteps(TestCase):
+    """
+    Test case for 'mldeploy.utils._get_slowest_build_steps' function.
+    """
+
+    def test_slowest_build_steps(self):
+        """
+        Tests that steps are returned slowest first and the summary
+        record is skipped.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = tmp_dir + "/log.jsonl"
+            with open(path, "w") as f:
+                for i, seconds in enumerate([1.0, 30.0, 5.0]):
+                    step = {"type": "step", "step": f"{i+1}/3", "seconds": seconds}
+                    f.write(json.dumps(step) + "\n")
+                f.write(json.dumps({"type": "build", "seconds": 36.0}) + "\n")
+            result = utils._get_slowest_build_steps(path, count=2)
+        self.assertEqual([s["step"] for s in result], ["2/3", "3/3"])
+
+    def test_slowest_build_steps_missing_log(self):
+        """
+        Tests that a missing log gives no steps.
+        """
+        self.assertEqual(utils._get_slowest_build_steps("/no/such/log.jsonl"), [])